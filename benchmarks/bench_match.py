@@ -0,0 +1,48 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import fnmatch
+import random
+import re
+import ipaddress
+from benchmarks.common import use_config, measure
+
+use_config()
+
+from pokiestream.components.match import matcher
+from pokiestream.components.dns import DomainSet, parse_query_name
+from scapy.layers.dns import DNS, DNSQR
+
+# a random domain name with the given number of labels
+def random_domain(rng, labels):
+    return ".".join("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randrange(3, 10))) for _ in range(labels - 1)) + rng.choice((".com", ".net", ".org", ".hu"))
+
+def main(count=200000):
+    rng = random.Random(1)
+    pairs = []
+    for _ in range(count):
+        src = str(ipaddress.IPv4Address(rng.getrandbits(32)))
+        dst = str(ipaddress.IPv4Address((10 << 24) | rng.getrandbits(24)))
+        pairs.append((src, dst) if rng.random() < 0.5 else (dst, src))
+
+    ports = [(rng.randrange(65536),) for _ in range(count)]
+
+    print(f"match_hosts: {measure(matcher.match_hosts, pairs):,.0f} pps")
+    print(f"match_port:  {measure(matcher.match_port, ports):,.0f} pps")
+
+    # the DNS payload filter with a blocklist sized domain list, half of the queries are below a listed domain
+    domains = [random_domain(rng, 2) for _ in range(50000)]
+    patterns = domains[:25000] + [f"*.{domain}" for domain in domains[25000:]]
+    queries = [random_domain(rng, 3) if rng.random() < 0.5 else f"www.{rng.choice(domains)}" for _ in range(count // 10)]
+    messages = [(bytes(DNS(id=1, rd=1, qd=DNSQR(qname=query))), 0) for query in queries[:count // 20]]
+
+    domain_set = DomainSet(patterns)
+    print(f"parse_query_name: {measure(parse_query_name, messages):,.0f} pps")
+    print(f"dns match ({len(patterns):,} domains): {measure(domain_set.match, [(query,) for query in queries]):,.0f} pps")
+
+    # the single regex of all patterns which was used before, only measured with fewer domains as it is too slow
+    regex = re.compile("|".join(f"(?:{fnmatch.translate(pattern)})" for pattern in patterns[:1000:10] + patterns[25000:26000:10]))
+    print(f"dns regex match (200 domains): {measure(regex.match, [(query,) for query in queries[:count // 100]]):,.0f} pps")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import gc
+import time
+import tracemalloc
+import ipaddress
+from benchmarks.common import use_config, discard_events, measure
+
+use_config()
+
+from pokiestream.components.udp import UDPSessionManager, UDP_IDLE_TIMEOUT
+from pokiestream.components.tcp import TCPSessionManager
+
+def flows(count):
+    server = int(ipaddress.IPv4Address("192.168.1.1"))
+    return [(4, 0x0A000000 + i // 1000, 1024 + i % 1000, server, 53) for i in range(count)]
+
+# measures the memory used by the session table per tracked flow
+def memory_per_flow(manager, track, items):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for item in items:
+        track(*item)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(manager)
+
+# measures how fast the timing wheel finds the expired sessions
+def expiry_rate(items):
+    manager = UDPSessionManager()
+    for item in items:
+        manager.track_session_sync(*item)
+
+    now = time.time() + UDP_IDLE_TIMEOUT + 1
+    start = time.perf_counter()
+    expired = sum(len(shard.timers.advance(now)) for shard in manager.shards)
+    return expired / (time.perf_counter() - start)
+
+def main(count=200000):
+    discard_events()
+    items = flows(count)
+
+    udp = UDPSessionManager()
+    print(f"udp memory per flow: {memory_per_flow(udp, udp.track_session_sync, items):.0f} bytes")
+    print(f"udp refresh: {measure(udp.track_session_sync, items):,.0f} pps")
+
+    print(f"udp expiry: {expiry_rate(items):,.0f} sessions/s")
+
+    tcp = TCPSessionManager()
+    syns = [item + (0x02,) for item in items]
+    print(f"tcp memory per flow: {memory_per_flow(tcp, tcp.track_session_sync, syns):.0f} bytes")
+
+    limited = UDPSessionManager(max_sessions=count // 2)
+    limited_items = flows(count)
+    print(f"udp new flows with eviction: {measure(limited.track_session_sync, limited_items, repeat=1):,.0f} pps ({limited.evicted()} evicted)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+# the plugins and the components they use don't read the config, so no bench config is needed
+from pokiestream.components.event import Event
+from pokiestream.components.plugin_process import load_python_receivers
+
+PLUGINS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins")
+
+def events(count):
+    start = time.time_ns()
+    return [
+        Event(4, 0x0A000000 + i % 5000, 0xC0A80101, 1024 + i % 60000, 53, 17, "UDP", "NEW" if i % 3 else "ESTABLISHED", start + i * 1000, (i % 5000) << 64 | i,
+              {"dns": f"host{i % 100}.example.com"} if i % 4 == 0 else None)
+        for i in range(count)
+    ]
+
+# A stub InfluxDB server: answers every write with 204 and counts the lines it received.
+class StubInflux:
+    def __init__(self):
+        self.lines = 0
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in request.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                body = await reader.readexactly(length)
+                self.lines += body.count(b"\n") + 1
+                self.requests += 1
+                writer.write(b"HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+# delivers the events in batches with `workers` concurrent writers and returns the events per second
+async def deliver(receiver_batch, config, items, batch_size, workers):
+    batches = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+    # the first batch connects (and creates the table), it is not measured
+    await receiver_batch(batches[0], config)
+
+    pending = iter(batches[1:])
+    async def worker():
+        for batch in pending:
+            await receiver_batch(batch, config)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return sum(len(batch) for batch in batches[1:]) / (time.perf_counter() - start)
+
+async def bench_influx(items, batch_size, workers):
+    stub = StubInflux()
+    server = await asyncio.start_server(stub.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    config = SimpleNamespace(influxdb=SimpleNamespace(url=f"http://127.0.0.1:{port}", pool_size=workers, max_in_flight=workers))
+
+    _, receiver_batch = load_python_receivers(os.path.join(PLUGINS, "influxdb.py"))
+    rate = await deliver(receiver_batch, config, items, batch_size, workers)
+    for connection in sys.modules["influxdb"].idle:
+        connection.close()
+    # lets the server see the connections closing before the loop ends
+    await asyncio.sleep(0.1)
+    server.close()
+    await server.wait_closed()
+    print(f"influxdb (stub server): {rate:,.0f} events/s ({stub.lines:,} lines in {stub.requests:,} requests)")
+
+async def bench_timescaledb(items, batch_size, workers, dsn):
+    for method in ("copy", "insert"):
+        table = f"pokiestream_bench_{method}"
+        config = SimpleNamespace(timescaledb=SimpleNamespace(dsn=dsn, table=table, method=method, pool_size=workers, max_in_flight=workers))
+        # every run loads a fresh copy of the plugin, the module keeps its pool in globals
+        _, receiver_batch = load_python_receivers(os.path.join(PLUGINS, "timescaledb.py"))
+        plugin = sys.modules["timescaledb"]
+
+        async with plugin.asyncpg.create_pool(dsn, min_size=1, max_size=1) as pool:
+            await pool.execute(f"DROP TABLE IF EXISTS {table}")
+        rate = await deliver(receiver_batch, config, items, batch_size, workers)
+        await plugin.pool.close()
+        print(f"timescaledb {method}: {rate:,.0f} events/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the events/s of the database sink plugins")
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=1000, help="events per batch (batch.max_size)")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent batches (plugin.workers)")
+    parser.add_argument("--dsn", help="a PostgreSQL database to benchmark the timescaledb plugin with, its benchmark tables are dropped")
+    options = parser.parse_args()
+
+    items = events(options.events)
+    asyncio.run(bench_influx(items, options.batch, options.workers))
+    if options.dsn:
+        asyncio.run(bench_timescaledb(items, options.batch, options.workers, options.dsn))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import argparse
+import json
+import sys
+
+# Compares two result files of benchmarks.run, for example the results of two commits.
+# Exits with status 1 if a benchmark got slower than the threshold, so it can be used in CI.
+#
+#   python -m benchmarks.compare before.json after.json --threshold 0.1
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two PokieStream benchmark results")
+    parser.add_argument("before", help="The baseline result file")
+    parser.add_argument("after", help="The result file to compare with the baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="The relative throughput loss reported as a regression (default: 0.1)")
+    options = parser.parse_args()
+
+    before = load(options.before)
+    after = load(options.after)
+    print(f"before: {before['meta'].get('commit')}  after: {after['meta'].get('commit')}")
+
+    regressions = []
+    for name, result in after["results"].items():
+        baseline = before["results"].get(name)
+        if baseline is None:
+            print(f"{name:<16} {result['per_second']:>14,.0f}/s  (new)")
+            continue
+
+        change = result["per_second"] / baseline["per_second"] - 1
+        line = f"{name:<16} {baseline['per_second']:>14,.0f}/s -> {result['per_second']:>14,.0f}/s  {change:+7.1%}"
+        if "p99_ns" in result and "p99_ns" in baseline:
+            line += f"  p99 {baseline['p99_ns'] / 1000:.2f}us -> {result['p99_ns'] / 1000:.2f}us"
+        if change < -options.threshold:
+            line += "  REGRESSION"
+            regressions.append(name)
+        print(line)
+
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {options.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+# The benchmark suite of the packet pipeline.
+# Every benchmark reports its throughput and per item latency percentiles, the results can be written as JSON
+# and compared between versions with benchmarks.compare.
+#
+#   python -m benchmarks.run --json results.json
+#   python -m benchmarks.run --only sessions --flows 5000000
+
+BENCHMARKS = ("inspect_raw", "inspect_packets", "sessions", "queue", "spill", "plugins", "end_to_end")
+
+NOOP_PLUGIN = """
+import time
+
+received = []
+
+async def receiver(data):
+    received.append(time.perf_counter_ns())
+"""
+
+# the plugins of the plugin benchmark and the sink settings they are run with, every one of them only counts the events
+BENCH_PLUGINS = {
+    "python": ("py", {}, """
+received = 0
+
+async def receiver(data):
+    global received
+    received += 1
+"""),
+    "python_batch": ("py", {}, """
+received = 0
+
+async def receiver_batch(events):
+    global received
+    received += len(events)
+"""),
+    "lua": ("lua", {}, """
+received = 0
+
+function receiver(data)
+    received = received + 1
+end
+"""),
+    "lua_batch": ("lua", {}, """
+received = 0
+
+function receiver_batch(events)
+    received = received + #events
+end
+"""),
+    "python_processes": ("py", {"processes": 2}, """
+received = 0
+
+async def receiver_batch(events):
+    global received
+    received += len(events)
+"""),
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="PokieStream benchmark suite")
+    parser.add_argument("--packets", type=int, default=200000, help="Number of packets for the pipeline benchmarks (default: 200000)")
+    parser.add_argument("--scapy-packets", type=int, default=20000, help="Number of packets for the inspect_packets benchmark (default: 20000)")
+    parser.add_argument("--flows", type=int, default=1000000, help="Number of flows for the session manager benchmarks (default: 1000000)")
+    parser.add_argument("--pipeline-flows", type=int, default=10000, help="Number of flows in the generated traffic (default: 10000)")
+    parser.add_argument("--udp", type=float, default=0.6, help="Share of UDP flows (default: 0.6)")
+    parser.add_argument("--tcp", type=float, default=0.3, help="Share of TCP flows (default: 0.3)")
+    parser.add_argument("--icmp", type=float, default=0.1, help="Share of ICMP flows (default: 0.1)")
+    parser.add_argument("--dns", type=float, default=0.2, help="Share of DNS queries among the UDP flows (default: 0.2)")
+    parser.add_argument("--ipv6", type=float, default=0.1, help="Share of IPv6 flows (default: 0.1)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the traffic generator (default: 1)")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="Run only the given benchmarks")
+    parser.add_argument("--json", metavar="FILE", help="Write the results as JSON to FILE, - writes them to stdout")
+    return parser.parse_args()
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def traffic(options, flows, **overrides):
+    from benchmarks.traffic import TrafficGenerator
+    mix = {"udp": options.udp, "tcp": options.tcp, "icmp": options.icmp, "dns": options.dns, "ipv6": options.ipv6, "seed": options.seed}
+    mix.update(overrides)
+    return TrafficGenerator(flows=flows, **mix)
+
+# the raw decoder path, frames are decoded without scapy
+def bench_inspect_raw(options):
+    from benchmarks.common import discard_events, measure_latency
+    from pokiestream.components.packets import inspect_raw
+
+    discard_events()
+    frames = traffic(options, options.pipeline_flows, network="10.0.0.0/10").frames(options.packets)
+    return {"inspect_raw": measure_latency(inspect_raw, [(frame,) for frame in frames])}
+
+# the scapy decoder path, the dissection itself is not measured
+def bench_inspect_packets(options):
+    from scapy.layers.l2 import Ether
+    from benchmarks.common import discard_events, measure_latency
+    from pokiestream.components.packets import inspect_packets
+
+    discard_events()
+    frames = traffic(options, options.pipeline_flows, network="10.64.0.0/10").frames(options.scapy_packets)
+    return {"inspect_packets": measure_latency(inspect_packets, [(Ether(frame),) for frame in frames])}
+
+# the session managers with a large number of concurrent flows
+def bench_sessions(options):
+    from benchmarks.common import discard_events, measure_latency
+    from pokiestream.components.clock import clock
+    from pokiestream.components.sessions import session_ids
+    from pokiestream.components.udp import UDPSessionManager
+    from pokiestream.components.tcp import TCPSessionManager
+
+    discard_events()
+    results = {"session_ids": measure_latency(session_ids.next, [()] * options.flows)}
+
+    udp = UDPSessionManager()
+    flows = [flow.endpoints() for flow in traffic(options, options.flows, udp=1, tcp=0, icmp=0, dns=0).flows]
+    results["udp_new"] = measure_latency(udp.track_session_sync, flows)
+    results["udp_refresh"] = measure_latency(udp.track_session_sync, flows)
+
+    start = time.perf_counter()
+    udp.expire_sync(clock.time() + 3600)
+    results["udp_expire"] = {"items": len(flows), "per_second": len(flows) / (time.perf_counter() - start)}
+    del udp
+
+    tcp = TCPSessionManager()
+    flows = [flow.endpoints() for flow in traffic(options, options.flows, udp=0, tcp=1, icmp=0, dns=0).flows]
+    results["tcp_syn"] = measure_latency(tcp.track_session_sync, [flow + (0x02,) for flow in flows])
+    results["tcp_syn_ack"] = measure_latency(tcp.track_session_sync, [(version, dst, dst_port, src, src_port, 0x12) for version, src, src_port, dst, dst_port in flows])
+    results["tcp_ack"] = measure_latency(tcp.track_session_sync, [flow + (0x10,) for flow in flows])
+    results["tcp_fin"] = measure_latency(tcp.track_session_sync, [flow + (0x11,) for flow in flows])
+    return results
+
+# the handoff from the capture thread to the event loop through the janus queue
+def bench_queue(options):
+    from benchmarks.common import percentiles
+    from pokiestream.components.queue import async_queue
+
+    async def run(count):
+        queue = await async_queue()
+        samples = []
+
+        def produce():
+            for _ in range(count):
+                queue.sync_q.put(time.perf_counter_ns())
+
+        start = time.perf_counter()
+        producer = asyncio.create_task(asyncio.to_thread(produce))
+        for _ in range(count):
+            sent = await queue.async_q.get()
+            samples.append(time.perf_counter_ns() - sent)
+        await producer
+        elapsed = time.perf_counter() - start
+
+        result = {"items": count, "per_second": count / elapsed}
+        result.update({f"{name}_ns": value for name, value in percentiles(samples).items()})
+        return result
+
+    return {"queue_handoff": asyncio.run(run(options.packets))}
+
+# the disk spill of the overload policy, the events are encoded into the segment files and read back in order
+def bench_spill(options):
+    import shutil
+    from benchmarks.common import measure_latency
+    from pokiestream.components.clock import clock
+    from pokiestream.components.event import Event
+    from pokiestream.components.sessions import session_ids
+    from pokiestream.components.spill import Spill
+
+    flows = traffic(options, options.pipeline_flows, tcp=0, icmp=0).flows
+    events = []
+    for index in range(options.packets):
+        version, src, src_port, dst, dst_port = flows[index % len(flows)].endpoints()
+        events.append(Event(version, src, dst, src_port, dst_port, 17, "UDP", "NEW", clock.time_ns(), session_ids.next()))
+
+    directory = tempfile.mkdtemp(prefix="pokiestream-bench-spill-")
+    try:
+        spill = Spill(directory, 64 << 20, 1 << 40)
+        results = {"spill_write": measure_latency(spill.append, [(event,) for event in events])}
+        results["spill_write"]["bytes_per_event"] = sum(segment.write_offset for segment in spill.segments) / len(events)
+
+        start = time.perf_counter()
+        while len(spill):
+            spill.read(1000)
+        results["spill_read"] = {"items": len(events), "per_second": len(events) / (time.perf_counter() - start)}
+        spill.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+# the delivery of events from the queue to a python and a lua plugin, with and without receiver_batch, and to python plugin processes
+def bench_plugins(options, directory):
+    from pokiestream.components.clock import clock
+    from pokiestream.components.config import config
+    from pokiestream.components.consumer import process_queue
+    from pokiestream.components.event import Event
+    from pokiestream.components.queue import create_queue, put_data_to_queue
+    from pokiestream.components.sessions import session_ids
+
+    flows = traffic(options, options.pipeline_flows, tcp=0, icmp=0).flows
+    events = []
+    for index in range(options.packets):
+        version, src, src_port, dst, dst_port = flows[index % len(flows)].endpoints()
+        events.append(Event(version, src, dst, src_port, dst_port, 17, "UDP", "NEW", clock.time_ns(), session_ids.next()))
+
+    def produce():
+        for event in events:
+            put_data_to_queue(event)
+
+    async def run():
+        await create_queue('log_queue', "block")
+        start = time.perf_counter()
+        await process_queue(asyncio.create_task(asyncio.to_thread(produce)))
+        return time.perf_counter() - start
+
+    results = {}
+    sink = config.sinks[0]
+    configured = dict(vars(sink))
+    try:
+        for name, (extension, settings, code) in BENCH_PLUGINS.items():
+            vars(sink).update(configured, path=os.path.join(directory, f"pokiestream_bench_{name}.{extension}"), **settings)
+            with open(sink.path, "w") as f:
+                f.write(code)
+            elapsed = asyncio.run(run())
+            results[f"plugin_{name}"] = {"items": len(events), "per_second": len(events) / elapsed}
+    finally:
+        vars(sink).update(configured)
+    return results
+
+# from the raw frame to a no-op plugin, every frame is a new flow so it is delivered as exactly one event
+def bench_end_to_end(options, plugin_module):
+    from benchmarks.common import percentiles
+    from pokiestream.components.consumer import process_queue
+    from pokiestream.components.packets import inspect_raw
+    from pokiestream.components.queue import create_queue
+
+    frames = traffic(options, options.packets, udp=1, tcp=0, icmp=0, network="10.128.0.0/10").frames(options.packets)
+    sent = [0] * len(frames)
+
+    def produce():
+        clock = time.perf_counter_ns
+        for index, frame in enumerate(frames):
+            sent[index] = clock()
+            inspect_raw(frame)
+
+    async def run():
+        # every event must reach the plugin to measure its latency
+        await create_queue('log_queue', "block")
+        start = time.perf_counter()
+        await process_queue(asyncio.create_task(asyncio.to_thread(produce)))
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    received = sys.modules[plugin_module].received
+    samples = [done - begin for begin, done in zip(sent, received)]
+
+    result = {"items": len(received), "per_second": len(received) / elapsed}
+    result.update({f"{name}_ns": value for name, value in percentiles(samples).items()})
+    return {"end_to_end": result}
+
+def format_result(name, result):
+    line = f"{name:<20} {result['per_second']:>14,.0f}/s"
+    for key in ("p50_ns", "p99_ns", "p99.9_ns"):
+        if key in result:
+            line += f"  {key[:-3]} {result[key] / 1000:>8.2f}us"
+    return line
+
+def main():
+    options = parse_args()
+
+    from benchmarks.common import BENCH_CONFIG, use_config
+
+    # the end to end benchmark delivers the events to a no-op python plugin
+    plugin_dir = tempfile.mkdtemp(prefix="pokiestream-bench-")
+    plugin_path = os.path.join(plugin_dir, "pokiestream_bench_noop.py")
+    with open(plugin_path, "w") as f:
+        f.write(NOOP_PLUGIN)
+    use_config(BENCH_CONFIG + f'  plugin:\n    path: "{plugin_path}"\n')
+
+    selected = options.only or BENCHMARKS
+    results = {}
+    # the messages of pokiestream must not end up in the JSON output
+    with redirect_stdout(sys.stderr if options.json == "-" else sys.stdout):
+        for name in BENCHMARKS:
+            if name not in selected:
+                continue
+            if name == "end_to_end":
+                results.update(bench_end_to_end(options, "pokiestream_bench_noop"))
+            elif name == "plugins":
+                results.update(bench_plugins(options, plugin_dir))
+            else:
+                results.update(globals()[f"bench_{name}"](options))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.now(timezone.utc).isoformat(),
+            "python": f"{platform.python_implementation()} {platform.python_version()}",
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "parameters": vars(options)
+        },
+        "results": results
+    }
+
+    if options.json != "-":
+        for name, result in results.items():
+            print(format_result(name, result))
+
+    if options.json == "-":
+        print(json.dumps(report, indent=2))
+    elif options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import ipaddress
+import random
+import struct
+
+# Synthetic traffic generator for the benchmarks.
+# Builds raw ethernet frames for a fixed set of flows with a configurable protocol mix and DNS share,
+# the same seed always produces the same frames so the results are comparable between versions.
+
+ETHERNET = struct.Struct("!6s6sH")
+IPV4 = struct.Struct("!BBHHHBBH4s4s")
+IPV6 = struct.Struct("!IHBB16s16s")
+UDP_HEADER = struct.Struct("!HHHH")
+TCP_HEADER = struct.Struct("!HHIIBBHHH")
+ICMP_HEADER = struct.Struct("!BBHHH")
+DNS_HEADER = struct.Struct("!HHHHHH")
+
+CLIENT_MAC = b"\x02\x00\x00\x00\x00\x01"
+SERVER_MAC = b"\x02\x00\x00\x00\x00\x02"
+
+TCP_SYN = 0x02
+TCP_ACK = 0x10
+TCP_PSH = 0x08
+
+def checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+def dns_query(name, query_id):
+    question = b"".join(bytes([len(label)]) + label.encode() for label in name.split(".")) + b"\x00"
+    return DNS_HEADER.pack(query_id, 0x0100, 1, 0, 0, 0) + question + struct.pack("!HH", 1, 1)
+
+# a single flow, the client is always the initiator
+class Flow:
+    __slots__ = ("protocol", "version", "client", "server", "client_port", "server_port", "dns", "packets")
+
+    def __init__(self, protocol, version, client, server, client_port, server_port, dns=None):
+        self.protocol = protocol
+        self.version = version
+        self.client = client
+        self.server = server
+        self.client_port = client_port
+        self.server_port = server_port
+        self.dns = dns
+        self.packets = 0
+
+    # returns the (src_ip, src_port, dst_ip, dst_port) tuple of the client side
+    def addresses(self):
+        return str(ipaddress.ip_address(self.client)), self.client_port, str(ipaddress.ip_address(self.server)), self.server_port
+
+    # returns the (version, src, src_port, dst, dst_port) tuple of the client side with integer addresses, as the session managers take them
+    def endpoints(self):
+        return self.version, self.client, self.client_port, self.server, self.server_port
+
+class TrafficGenerator:
+    # udp, tcp and icmp are the shares of the flows, dns is the share of the UDP flows which are DNS queries
+    # the clients are allocated from `network`, so generators with different networks never share a flow
+    def __init__(self, flows=10000, udp=0.6, tcp=0.3, icmp=0.1, dns=0.2, ipv6=0.1, payload=64, network="10.0.0.0/8", seed=1):
+        rng = random.Random(seed)
+        network = ipaddress.ip_network(network)
+        network6 = ipaddress.ip_network("2001:db8::/32")
+        total = udp + tcp + icmp
+        self.payload = bytes(payload)
+        self.flows = []
+
+        for index in range(flows):
+            ipv6_flow = rng.random() < ipv6
+            if ipv6_flow:
+                client = int(network6.network_address) + 1 + index
+                server = int(network6.network_address) + (1 << 64) + rng.randrange(1 << 16)
+            else:
+                client = int(network.network_address) + 1 + index % (network.num_addresses - 2)
+                server = int(ipaddress.IPv4Address("192.168.0.0")) + rng.randrange(1 << 16)
+
+            kind = rng.random() * total
+            client_port = 1024 + rng.randrange(64512)
+            if kind < udp:
+                if rng.random() < dns:
+                    flow = Flow(17, 6 if ipv6_flow else 4, client, server, client_port, 53, dns=f"host{index}.example.com")
+                else:
+                    flow = Flow(17, 6 if ipv6_flow else 4, client, server, client_port, 443)
+            elif kind < udp + tcp:
+                flow = Flow(6, 6 if ipv6_flow else 4, client, server, client_port, rng.choice((80, 443)))
+            else:
+                flow = Flow(58 if ipv6_flow else 1, 6 if ipv6_flow else 4, client, server, 0, 0)
+
+            self.flows.append(flow)
+
+    def ip_frame(self, flow, forward, protocol, transport):
+        src, dst = (flow.client, flow.server) if forward else (flow.server, flow.client)
+        src_mac, dst_mac = (CLIENT_MAC, SERVER_MAC) if forward else (SERVER_MAC, CLIENT_MAC)
+
+        if flow.version == 6:
+            header = IPV6.pack(6 << 28, len(transport), protocol, 64, src.to_bytes(16, "big"), dst.to_bytes(16, "big"))
+            return ETHERNET.pack(dst_mac, src_mac, 0x86DD) + header + transport
+
+        header = IPV4.pack(0x45, 0, 20 + len(transport), flow.packets & 0xFFFF, 0, 64, protocol, 0, src.to_bytes(4, "big"), dst.to_bytes(4, "big"))
+        header = header[:10] + struct.pack("!H", checksum(header)) + header[12:]
+        return ETHERNET.pack(dst_mac, src_mac, 0x0800) + header + transport
+
+    # builds the next packet of a flow
+    # TCP flows start with a handshake (SYN, SYN-ACK) followed by data packets in both directions
+    def next_frame(self, flow):
+        packet = flow.packets
+        flow.packets += 1
+
+        if flow.protocol == 17:
+            data = dns_query(flow.dns, packet & 0xFFFF) if flow.dns else self.payload
+            transport = UDP_HEADER.pack(flow.client_port, flow.server_port, 8 + len(data), 0) + data
+            return self.ip_frame(flow, True, 17, transport)
+
+        if flow.protocol == 6:
+            forward = packet % 2 == 0
+            if packet == 0:
+                flags, data = TCP_SYN, b""
+            elif packet == 1:
+                flags, data = TCP_SYN | TCP_ACK, b""
+            else:
+                flags, data = TCP_PSH | TCP_ACK, self.payload
+
+            sport, dport = (flow.client_port, flow.server_port) if forward else (flow.server_port, flow.client_port)
+            transport = TCP_HEADER.pack(sport, dport, packet, packet, 5 << 4, flags, 65535, 0, 0) + data
+            return self.ip_frame(flow, forward, 6, transport)
+
+        # ICMP / ICMPv6 echo request
+        icmp_type = 128 if flow.protocol == 58 else 8
+        transport = ICMP_HEADER.pack(icmp_type, 0, 0, 1, packet & 0xFFFF) + self.payload
+        return self.ip_frame(flow, True, flow.protocol, transport)
+
+    # returns `count` frames, the flows take turns so every flow gets an equal share of the packets
+    def frames(self, count):
+        flows = self.flows
+        return [self.next_frame(flows[index % len(flows)]) for index in range(count)]
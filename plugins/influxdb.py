@@ -0,0 +1,257 @@
+import asyncio
+import random
+import ssl
+import time
+import zlib
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlencode, urlsplit
+
+# Writes the packet logs to InfluxDB in the line protocol, a batch is a single HTTP request.
+# The requests are sent over a pool of keep-alive connections, a request which fails because of the connection,
+# a 429 or a 5xx answer is retried with a jittered exponential backoff. Run it with pass_config enabled, the settings
+# are read from the influxdb section of the config (see SETTINGS), and set plugin.workers to send multiple batches at once.
+#
+# influxdb:
+#   url: "http://localhost:8086"
+#   bucket: "pokiestream" # InfluxDB 2.x (with org and token), or database for the 1.x API
+#   org: "myorg"
+#   token: "..."
+
+SETTINGS = {
+    "url": "http://localhost:8086",
+    # InfluxDB 2.x
+    "bucket": None,
+    "org": None,
+    "token": None,
+    # InfluxDB 1.x, used if no bucket is set
+    "database": "pokiestream",
+    "username": None,
+    "password": None,
+    "measurement": "packet_logs",
+    # the fields stored as tags, the rest are stored as fields (addresses and session ids have too many values for tags)
+    "tags": ["protocol_name", "state"],
+    "gzip": False,
+    "pool_size": 4,
+    # the most requests sent at the same time, the other batches wait for their turn
+    "max_in_flight": 4,
+    # the retries of a failed request and their delay, the delay doubles with every retry up to max_backoff (in seconds)
+    "retries": 5,
+    "backoff": 0.2,
+    "max_backoff": 10,
+    # the timeout of a single request in seconds
+    "timeout": 30
+}
+
+FIELDS = ("src_ip", "dst_ip", "src_port", "dst_port", "protocol_num", "protocol_name", "state", "session_id")
+
+# the answers which are worth a retry
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# a request which failed and may succeed later
+class RetryableError(Exception):
+    def __init__(self, message, delay=None):
+        super().__init__(message)
+        self.delay = delay
+
+MEASUREMENT_ESCAPES = str.maketrans({",": "\\,", " ": "\\ "})
+TAG_ESCAPES = str.maketrans({",": "\\,", " ": "\\ ", "=": "\\="})
+STRING_ESCAPES = str.maketrans({'"': '\\"', "\\": "\\\\"})
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# the first and the last timestamp of the latest run of points of every series (tag set) which had to be moved forward
+# InfluxDB keeps one point per series and timestamp, a point with the same timestamp overwrites the previous one
+latest = {}
+
+def field_value(value):
+    if value is True or value is False:
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return '"' + str(value).translate(STRING_ESCAPES) + '"'
+
+# returns the timestamp of a packet log in nanoseconds, the dict packet logs only have the timestamp string (UTC, microseconds)
+def event_time(data):
+    time_ns = getattr(data, "time_ns", None)
+    if time_ns is not None:
+        return time_ns
+    try:
+        return (datetime.fromisoformat(data["timestamp"]) - EPOCH) // MICROSECOND * 1000
+    except (KeyError, TypeError, ValueError):
+        return time.time_ns()
+
+# returns a timestamp for a point of the series which doesn't overwrite the previous points,
+# a point with the timestamp of a previous point of the series (a burst, or a replay with microsecond timestamps)
+# is moved forward to the nanosecond after the last one, the moved points keep their order
+def unique_time(series, time_ns):
+    entry = latest.get(series)
+    if entry is not None and entry[0] <= time_ns <= entry[1]:
+        entry[1] += 1
+        return entry[1]
+    latest[series] = [time_ns, time_ns]
+    return time_ns
+
+# returns the line of a packet log, the payload is stored as fields (dns, sni, packets, ...)
+def to_line(data, measurement, tags):
+    tag_set = ""
+    fields = []
+    for key in FIELDS:
+        value = data[key]
+        if value is None:
+            continue
+        if key in tags:
+            tag_set += f",{key}={str(value).translate(TAG_ESCAPES)}"
+        else:
+            fields.append(f"{key}={field_value(value)}")
+
+    payload = data["payload"]
+    if payload:
+        for key, value in payload.items():
+            if value is not None and not isinstance(value, (dict, list)):
+                fields.append(f"{str(key).translate(TAG_ESCAPES)}={field_value(value)}")
+
+    if not fields:
+        # a line needs at least one field
+        fields.append("count=1i")
+    return f"{measurement}{tag_set} {','.join(fields)} {unique_time(tag_set, event_time(data))}"
+
+# A keep-alive HTTP/1.1 connection to the InfluxDB server.
+class Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, endpoint):
+        reader, writer = await asyncio.open_connection(endpoint.host, endpoint.port, ssl=endpoint.ssl)
+        return cls(reader, writer)
+
+    def close(self):
+        self.writer.close()
+
+    # sends a request and returns the status, the headers (lower case names) and the body of the answer
+    async def request(self, head, body):
+        self.writer.write(head + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("The connection was closed by the server")
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            content = b""
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                content += chunk[:-2]
+        else:
+            content = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        return status, headers, content
+
+# the address of the server and the request line of the writes
+class Endpoint:
+    def __init__(self, settings):
+        url = urlsplit(settings["url"])
+        secure = url.scheme == "https"
+        self.host = url.hostname
+        self.port = url.port or (443 if secure else 80)
+        self.ssl = ssl.create_default_context() if secure else None
+        prefix = url.path.rstrip("/")
+
+        headers = {"Host": url.netloc, "Content-Type": "text/plain; charset=utf-8", "Connection": "keep-alive"}
+        if settings["bucket"]:
+            query = {"bucket": settings["bucket"], "precision": "ns"}
+            if settings["org"]:
+                query["org"] = settings["org"]
+            path = f"{prefix}/api/v2/write?{urlencode(query)}"
+            if settings["token"]:
+                headers["Authorization"] = f"Token {settings['token']}"
+        else:
+            query = {"db": settings["database"], "precision": "ns"}
+            if settings["username"]:
+                query.update(u=settings["username"], p=settings["password"] or "")
+            path = f"{prefix}/write?{urlencode(query, quote_via=quote)}"
+        if settings["gzip"]:
+            headers["Content-Encoding"] = "gzip"
+
+        self.request_line = f"POST {path} HTTP/1.1\r\n" + "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+
+settings = None
+endpoint = None
+# the idle connections, and the most requests sent at the same time
+idle = []
+window = None
+
+def setup(config):
+    global settings, endpoint, window
+    section = getattr(config, "influxdb", None)
+    settings = dict(SETTINGS, **(vars(section) if section is not None else {}))
+    endpoint = Endpoint(settings)
+    window = asyncio.Semaphore(min(settings["max_in_flight"], settings["pool_size"]))
+
+async def send(body):
+    connection = idle.pop() if idle else await Connection.open(endpoint)
+    head = f"{endpoint.request_line}Content-Length: {len(body)}\r\n\r\n".encode()
+    try:
+        status, headers, content = await asyncio.wait_for(connection.request(head, body), settings["timeout"])
+    except BaseException:
+        # the state of the connection is unknown
+        connection.close()
+        raise
+
+    if headers.get("connection", "").lower() == "close" or len(idle) >= settings["pool_size"]:
+        connection.close()
+    else:
+        idle.append(connection)
+
+    if status < 300:
+        return
+    message = f"InfluxDB answered {status}: {content[:200].decode('utf-8', 'replace')}"
+    if status in RETRY_STATUS:
+        retry_after = headers.get("retry-after", "")
+        raise RetryableError(message, float(retry_after) if retry_after.isdigit() else None)
+    raise RuntimeError(message)
+
+# sends the lines, the failed requests are retried after a random delay between 0 and the backoff of the attempt
+async def send_with_retries(body):
+    attempt = 0
+    while True:
+        try:
+            return await send(body)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, RetryableError) as e:
+            if attempt >= settings["retries"]:
+                raise
+            delay = random.uniform(0, min(settings["max_backoff"], settings["backoff"] * 2 ** attempt))
+            if isinstance(e, RetryableError) and e.delay is not None:
+                delay = max(delay, e.delay)
+            print(f"InfluxDB write failed ({e}), retrying in {delay:.2f} seconds.")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+async def receiver_batch(events, config=None):
+    if settings is None:
+        setup(config)
+
+    measurement = settings["measurement"].translate(MEASUREMENT_ESCAPES)
+    tags = settings["tags"]
+    body = "\n".join(to_line(data, measurement, tags) for data in events).encode()
+    if settings["gzip"]:
+        compressor = zlib.compressobj(wbits=31)
+        body = compressor.compress(body) + compressor.flush()
+
+    async with window:
+        await send_with_retries(body)
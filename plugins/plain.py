@@ -1,36 +1,155 @@
 import socket
 import asyncio
 import time
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
 
 COLORS = {
     "NEW": "\033[94m",
     "ESTABLISHED": "\033[92m",
     "CLOSE": "\033[91m",
     "ABORT": "\033[1;91m",
+    "INSPECTED": "\033[96m",
+    "INTERIM": "\033[95m",
+    "OVERLOAD": "\033[1;93m",
+    "RECOVERED": "\033[1;93m",
     "UNKNOWN": "\033[93m",
+    "NAME": "\033[90m",
     "RESET": "\033[0m",
 }
 
-rdns_cache = {}
-CACHE_TTL = 120 
-
-async def reverse_dns(ip):
-    now = time.time()
-    if ip in rdns_cache:
-        hostname, ts = rdns_cache[ip]
-        if now - ts < CACHE_TTL:
-            return hostname
-        rdns_cache.pop(ip, None)
-    
+# Reverse DNS of the destination addresses.
+# RDNS_MODE "immediate" prints every packet log at once and looks the unknown addresses up in the background,
+# their names are printed when they arrive and shown in the following packet logs. "wait" waits for the lookup, at most LOOKUP_TIMEOUT seconds.
+# Both can be set in the config with pass_config enabled, see configure().
+RDNS_MODE = "immediate"
+LOOKUP_TIMEOUT = 0.5
+# the names are cached for CACHE_TTL seconds, failed lookups for NEGATIVE_TTL seconds, at most CACHE_SIZE addresses (least recently used first out)
+CACHE_SIZE = 10000
+CACHE_TTL = 120
+NEGATIVE_TTL = 30
+# the most lookups running at the same time (every one blocks a thread) and waiting for their turn, more new addresses are not looked up
+MAX_LOOKUPS = 8
+MAX_PENDING = 1000
+
+# the name of an address from the system resolver, None if it has none
+async def system_lookup(ip):
     try:
-        hostname = await asyncio.to_thread(socket.gethostbyaddr, ip)
-        hostname = hostname[0]
-    except Exception:
-        hostname = None
-    
-    rdns_cache[ip] = (hostname, now)
-    return hostname
+        return (await asyncio.to_thread(socket.gethostbyaddr, ip))[0]
+    except (OSError, UnicodeError):
+        return None
+
+# A reverse DNS cache in front of a lookup function (an async function which returns the name of an address or None).
+# Concurrent lookups of the same address share a single request.
+class Resolver:
+    def __init__(self, lookup=system_lookup, size=CACHE_SIZE, ttl=CACHE_TTL, negative_ttl=NEGATIVE_TTL, max_lookups=MAX_LOOKUPS, max_pending=MAX_PENDING):
+        self.lookup = lookup
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_lookups = max_lookups
+        self.max_pending = max_pending
+        # ip -> (name, expiry), in the order of use
+        self.cache = OrderedDict()
+        # ip -> the task of the running lookup
+        self.pending = {}
+        self.slots = None
+
+    # returns (True, name) if the address is cached, (False, None) if it has to be looked up
+    def cached(self, ip):
+        entry = self.cache.get(ip)
+        if entry is None:
+            return False, None
+        if entry[1] <= time.monotonic():
+            del self.cache[ip]
+            return False, None
+        self.cache.move_to_end(ip)
+        return True, entry[0]
+
+    def store(self, ip, name):
+        self.cache[ip] = (name, time.monotonic() + (self.ttl if name else self.negative_ttl))
+        self.cache.move_to_end(ip)
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+    async def run(self, ip):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_lookups)
+        try:
+            async with self.slots:
+                name = await self.lookup(ip)
+        except Exception:
+            name = None
+        finally:
+            self.pending.pop(ip, None)
+        self.store(ip, name)
+        return name
+
+    # starts the lookup of an address unless it is running already, returns its task
+    # returns None if too many lookups are waiting
+    def start(self, ip):
+        task = self.pending.get(ip)
+        if task is None and len(self.pending) < self.max_pending:
+            task = self.pending[ip] = asyncio.ensure_future(self.run(ip))
+        return task
+
+    # returns the name of an address, None if it has none or the lookup took longer than the timeout
+    # the lookup goes on after the timeout, its result is cached for the next time
+    async def resolve(self, ip, timeout):
+        found, name = self.cached(ip)
+        if found:
+            return name
+        task = self.start(ip)
+        if task is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+resolver = Resolver()
+
+# prints the name of an address once its lookup finished, for the packet logs which were printed without it
+def print_name(ip, task):
+    if not task.cancelled() and task.result():
+        print(f"{COLORS['NAME']}{ip} is {task.result()}{COLORS['RESET']}")
+
+# returns the name of an address without waiting, the lookup of an unknown address runs in the background
+def name_now(ip):
+    found, name = resolver.cached(ip)
+    if not found and ip not in resolver.pending:
+        task = resolver.start(ip)
+        if task is not None:
+            task.add_done_callback(lambda task: print_name(ip, task))
+    return name
+
+# reads the settings of the plugin from the plain section of the config (pass_config must be enabled):
+#
+# plain:
+#   rdns_mode: "immediate" # immediate or wait
+#   lookup_timeout: 0.5
+#   cache_size: 10000
+#   cache_ttl: 120
+#   negative_ttl: 30
+#   max_lookups: 8
+#   max_pending: 1000
+# the lookup function of the current resolver is kept, so a resolver with a stub lookup can be configured as well
+def configure(config):
+    global RDNS_MODE, LOOKUP_TIMEOUT, resolver
+    settings = getattr(config, "plain", None)
+    if settings is None:
+        return
+    RDNS_MODE = getattr(settings, "rdns_mode", RDNS_MODE)
+    LOOKUP_TIMEOUT = getattr(settings, "lookup_timeout", LOOKUP_TIMEOUT)
+    resolver = Resolver(
+        lookup=resolver.lookup,
+        size=getattr(settings, "cache_size", CACHE_SIZE),
+        ttl=getattr(settings, "cache_ttl", CACHE_TTL),
+        negative_ttl=getattr(settings, "negative_ttl", NEGATIVE_TTL),
+        max_lookups=getattr(settings, "max_lookups", MAX_LOOKUPS),
+        max_pending=getattr(settings, "max_pending", MAX_PENDING)
+    )
+
+configured = False
 
 Packet = namedtuple("Packet", [
     "src_ip", "dst_ip", "src_port", "dst_port",
@@ -38,15 +157,30 @@ Packet = namedtuple("Packet", [
     "timestamp", "session_id", "payload"
 ])
 
-async def receiver(data):
+async def receiver(data, config=None):
+    global configured
+    if not configured:
+        configured = True
+        if config is not None:
+            configure(config)
+
     packet = Packet(**data)
     src_ip, dst_ip, src_port, dst_port, proto_num, proto_name, state, timestamp, session_id, payload = packet
 
-    rdns = await reverse_dns(dst_ip)
-    dst_display = f"{dst_ip} ({rdns})" if rdns else dst_ip
-
     color = COLORS.get(state, COLORS["UNKNOWN"])
 
+    # the queue state events of PokieStream have no addresses
+    if state in ("OVERLOAD", "RECOVERED"):
+        details = ", ".join(f"{key}: {value}" for key, value in payload.items())
+        print(f"{color}[{timestamp}] {state} {details}{COLORS['RESET']}")
+        return
+
+    if RDNS_MODE == "wait":
+        rdns = await resolver.resolve(dst_ip, LOOKUP_TIMEOUT)
+    else:
+        rdns = name_now(dst_ip)
+    dst_display = f"{dst_ip} ({rdns})" if rdns else dst_ip
+
     if proto_name.upper() == "ICMP":
         line = (
             f"{color}[{timestamp}] {src_ip} -> {dst_display} "
@@ -59,9 +193,16 @@ async def receiver(data):
         )
 
     if payload:
+        if payload.get("sni"):
+            line += f", SNI: {payload['sni']}"
         if payload.get("host"):
             line += f", Host: {payload['host']}"
         if payload.get("dns"):
             line += f", DNS: {payload['dns']}"
+        if "packets" in payload:
+            line += (
+                f", Packets: {payload['packets']}/{payload['reply_packets']}"
+                f", Bytes: {payload['bytes']}/{payload['reply_bytes']}, Duration: {payload['duration']}s"
+            )
 
     print(line)
\ No newline at end of file
@@ -0,0 +1,175 @@
+import asyncio
+import ipaddress
+import json
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+try:
+    import asyncpg
+except ImportError:
+    raise ImportError("The timescaledb plugin needs asyncpg, install it with: pip install asyncpg")
+
+# Writes the packet logs into a PostgreSQL / TimescaleDB table in batches.
+# The batches are written with COPY (or multi-row INSERTs) over a connection pool, a batch which fails because of the
+# connection or the server is retried with a jittered exponential backoff. Run it with pass_config enabled, the settings
+# are read from the timescaledb section of the config (see SETTINGS), and set plugin.workers to write multiple batches at once.
+#
+# timescaledb:
+#   dsn: "postgresql://pokiestream@localhost/pokiestream"
+#   table: "packet_logs"
+
+SETTINGS = {
+    "dsn": "postgresql://localhost/pokiestream",
+    "table": "packet_logs",
+    # create the table if it doesn't exist, as a hypertable if the timescaledb extension is installed
+    "create_table": True,
+    # copy or insert
+    "method": "copy",
+    "pool_size": 4,
+    # the most batches written at the same time, the other batches wait for their turn
+    "max_in_flight": 4,
+    # the retries of a failed batch and their delay, the delay doubles with every retry up to max_backoff (in seconds)
+    "retries": 5,
+    "backoff": 0.2,
+    "max_backoff": 10,
+    # the timeout of a single write in seconds
+    "timeout": 30
+}
+
+COLUMNS = ("time", "session_id", "src_ip", "dst_ip", "src_port", "dst_port", "protocol_num", "protocol_name", "state", "payload")
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    time TIMESTAMPTZ NOT NULL,
+    session_id UUID,
+    src_ip INET,
+    dst_ip INET,
+    src_port INTEGER,
+    dst_port INTEGER,
+    protocol_num SMALLINT,
+    protocol_name TEXT,
+    state TEXT,
+    payload JSONB
+)
+"""
+
+# the errors of the connection and the server which are worth a retry, errors of the data or the schema are not
+RETRY_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError,
+    asyncpg.InsufficientResourcesError,
+    asyncpg.SerializationError,
+    asyncpg.DeadlockDetectedError,
+)
+
+# the most parameters of a statement is 32767, a multi-row INSERT has at most this many rows
+INSERT_ROWS = 32767 // len(COLUMNS)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ADDRESS_TYPES = {4: ipaddress.IPv4Address, 6: ipaddress.IPv6Address}
+
+settings = None
+pool = None
+window = None
+setup_lock = None
+
+# returns a row of the table, the packet logs of PokieStream are converted from their raw fields
+def to_row(data):
+    payload = data["payload"]
+    payload = json.dumps(payload) if payload is not None else None
+
+    time_ns = getattr(data, "time_ns", None)
+    if time_ns is None:
+        # a plain dict
+        session_id = data["session_id"]
+        return (
+            datetime.fromisoformat(data["timestamp"]).replace(tzinfo=timezone.utc), session_id and uuid.UUID(session_id),
+            data["src_ip"], data["dst_ip"], data["src_port"], data["dst_port"], data["protocol_num"], data["protocol_name"], data["state"], payload
+        )
+
+    address = ADDRESS_TYPES.get(data.version)
+    session = data.session
+    return (
+        EPOCH + timedelta(microseconds=time_ns // 1000), None if session is None else uuid.UUID(int=session),
+        None if address is None else address(data.src), None if address is None else address(data.dst),
+        data.src_port, data.dst_port, data.protocol_num, data.protocol_name, data.state, payload
+    )
+
+def quote(table):
+    return ".".join(f'"{part}"' for part in table.split("."))
+
+def read_settings(config):
+    global settings, window
+    section = getattr(config, "timescaledb", None)
+    settings = dict(SETTINGS, **(vars(section) if section is not None else {}))
+    window = asyncio.Semaphore(settings["max_in_flight"])
+
+async def setup():
+    global pool
+    connections = await asyncpg.create_pool(settings["dsn"], min_size=1, max_size=settings["pool_size"], timeout=settings["timeout"])
+    try:
+        if settings["create_table"]:
+            table = quote(settings["table"])
+            async with connections.acquire() as conn:
+                await conn.execute(CREATE_TABLE.format(table=table))
+                if await conn.fetchval("SELECT count(*) FROM pg_extension WHERE extname = 'timescaledb'"):
+                    await conn.execute(f"SELECT create_hypertable('{table}', 'time', if_not_exists => TRUE)")
+    except BaseException:
+        await connections.close()
+        raise
+
+    pool = connections
+
+async def write(rows):
+    async with pool.acquire() as conn:
+        if settings["method"] == "copy":
+            schema, _, table = settings["table"].rpartition(".")
+            await conn.copy_records_to_table(table, schema_name=schema or None, records=rows, columns=COLUMNS, timeout=settings["timeout"])
+            return
+
+        # a batch with more rows than a statement can take is written in a transaction, a retry never writes a part twice
+        table = quote(settings["table"])
+        async with conn.transaction():
+            for start in range(0, len(rows), INSERT_ROWS):
+                chunk = rows[start:start + INSERT_ROWS]
+                values = ", ".join(
+                    "(" + ", ".join(f"${row * len(COLUMNS) + column + 1}" for column in range(len(COLUMNS))) + ")"
+                    for row in range(len(chunk))
+                )
+                await conn.execute(f"INSERT INTO {table} ({', '.join(COLUMNS)}) VALUES {values}", *[value for row in chunk for value in row], timeout=settings["timeout"])
+
+# calls the coroutine function until it succeeds, the failed calls are retried after a random delay between 0 and the backoff of the attempt
+async def with_retries(action, *args):
+    attempt = 0
+    while True:
+        try:
+            return await action(*args)
+        except RETRY_ERRORS as e:
+            if attempt >= settings["retries"]:
+                raise
+            delay = random.uniform(0, min(settings["max_backoff"], settings["backoff"] * 2 ** attempt))
+            print(f"TimescaleDB {action.__name__} failed ({e!r}), retrying in {delay:.2f} seconds.")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+# the pool is created by the first batch with the same retries as the writes,
+# if the database is still not available the batch is lost and the next batch tries again
+async def receiver_batch(events, config=None):
+    global setup_lock
+    if settings is None:
+        read_settings(config)
+    if pool is None:
+        if setup_lock is None:
+            setup_lock = asyncio.Lock()
+        async with setup_lock:
+            if pool is None:
+                await with_retries(setup)
+
+    rows = [to_row(data) for data in events]
+    async with window:
+        await with_retries(write, rows)
@@ -6,66 +6,74 @@ import threading
 import sys
 import logging
 
-from scapy.all import sniff
-from scapy.config import conf
-from pokiestream.components.packets import inspect_packets
+from pokiestream.components.args import args
+from pokiestream.components.capture import run_sniffer
+from pokiestream.components.replay import run_replay
+from pokiestream.components.sharding import start_capture_workers, receive_from_capture_workers
 from pokiestream.components.config import config
-from pokiestream.components.queue import create_queue, queues
+from pokiestream.components.queue import close_queues, create_stream
 from pokiestream.components.checks import check_interface
-from pokiestream.components.plugin import load_receiver
+from pokiestream.components.consumer import process_queue
+from pokiestream.components.metrics import start_metrics_server, log_stats
 from pokiestream.components.udp import start_cleanup_task as start_udp_cleanup_task
 from pokiestream.components.tcp import start_cleanup_task as start_tcp_cleanup_task
 
 # Supress scapy errors.
 logging.getLogger("scapy.runtime").setLevel(logging.CRITICAL)
 
-# initialize the sniffer
-def run_sniffer():
-    try:
-        conf.debug_dissector = 2
-        sniff(prn=inspect_packets, store=0, iface=config.iface, filter=config.filter.scapy)
-    except ValueError as e:
-        print(f"There is an error with the sniffer: {e}")
-
-# process the queue
-async def process_queue():
-    receiver = load_receiver()
-
-    while True:
-        if queues['log_queue'].async_q.qsize() > 0:
-            data = await queues['log_queue'].async_q.get()
-            if receiver:
-                if config.plugin.pass_config:
-                    await receiver(data, config)
-                else:
-                    await receiver(data)
+async def async_main(capture_workers=None):
+    # every sink gets its own queue of the event stream
+    # a replay waits for the plugins instead of dropping events, the file can't overflow like a network interface
+    await create_stream('log_queue', config.sinks, "block" if args.read else None)
 
-            else:
-                print(f"{data}")
+    if config.metrics.enabled:
+        try:
+            await start_metrics_server(config.metrics.host, config.metrics.port)
+        except OSError as e:
+            print(f"There is an error with the metrics server: {e}")
+            sys.exit(1)
+    if config.metrics.log_interval:
+        asyncio.create_task(log_stats(config.metrics.log_interval, [sink.name for sink in config.sinks]))
 
-        if not config.NOT_RECOMMENDED.bypass_polling_delay:
-            await asyncio.sleep(0.01)
-
-async def async_main():
-    if not check_interface(config.iface):
-        print(f"Interface {config.iface} does not exist.")
-        sys.exit(1)
+    if args.read:
+        # the packets are replayed from a file, the sessions are expired by the replay in trace time
+        replay = asyncio.create_task(asyncio.to_thread(run_replay, args.read, args.speed))
+        await process_queue(replay)
+        return
 
-    await create_queue('log_queue')
+    if capture_workers:
+        # the packets are captured and tracked by the worker processes
+        receive_from_capture_workers(capture_workers)
+    else:
+        # start the sniffer in different thread
+        sniffer_thread = threading.Thread(target=run_sniffer, daemon=True)
+        sniffer_thread.start()
 
-    # start the sniffer in different thread
-    sniffer_thread = threading.Thread(target=run_sniffer, daemon=True)
-    sniffer_thread.start()
+        asyncio.create_task(start_udp_cleanup_task())
+        asyncio.create_task(start_tcp_cleanup_task())
 
-    asyncio.create_task(start_udp_cleanup_task())
-    asyncio.create_task(start_tcp_cleanup_task())
     await process_queue()
 
 
 def main():
+    if args.read:
+        if args.speed < 0:
+            print("The replay speed must not be negative.")
+            sys.exit(1)
+    elif not check_interface(config.iface):
+        print(f"Interface {config.iface} does not exist.")
+        sys.exit(1)
+
     try:
-        asyncio.run(async_main())
+        capture_workers = None
+        if config.capture.workers > 1 and not args.read:
+            capture_workers = start_capture_workers(config.capture.workers)
+            print(f"Started {len(capture_workers)} capture workers.")
+
+        asyncio.run(async_main(capture_workers))
 
     except KeyboardInterrupt:
         print("\nExiting gracefully...")
-        sys.exit(0)
\ No newline at end of file
+        sys.exit(0)
+    finally:
+        close_queues()
\ No newline at end of file
@@ -5,4 +5,6 @@ import argparse
 
 parser = argparse.ArgumentParser(description="PokieStream - A simple and fast packet sniffer with plugins.")
 parser.add_argument("-c", "--config", help="Path to the config file", default="config.yml")
+parser.add_argument("-r", "--read", help="Replay a pcap or pcapng file instead of capturing on the interface", metavar="FILE")
+parser.add_argument("--speed", help="Replay speed relative to the recorded pace, 0 replays as fast as possible (default: 0)", type=float, default=0)
 args = parser.parse_args()
\ No newline at end of file
@@ -0,0 +1,284 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import mmap
+import select
+import socket
+import struct
+import threading
+import time
+
+from scapy.all import sniff
+from scapy.config import conf
+from scapy.layers.l2 import Ether
+from pokiestream.components.packets import inspect_packets, inspect_raw
+from pokiestream.components.match import matcher, bpf_expression, combine_bpf
+from pokiestream.components.config import config
+from pokiestream.components.metrics import metrics
+
+# Linux AF_PACKET constants (linux/if_packet.h)
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_MR_PROMISC = 1
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+PACKET_FANOUT = 18
+PACKET_FANOUT_HASH = 0
+PACKET_FANOUT_FLAG_DEFRAG = 0x8000
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# struct tpacket_req3
+tpacket_req3 = struct.Struct("IIIIIII")
+# struct packet_mreq
+packet_mreq = struct.Struct("iHH8s")
+# struct tpacket_stats, returned by sockets without a TPACKET_V3 ring
+tpacket_stats = struct.Struct("II")
+# struct tpacket_stats_v3
+tpacket_stats_v3 = struct.Struct("III")
+# block_status, num_pkts, offset_to_first_pkt of struct tpacket_block_desc
+block_header = struct.Struct("III")
+BLOCK_HEADER_OFFSET = 8
+# tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac of struct tpacket3_hdr
+frame_header = struct.Struct("IIIIIIH")
+u32 = struct.Struct("I")
+
+kernel_packets = metrics.counter("pokiestream_kernel_packets_total", "Packets received by the capture socket")
+kernel_drops = metrics.counter("pokiestream_kernel_drops_total", "Packets dropped by the kernel because the capture could not keep up")
+
+# Joins a packet socket to a PACKET_FANOUT group in flow hash mode.
+# The kernel uses a symmetric flow hash, so both directions of a flow are always delivered to the same socket.
+# Fragments are reassembled for the hash so they also stay with their flow.
+def join_fanout(sock, group_id):
+    sock.setsockopt(SOL_PACKET, PACKET_FANOUT, u32.pack((group_id & 0xFFFF) | ((PACKET_FANOUT_HASH | PACKET_FANOUT_FLAG_DEFRAG) << 16)))
+
+# Captures packets with scapy, either fully dissected or as raw frames for the raw decoder
+class ScapyCapture:
+    def __init__(self, iface, bpf_filter, decoder, fanout_group=None):
+        self.iface = iface
+        self.bpf_filter = bpf_filter or None
+        self.decoder = decoder
+        self.fanout_group = fanout_group
+        self.sock = None
+        self.stats_lock = threading.Lock()
+
+    # adds the kernel packet counters to the metrics, the kernel resets them on every read
+    def update_stats(self):
+        with self.stats_lock:
+            if self.sock is None:
+                return
+            packets, drops = tpacket_stats.unpack(self.sock.ins.getsockopt(SOL_PACKET, PACKET_STATISTICS, tpacket_stats.size))
+        kernel_packets.value += packets
+        kernel_drops.value += drops
+
+    def run(self):
+        sock = conf.L2listen(iface=self.iface, filter=self.bpf_filter)
+        if self.fanout_group is not None:
+            join_fanout(sock.ins, self.fanout_group)
+        self.sock = sock
+        metrics.collector(self.update_stats)
+
+        if self.decoder != "raw":
+            conf.debug_dissector = 2
+            try:
+                sniff(prn=inspect_packets, store=0, opened_socket=sock)
+            finally:
+                self.close()
+            return
+
+        # captures raw frames and decodes the headers without scapy dissection
+        try:
+            while True:
+                link_layer, frame, _ = sock.recv_raw()
+                if frame:
+                    inspect_raw(frame, link_layer)
+        finally:
+            self.close()
+
+    def close(self):
+        with self.stats_lock:
+            self.sock.close()
+            self.sock = None
+
+# Captures packets from a Linux AF_PACKET TPACKET_V3 memory-mapped ring.
+# The kernel fills whole blocks of frames and wakes us up once per block (or after block_timeout),
+# the frames are then read in place through memoryviews without copying them out of the ring.
+class TPacketV3Capture:
+    def __init__(self, iface, bpf_filter, block_size=1 << 20, block_count=64, frame_size=2048, block_timeout=100, promisc=True, stats_interval=60, fanout_group=None):
+        self.iface = iface
+        self.bpf_filter = bpf_filter or None
+        self.block_size = block_size
+        self.block_count = block_count
+        self.frame_size = frame_size
+        self.block_timeout = block_timeout
+        self.promisc = promisc
+        self.stats_interval = stats_interval
+        self.fanout_group = fanout_group
+
+        self.packets = 0
+        self.drops = 0
+        self.freezes = 0
+
+        self.sock = None
+        self.ring = None
+        self.link_layer = Ether
+        # the counters are read by the capture thread and by the metrics collection
+        self.stats_lock = threading.Lock()
+
+    def open(self):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            # attach the kernel filter before binding so no unfiltered packet reaches the ring
+            if self.bpf_filter:
+                from scapy.arch.linux import attach_filter
+                attach_filter(sock, self.bpf_filter, self.iface)
+
+            sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            sock.setsockopt(SOL_PACKET, PACKET_RX_RING, tpacket_req3.pack(
+                self.block_size, self.block_count, self.frame_size,
+                (self.block_size // self.frame_size) * self.block_count,
+                self.block_timeout, 0, 0
+            ))
+            self.ring = mmap.mmap(sock.fileno(), self.block_size * self.block_count, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+            sock.bind((self.iface, ETH_P_ALL))
+            if self.fanout_group is not None:
+                join_fanout(sock, self.fanout_group)
+            if self.promisc:
+                sock.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, packet_mreq.pack(socket.if_nametoindex(self.iface), PACKET_MR_PROMISC, 0, b""))
+
+            # non ethernet interfaces are handed over to scapy, just like the scapy backend does
+            hatype = sock.getsockname()[3]
+            self.link_layer = conf.l2types.num2layer.get(hatype, Ether)
+        except Exception:
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+            sock.close()
+            raise
+
+        self.sock = sock
+        metrics.collector(self.update_stats)
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        with self.stats_lock:
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+    # reads the kernel packet counters, the kernel resets them on every read
+    def update_stats(self):
+        with self.stats_lock:
+            if self.sock is not None:
+                packets, drops, freezes = tpacket_stats_v3.unpack(self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, tpacket_stats_v3.size))
+                self.packets += packets
+                self.drops += drops
+                self.freezes += freezes
+                kernel_packets.value += packets
+                kernel_drops.value += drops
+            return self.packets, self.drops
+
+    def report_stats(self):
+        packets, drops = self.update_stats()
+        print(f"Capture statistics ({self.iface}): {packets} packets received, {drops} packets dropped by the kernel")
+
+    # processes every frame of a block which is owned by user space
+    def read_block(self, ring, base, handler):
+        _, num_pkts, offset = block_header.unpack_from(ring, base + BLOCK_HEADER_OFFSET)
+        link_layer = self.link_layer
+        offset += base
+
+        for _ in range(num_pkts):
+            next_offset, _, _, snaplen, _, _, mac = frame_header.unpack_from(ring, offset)
+            start = offset + mac
+            frame = ring[start:start + snaplen]
+            try:
+                handler(frame, link_layer)
+            finally:
+                frame.release()
+            offset += next_offset
+
+    def run(self, handler=inspect_raw):
+        self.open()
+        ring = memoryview(self.ring)
+        poller = select.poll()
+        poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+
+        block = 0
+        next_report = time.monotonic() + self.stats_interval if self.stats_interval else None
+
+        try:
+            while True:
+                base = block * self.block_size
+                status = u32.unpack_from(ring, base + BLOCK_HEADER_OFFSET)[0]
+
+                if status & TP_STATUS_USER:
+                    self.read_block(ring, base, handler)
+                    # hand the block back to the kernel
+                    u32.pack_into(ring, base + BLOCK_HEADER_OFFSET, TP_STATUS_KERNEL)
+                    block = (block + 1) % self.block_count
+                else:
+                    poller.poll(self.block_timeout)
+
+                if next_report is not None and time.monotonic() >= next_report:
+                    self.report_stats()
+                    next_report = time.monotonic() + self.stats_interval
+        finally:
+            ring.release()
+            self.close()
+
+CAPTURE_BACKENDS = ("scapy", "tpacket_v3")
+
+# the instruction limit of a classic BPF program in the kernel
+BPF_MAX_INSTRUCTIONS = 4096
+
+# returns the BPF expression attached to the capture socket: filter.scapy combined with the filter section
+# if the filter section can't be compiled for the interface (no VLAN support on the link type, too many subnets,
+# no libpcap), only filter.scapy is attached and the filter section is applied in userspace as before
+def kernel_filter(iface):
+    user_expression = config.filter.scapy
+    if not config.filter.kernel:
+        return user_expression
+
+    from scapy.arch.common import compile_filter
+    for vlan in (True, False):
+        expression = combine_bpf(user_expression, bpf_expression(matcher, vlan))
+        try:
+            program = compile_filter(expression, iface)
+        except Exception:
+            continue
+        if program.bf_len <= BPF_MAX_INSTRUCTIONS:
+            return expression
+
+    print("The filter section can't be compiled into a kernel filter, it is applied in userspace only.")
+    return user_expression
+
+# creates the capture backend selected in the config
+# fanout_group is set when the capture is sharded between multiple worker processes
+def create_capture(fanout_group=None):
+    capture = config.capture
+    bpf_filter = kernel_filter(config.iface)
+
+    if capture.backend == "tpacket_v3":
+        ring = capture.ring
+        return TPacketV3Capture(
+            config.iface, bpf_filter,
+            block_size=ring.block_size, block_count=ring.block_count,
+            frame_size=ring.frame_size, block_timeout=ring.block_timeout,
+            stats_interval=capture.stats_interval, fanout_group=fanout_group
+        )
+
+    return ScapyCapture(config.iface, bpf_filter, capture.decoder, fanout_group)
+
+# initialize the sniffer
+def run_sniffer(fanout_group=None):
+    try:
+        create_capture(fanout_group).run()
+    except (ValueError, OSError) as e:
+        print(f"There is an error with the sniffer: {e}")
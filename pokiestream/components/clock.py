@@ -0,0 +1,37 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import time
+from pokiestream.components.event import format_timestamp
+
+# The clock of the packet pipeline.
+# A live capture uses the wall clock, a replayed capture file uses the timestamps of its packets (trace time),
+# so the event timestamps and the session expiry are the same as they were when the packets were captured.
+class Clock:
+    def __init__(self):
+        # the trace time in microseconds, the resolution of the event timestamps
+        self.trace_time_us = None
+
+    # returns the current time in seconds since the epoch
+    def time(self):
+        if self.trace_time_us is None:
+            return time.time()
+        return self.trace_time_us / 1e6
+
+    # returns the current time in nanoseconds since the epoch, the timestamp of the events
+    def time_ns(self):
+        if self.trace_time_us is None:
+            return time.time_ns()
+        return self.trace_time_us * 1000
+
+    # switches to trace time, the clock never goes backwards (out of order packets)
+    def advance(self, timestamp):
+        timestamp_us = round(timestamp * 1e6)
+        if self.trace_time_us is None or timestamp_us > self.trace_time_us:
+            self.trace_time_us = timestamp_us
+
+    # returns the current time in the event timestamp format
+    def timestamp(self):
+        return format_timestamp(self.time_ns())
+
+clock = Clock()
@@ -0,0 +1,260 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import struct
+
+from pokiestream.components.event import Event
+
+# Compact binary encoding of the events, used by the disk spill.
+# An event record is stored as its raw fields (integer addresses and timestamp). Every value is tagged with a single byte,
+# the common strings (field names, states, protocol names) are stored as an index. Anything else is stored as it is,
+# so every event survives the round trip unchanged, including the payload of the plugins.
+
+NONE = 0
+TRUE = 1
+FALSE = 2
+U8 = 3
+U16 = 4
+I64 = 5
+U128 = 6
+BIGINT = 7
+FLOAT = 8
+STR = 9
+BYTES = 10
+LIST = 11
+DICT = 12
+KNOWN = 13
+# an event record, the values of its slots follow in order
+RECORD = 14
+# an event record of an IPv4 or IPv6 packet with its fixed fields packed into a struct (packed_ipv4, packed_ipv6),
+# the payload follows if the PAYLOAD flag is set
+PACKED_IPV4 = 15
+PACKED_IPV6 = 16
+
+KNOWN_STRINGS = (
+    "src_ip", "dst_ip", "src_port", "dst_port", "protocol_num", "protocol_name", "state", "timestamp", "session_id", "payload",
+    "UDP", "TCP", "ICMP", "ICMPv6",
+    "NEW", "ESTABLISHED", "CLOSE", "ABORT", "EXPIRED", "EVICTED", "OVERLOAD", "RECOVERED",
+    "dns", "host", "sni", "queue", "policy", "depth", "dropped", "duration", "log_queue",
+    # new strings are only appended, the index is stored in the spill files
+    "INSPECTED",
+    "INTERIM", "packets", "bytes", "reply_packets", "reply_bytes",
+)
+KNOWN_INDEX = {value: index for index, value in enumerate(KNOWN_STRINGS)}
+
+# tag, protocol number, state and protocol name (KNOWN_STRINGS indices), flags, ports, timestamp, addresses, session id (high and low half)
+packed_ipv4 = struct.Struct("<BBBBBHHqIIQQ")
+packed_ipv6 = struct.Struct("<BBBBBHHqQQQQQQ")
+# the fields of a packed record which are None
+NO_SRC_PORT = 1
+NO_DST_PORT = 2
+NO_SESSION = 4
+PAYLOAD = 8
+# the state of a packed record which is None
+NO_STATE = 0xFF
+LOW_64 = (1 << 64) - 1
+
+u16 = struct.Struct("<H")
+u32 = struct.Struct("<I")
+i64 = struct.Struct("<q")
+f64 = struct.Struct("<d")
+
+def encode_str(out, value):
+    index = KNOWN_INDEX.get(value)
+    if index is not None:
+        out += bytes((KNOWN, index))
+        return
+
+    data = value.encode()
+    out.append(STR)
+    out += u32.pack(len(data))
+    out += data
+
+def encode_value(out, value):
+    if value is None:
+        out.append(NONE)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, str):
+        encode_str(out, value)
+    elif isinstance(value, int):
+        if 0 <= value < 0x100:
+            out.append(U8)
+            out.append(value)
+        elif 0 <= value < 0x10000:
+            out.append(U16)
+            out += u16.pack(value)
+        elif -(1 << 63) <= value < (1 << 63):
+            out.append(I64)
+            out += i64.pack(value)
+        elif 0 <= value < (1 << 128):
+            out.append(U128)
+            out += value.to_bytes(16, "little")
+        else:
+            data = str(value).encode()
+            out.append(BIGINT)
+            out += u32.pack(len(data))
+            out += data
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += f64.pack(value)
+    elif isinstance(value, dict):
+        out.append(DICT)
+        out += u32.pack(len(value))
+        for key, item in value.items():
+            encode_value(out, key)
+            encode_value(out, item)
+    elif isinstance(value, (list, tuple)):
+        out.append(LIST)
+        out += u32.pack(len(value))
+        for item in value:
+            encode_value(out, item)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        data = bytes(value)
+        out.append(BYTES)
+        out += u32.pack(len(data))
+        out += data
+    else:
+        raise TypeError(f"Can't encode a value of type {type(value).__name__}")
+
+# returns the packed record of an event, or None if a field doesn't fit into it
+def encode_packed(event):
+    version = event.version
+    state = event.state
+    state_index = NO_STATE if state is None else KNOWN_INDEX.get(state)
+    name_index = KNOWN_INDEX.get(event.protocol_name)
+    protocol_num = event.protocol_num
+    if state_index is None or name_index is None or version not in (4, 6) or protocol_num is None or not 0 <= protocol_num < 0x100:
+        return None
+
+    flags = 0
+    src_port = event.src_port
+    if src_port is None:
+        flags |= NO_SRC_PORT
+        src_port = 0
+    dst_port = event.dst_port
+    if dst_port is None:
+        flags |= NO_DST_PORT
+        dst_port = 0
+    session = event.session
+    if session is None:
+        flags |= NO_SESSION
+        session = 0
+    payload = event.payload
+    if payload is not None:
+        flags |= PAYLOAD
+
+    if version == 4:
+        out = bytearray(packed_ipv4.pack(PACKED_IPV4, protocol_num, state_index, name_index, flags, src_port, dst_port, event.time_ns, event.src, event.dst, session >> 64, session & LOW_64))
+    else:
+        src = event.src
+        dst = event.dst
+        out = bytearray(packed_ipv6.pack(PACKED_IPV6, protocol_num, state_index, name_index, flags, src_port, dst_port, event.time_ns, src >> 64, src & LOW_64, dst >> 64, dst & LOW_64, session >> 64, session & LOW_64))
+    if payload is not None:
+        encode_value(out, payload)
+    return out
+
+def decode_packed(data):
+    if data[0] == PACKED_IPV4:
+        _, protocol_num, state_index, name_index, flags, src_port, dst_port, time_ns, src, dst, session_high, session_low = packed_ipv4.unpack_from(data, 0)
+        version = 4
+        offset = packed_ipv4.size
+    else:
+        _, protocol_num, state_index, name_index, flags, src_port, dst_port, time_ns, src_high, src_low, dst_high, dst_low, session_high, session_low = packed_ipv6.unpack_from(data, 0)
+        version = 6
+        src = (src_high << 64) | src_low
+        dst = (dst_high << 64) | dst_low
+        offset = packed_ipv6.size
+
+    return Event(
+        version, src, dst,
+        None if flags & NO_SRC_PORT else src_port,
+        None if flags & NO_DST_PORT else dst_port,
+        protocol_num, KNOWN_STRINGS[name_index],
+        None if state_index == NO_STATE else KNOWN_STRINGS[state_index],
+        time_ns,
+        None if flags & NO_SESSION else (session_high << 64) | session_low,
+        decode_value(data, offset)[0] if flags & PAYLOAD else None
+    )
+
+# returns the binary form of an event (or any other value made of the supported types)
+def encode(value):
+    if type(value) is Event:
+        packed = encode_packed(value)
+        if packed is not None:
+            return packed
+
+    out = bytearray()
+    if type(value) is Event:
+        out.append(RECORD)
+        for slot in Event.__slots__:
+            encode_value(out, getattr(value, slot))
+    else:
+        encode_value(out, value)
+    return out
+
+# returns the value and the offset after it
+def decode_value(data, offset):
+    tag = data[offset]
+    offset += 1
+
+    if tag == KNOWN:
+        return KNOWN_STRINGS[data[offset]], offset + 1
+    if tag == NONE:
+        return None, offset
+    if tag == U8:
+        return data[offset], offset + 1
+    if tag == U16:
+        return u16.unpack_from(data, offset)[0], offset + 2
+    if tag == DICT:
+        count = u32.unpack_from(data, offset)[0]
+        offset += 4
+        value = {}
+        for _ in range(count):
+            key, offset = decode_value(data, offset)
+            value[key], offset = decode_value(data, offset)
+        return value, offset
+    if tag == TRUE:
+        return True, offset
+    if tag == FALSE:
+        return False, offset
+    if tag == I64:
+        return i64.unpack_from(data, offset)[0], offset + 8
+    if tag == U128:
+        return int.from_bytes(data[offset:offset + 16], "little"), offset + 16
+    if tag == FLOAT:
+        return f64.unpack_from(data, offset)[0], offset + 8
+    if tag == LIST:
+        count = u32.unpack_from(data, offset)[0]
+        offset += 4
+        value = []
+        for _ in range(count):
+            item, offset = decode_value(data, offset)
+            value.append(item)
+        return value, offset
+
+    length = u32.unpack_from(data, offset)[0]
+    offset += 4
+    raw = bytes(data[offset:offset + length])
+    if tag == STR:
+        return raw.decode(), offset + length
+    if tag == BYTES:
+        return raw, offset + length
+    if tag == BIGINT:
+        return int(raw), offset + length
+    raise ValueError(f"Unknown tag {tag} in encoded data")
+
+def decode(data):
+    if data[0] == PACKED_IPV4 or data[0] == PACKED_IPV6:
+        return decode_packed(data)
+    if data[0] == RECORD:
+        values = []
+        offset = 1
+        for _ in Event.__slots__:
+            value, offset = decode_value(data, offset)
+            values.append(value)
+        return Event(*values)
+
+    return decode_value(data, 0)[0]
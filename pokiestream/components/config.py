@@ -4,32 +4,101 @@
 import yaml
 from types import SimpleNamespace
 from copy import deepcopy
-from pokiestream.components.validator import config_validation
+from pokiestream.components.validator import config_validation, sink_name
 import sys
 from pokiestream.components.args import args
 
 CONFIG = args.config if args.config else "config.yml"
 
 DEFAULTS = {
+    "queue_size": 10000,
+
+    "overload": {
+        "policy": "drop_newest",
+        "high_watermark": 0.9,
+        "low_watermark": 0.5,
+        "sample_rate": 0.1,
+        "spill": {
+            "path": "spill",
+            "segment_size": 67108864,
+            "max_bytes": 1073741824
+        }
+    },
+
     "NOT_RECOMMENDED": {
         "bypass_polling_delay": False,
     },
 
+    "capture": {
+        "backend": "scapy",
+        "decoder": "scapy",
+        "workers": 1,
+        "stats_interval": 60,
+        "ring": {
+            "block_size": 1048576,
+            "block_count": 64,
+            "frame_size": 2048,
+            "block_timeout": 100
+        }
+    },
+
+    "sessions": {
+        "shards": 16,
+        "max_sessions": 0,
+        "eviction": "oldest",
+        "max_expire_per_tick": 100000,
+        "active_timeout": 0
+    },
+
+    "metrics": {
+        "enabled": False,
+        "host": "127.0.0.1",
+        "port": 9108,
+        "log_interval": 0
+    },
+
     "filter": {
         "scapy": "",
+        "kernel": True,
         "strict": False,
         "payload": {
             "dns": {
                 "enabled": False,
                 "ports": [],
-                "match": []
-            }
+                "match": [],
+                "match_file": None
+            },
+            "tls": {
+                "enabled": False,
+                "ports": [443],
+                "match": [],
+                "match_file": None
+            },
+            "http": {
+                "enabled": False,
+                "ports": [80],
+                "match": [],
+                "match_file": None
+            },
+            "inspect_bytes": 4096
         }
     },
 
     "plugin": {
         "pass_config": False,
-        "path": None
+        "path": None,
+        "workers": 1,
+        "runtimes": 1,
+        "processes": 0,
+        "process": {
+            "ring_size": 16777216,
+            "timeout": 60
+        },
+        "ordered_sessions": True,
+        "batch": {
+            "max_size": 500,
+            "max_linger": 100
+        }
     }
 }
 
@@ -81,12 +150,14 @@ config_dict = config.__dict__
 merged_config = merge_defaults(DEFAULTS, config_dict)
 config = dtn(merged_config)
 
-def has_field(path):
-    keys = path.split(".")
-    current = config
-    try:
-        for key in keys:
-            current = getattr(current, key)
-        return True
-    except AttributeError:
-        return False
\ No newline at end of file
+# The plugin section is a single sink or a list of sinks, every sink has its own queue and workers.
+# A sink gets the plugin defaults and the global queue_size and overload settings, it can override all of them.
+# The single sink keeps the queue name of earlier versions (log_queue), the sinks of a list are named by sink_name.
+def load_sinks(merged):
+    shared = {"queue_size": merged["queue_size"], "overload": merged["overload"]}
+    plugin = merged["plugin"]
+    if not isinstance(plugin, list):
+        return [dtn(merge_defaults({**shared, "name": "log_queue"}, plugin))]
+    return [dtn(merge_defaults({**DEFAULTS["plugin"], **shared, "name": sink_name(sink)}, sink)) for sink in plugin]
+
+config.sinks = load_sinks(merged_config)
@@ -0,0 +1,169 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import asyncio
+import time
+from pokiestream.components.clock import clock
+from pokiestream.components.config import config
+from pokiestream.components.metrics import ERROR_LOG_INTERVAL, events_delivered, metrics, plugin_latency
+from pokiestream.components.queue import collect_batch, flow_hash, queues
+from pokiestream.components.plugin import load_plugin
+
+# A sink of the event stream: a plugin with its own queue, workers and metrics.
+# The sinks never wait for each other, and a plugin which raises an exception only loses the events it failed on.
+class Sink:
+    def __init__(self, settings, plugin):
+        self.settings = settings
+        self.name = settings.name
+        self.plugin = plugin
+        labels = {"sink": self.name}
+        self.delivered = metrics.counter("pokiestream_sink_events_delivered_total", "Events delivered to the sink", labels)
+        self.errors = metrics.counter("pokiestream_sink_errors_total", "Plugin calls of the sink which raised an exception", labels)
+        self.latency = metrics.histogram("pokiestream_sink_latency_seconds", "Time spent in the plugin receiver of the sink per call", labels=labels)
+        self.lag = metrics.histogram("pokiestream_sink_lag_seconds", "Time from the capture of an event until it was delivered to the sink", labels=labels)
+        self.last_error_log = None
+        self.suppressed_errors = 0
+
+    # the errors are printed at most once per ERROR_LOG_INTERVAL, like the packet errors
+    def failed(self, error):
+        self.errors.value += 1
+
+        now = time.monotonic()
+        if self.last_error_log is not None and now - self.last_error_log < ERROR_LOG_INTERVAL:
+            self.suppressed_errors += 1
+            return
+
+        suffix = f" ({self.suppressed_errors} more errors since the last report)" if self.suppressed_errors else ""
+        print(f"The plugin of sink {self.name} failed: {error!r}{suffix}")
+        self.last_error_log = now
+        self.suppressed_errors = 0
+
+    # the delay of an event from its capture
+    def observe_lag(self, data):
+        self.lag.observe(max(clock.time_ns() - data.time_ns, 0) / 1e9)
+
+# delivers a single event to the plugin of a sink, or prints it if the sink has no plugin
+async def deliver(sink, data):
+    plugin = sink.plugin
+    start = time.perf_counter()
+    try:
+        if plugin:
+            if sink.settings.pass_config:
+                await plugin.receiver(data, config)
+            else:
+                await plugin.receiver(data)
+
+        else:
+            print(f"{data}")
+
+    except Exception as e:
+        sink.failed(e)
+    else:
+        events_delivered.value += 1
+        sink.delivered.value += 1
+
+    elapsed = time.perf_counter() - start
+    plugin_latency.observe(elapsed)
+    sink.latency.observe(elapsed)
+    sink.observe_lag(data)
+
+# delivers a batch of events to a plugin which implements receiver_batch
+async def deliver_batch(sink, events):
+    plugin = sink.plugin
+    start = time.perf_counter()
+    try:
+        if sink.settings.pass_config:
+            await plugin.receiver_batch(events, config)
+        else:
+            await plugin.receiver_batch(events)
+
+    except Exception as e:
+        sink.failed(e)
+    else:
+        events_delivered.value += len(events)
+        sink.delivered.value += len(events)
+
+    elapsed = time.perf_counter() - start
+    plugin_latency.observe(elapsed)
+    sink.latency.observe(elapsed)
+    # the first event of the batch waited the longest
+    sink.observe_lag(events[0])
+
+# consumes events from a queue and delivers them to the plugin of a sink
+# the consumer simply waits for the next event, there is no polling involved
+async def consume(sink, async_q):
+    if sink.plugin and sink.plugin.receiver_batch:
+        batch_size = sink.settings.batch.max_size
+        batch_linger = sink.settings.batch.max_linger / 1000 if sink.plugin.linger is None else sink.plugin.linger
+
+        while True:
+            events = await collect_batch(async_q, batch_size, batch_linger)
+            await deliver_batch(sink, events)
+            for _ in events:
+                async_q.task_done()
+
+    while True:
+        data = await async_q.get()
+        await deliver(sink, data)
+        async_q.task_done()
+
+# routes the events to the worker queues
+# events of the same session always go to the same worker, so their order is kept
+async def dispatch(async_q, worker_queues):
+    count = len(worker_queues)
+    next_worker = 0
+
+    while True:
+        data = await async_q.get()
+
+        # events without a session (ICMP) have no ordering requirements
+        if data.session is None:
+            index = next_worker
+            next_worker = (next_worker + 1) % count
+        else:
+            index = flow_hash(data) % count
+
+        await worker_queues[index].put(data)
+        async_q.task_done()
+
+# returns the tasks which deliver the queue of a sink with its number of concurrent workers, and the queues they read
+def sink_tasks(sink):
+    settings = sink.settings
+    sink_queue = queues[sink.name].async_q
+    workers = settings.workers
+
+    if workers == 1 or not settings.ordered_sessions:
+        return [consume(sink, sink_queue) for _ in range(workers)], [sink_queue]
+
+    worker_queues = [asyncio.Queue(maxsize=max(1, (settings.queue_size or config.queue_size) // workers)) for _ in range(workers)]
+    tasks = [dispatch(sink_queue, worker_queues)] + [consume(sink, worker_queue) for worker_queue in worker_queues]
+    return tasks, [sink_queue] + worker_queues
+
+# process the queues of all sinks
+# if a producer task is given (replay), the events left in the queues are delivered once it finished, then it returns
+async def process_queue(producer=None):
+    tasks = []
+    sink_queues = []
+    for settings in config.sinks:
+        sink = Sink(settings, load_plugin(settings))
+        work, read = sink_tasks(sink)
+        tasks += work
+        sink_queues += read
+
+    if producer is None:
+        await asyncio.gather(*tasks)
+        return
+
+    consumers = [asyncio.create_task(task) for task in tasks]
+    try:
+        done, _ = await asyncio.wait([producer, *consumers], return_when=asyncio.FIRST_COMPLETED)
+        # a consumer only stops if it failed
+        for task in done:
+            task.result()
+
+        # the sink queues are joined before the worker queues they feed
+        for sink_queue in sink_queues:
+            await sink_queue.join()
+    finally:
+        for task in consumers:
+            task.cancel()
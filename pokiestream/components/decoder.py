@@ -0,0 +1,155 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import struct
+
+# Minimal header decoder working directly on the raw frame bytes.
+# It only extracts what PokieStream needs (L3/L4 addresses, ports and TCP flags)
+# and skips the full Scapy dissection of every packet.
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+VLAN_TYPES = (0x8100, 0x88A8, 0x9100)
+
+PROTO_ICMP = 1
+PROTO_TCP = 6
+PROTO_UDP = 17
+PROTO_ICMPV6 = 58
+
+# IPv6 extension headers we walk through to find the transport header
+IPV6_EXT_HEADERS = (0, 43, 60)
+IPV6_FRAGMENT = 44
+IPV6_AH = 51
+
+# Only echo request and reply are reported for ICMPv6
+ICMPV6_ECHO = (128, 129)
+
+u16 = struct.Struct("!H")
+u32 = struct.Struct("!I")
+ports = struct.Struct("!HH")
+
+# decodes an IPv4 packet starting at offset
+def decode_ipv4(buf, offset):
+    if len(buf) < offset + 20 or buf[offset] >> 4 != 4:
+        return None
+
+    header_length = (buf[offset] & 0x0F) * 4
+    prot_num = buf[offset + 9]
+    src = bytes(buf[offset + 12:offset + 16])
+    dst = bytes(buf[offset + 16:offset + 20])
+
+    # non-first fragments do not carry a transport header
+    if u16.unpack_from(buf, offset + 6)[0] & 0x1FFF:
+        return 4, src, dst, prot_num, None, offset + header_length
+
+    return 4, src, dst, prot_num, prot_num, offset + header_length
+
+# decodes an IPv6 packet starting at offset, following the extension header chain
+def decode_ipv6(buf, offset):
+    if len(buf) < offset + 40 or buf[offset] >> 4 != 6:
+        return None
+
+    prot_num = buf[offset + 6]
+    src = bytes(buf[offset + 8:offset + 24])
+    dst = bytes(buf[offset + 24:offset + 40])
+
+    next_header = prot_num
+    offset += 40
+    size = len(buf)
+
+    while True:
+        if next_header in IPV6_EXT_HEADERS:
+            if size < offset + 2:
+                return 6, src, dst, prot_num, None, offset
+            next_header, offset = buf[offset], offset + (buf[offset + 1] + 1) * 8
+        elif next_header == IPV6_FRAGMENT:
+            if size < offset + 8:
+                return 6, src, dst, prot_num, None, offset
+            if u16.unpack_from(buf, offset + 2)[0] & 0xFFF8:
+                return 6, src, dst, prot_num, None, offset + 8
+            next_header, offset = buf[offset], offset + 8
+        elif next_header == IPV6_AH:
+            if size < offset + 2:
+                return 6, src, dst, prot_num, None, offset
+            next_header, offset = buf[offset], offset + (buf[offset + 1] + 2) * 4
+        else:
+            return 6, src, dst, prot_num, next_header, offset
+
+# Decodes an Ethernet frame (with optional VLAN tags).
+# Returns None for frames that are not IPv4/IPv6, otherwise a tuple of
+# (ip_version, src, dst, protocol_num, transport, src_port, dst_port, tcp_flags, ip_offset, transport_offset)
+# where src and dst are the packed addresses and transport is None if there is no supported transport header.
+# The payload is only read with udp_payload and tcp_segment when it is needed.
+def decode_frame(frame):
+    buf = memoryview(frame)
+    if len(buf) < 14:
+        return None
+
+    ether_type = u16.unpack_from(buf, 12)[0]
+    ip_offset = 14
+    while ether_type in VLAN_TYPES:
+        if len(buf) < ip_offset + 4:
+            return None
+        ether_type = u16.unpack_from(buf, ip_offset + 2)[0]
+        ip_offset += 4
+
+    if ether_type == ETH_P_IP:
+        ip = decode_ipv4(buf, ip_offset)
+    elif ether_type == ETH_P_IPV6:
+        ip = decode_ipv6(buf, ip_offset)
+    else:
+        return None
+
+    if ip is None:
+        return None
+
+    version, src, dst, prot_num, transport, offset = ip
+    size = len(buf)
+
+    if transport == PROTO_TCP:
+        if size < offset + 20:
+            return version, src, dst, prot_num, None, None, None, None, ip_offset, offset
+        src_port, dst_port = ports.unpack_from(buf, offset)
+        flags = buf[offset + 13] | ((buf[offset + 12] & 0x01) << 8)
+        return version, src, dst, prot_num, transport, src_port, dst_port, flags, ip_offset, offset
+
+    if transport == PROTO_UDP:
+        if size < offset + 8:
+            return version, src, dst, prot_num, None, None, None, None, ip_offset, offset
+        src_port, dst_port = ports.unpack_from(buf, offset)
+        return version, src, dst, prot_num, transport, src_port, dst_port, None, ip_offset, offset
+
+    if transport == PROTO_ICMP and version == 4:
+        return version, src, dst, prot_num, transport, None, None, None, ip_offset, offset
+
+    if transport == PROTO_ICMPV6 and version == 6 and size > offset and buf[offset] in ICMPV6_ECHO:
+        return version, src, dst, prot_num, transport, None, None, None, ip_offset, offset
+
+    return version, src, dst, prot_num, None, None, None, None, ip_offset, offset
+
+# returns the end of the IP packet at ip_offset, anything after it is ethernet padding
+def packet_end(buf, ip_offset):
+    if buf[ip_offset] >> 4 == 4:
+        return min(len(buf), ip_offset + u16.unpack_from(buf, ip_offset + 2)[0])
+    payload_length = u16.unpack_from(buf, ip_offset + 4)[0]
+    # a zero payload length is a jumbogram
+    return min(len(buf), ip_offset + 40 + payload_length) if payload_length else len(buf)
+
+# returns the length of the IP packet at ip_offset from its header, the size counted by the flow records
+# (a truncated capture still counts the full packet)
+def ip_length(buf, ip_offset):
+    if buf[ip_offset] >> 4 == 4:
+        return (buf[ip_offset + 2] << 8) | buf[ip_offset + 3]
+    payload_length = (buf[ip_offset + 4] << 8) | buf[ip_offset + 5]
+    # a zero payload length is a jumbogram
+    return 40 + payload_length if payload_length else len(buf) - ip_offset
+
+# returns the payload of the UDP datagram at offset
+def udp_payload(frame, ip_offset, offset):
+    buf = memoryview(frame)
+    return buf[offset + 8:packet_end(buf, ip_offset)]
+
+# returns the sequence number and the payload of the TCP segment at offset
+def tcp_segment(frame, ip_offset, offset):
+    buf = memoryview(frame)
+    return u32.unpack_from(buf, offset + 4)[0], buf[offset + (buf[offset + 12] >> 4) * 4:packet_end(buf, ip_offset)]
@@ -0,0 +1,129 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import fnmatch
+import re
+
+# DNS support of the payload filter: a parser for the queried name working directly on the raw packet bytes,
+# and a domain matcher which doesn't get slower with the number of configured domains.
+
+DNS_HEADER_LENGTH = 12
+# the longest name allowed by RFC 1035 and the most compression pointers followed in a name
+MAX_NAME_LENGTH = 255
+MAX_POINTERS = 16
+
+# returns the first queried name of the DNS message at offset as it was sent (the case is kept) without the trailing dot,
+# or None if it is not a DNS message with a question or the name is malformed
+# a query of the root (a name without labels) returns the empty name, like the Scapy dissection did
+# buf is only sliced for the labels, the message itself is not copied
+def parse_query_name(buf, offset):
+    buf = memoryview(buf)
+    size = len(buf)
+    if size < offset + DNS_HEADER_LENGTH:
+        return None
+    # qdcount
+    if not (buf[offset + 4] or buf[offset + 5]):
+        return None
+
+    labels = []
+    length = 0
+    pointers = 0
+    position = offset + DNS_HEADER_LENGTH
+    while True:
+        if position >= size:
+            return None
+        label_length = buf[position]
+
+        if label_length == 0:
+            break
+
+        if label_length & 0xC0 == 0xC0:
+            if position + 1 >= size or pointers == MAX_POINTERS:
+                return None
+            target = offset + (((label_length & 0x3F) << 8) | buf[position + 1])
+            # a pointer must point backwards, so the name can't loop
+            if target >= position:
+                return None
+            pointers += 1
+            position = target
+            continue
+
+        if label_length & 0xC0:
+            # the extended label types are not used
+            return None
+
+        end = position + 1 + label_length
+        length += label_length + 1
+        if end > size or length > MAX_NAME_LENGTH:
+            return None
+        labels.append(bytes(buf[position + 1:end]))
+        position = end
+
+    return b".".join(labels).decode("utf-8", "replace")
+
+# The domain patterns of the payload filter.
+# Plain domains ("example.com") and wildcard domains ("*.example.com", any name below example.com) are stored in a trie of
+# the reversed labels, a name is matched by walking its labels from the top level domain, O(labels) for any number of patterns.
+# Other fnmatch patterns ("ex?mple.com", "*example.com") are rare and compiled into a single regex.
+# the markers of the patterns which end at a node, kept apart from the labels so no label can collide with them
+TERMINAL = object()
+WILDCARD = object()
+
+class DomainSet:
+    __slots__ = ("root", "regex", "size")
+
+    def __init__(self, patterns):
+        self.root = {}
+        self.size = 0
+        others = []
+
+        for pattern in patterns or ():
+            pattern = pattern.strip().lower().rstrip(".")
+            if not pattern:
+                continue
+            labels = pattern.split(".")
+            wildcard = labels[0] == "*"
+            if wildcard:
+                labels = labels[1:]
+
+            if any(char in label for label in labels for char in "*?[") or "" in labels:
+                others.append(pattern)
+                continue
+
+            node = self.root
+            for label in reversed(labels):
+                node = node.setdefault(label, {})
+            node[WILDCARD if wildcard else TERMINAL] = True
+            self.size += 1
+
+        self.regex = re.compile("|".join(f"(?:{fnmatch.translate(pattern)})" for pattern in others)) if others else None
+        self.size += len(others)
+
+    def __len__(self):
+        return self.size
+
+    # matches a name without the trailing dot, the names are case insensitive
+    def match(self, name):
+        name = name.lower()
+        node = self.root
+        labels = name.split(".")
+        # a name with an empty label (".example.com", "a..example.com") is not a valid domain
+        if "" in labels:
+            return False
+        for index in range(len(labels) - 1, -1, -1):
+            # a wildcard matches one or more labels below its domain
+            if WILDCARD in node:
+                return True
+            node = node.get(labels[index])
+            if node is None:
+                break
+        else:
+            if TERMINAL in node:
+                return True
+
+        return self.regex is not None and self.regex.match(name) is not None
+
+# reads a domain list file, one pattern per line, empty lines and lines starting with # are skipped
+def load_domain_file(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
@@ -0,0 +1,91 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import socket
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+
+# The packet log record passed from the capture to the plugins.
+# The capture only stores numbers: the addresses as integers, the timestamp in nanoseconds since the epoch and the session id
+# as a 128 bit integer. The addresses, the timestamp and the session id are rendered as strings when a plugin reads them.
+#
+# An event is a read-only mapping with the fields of the packet log format, so plugins written for dict
+# packet logs keep working (event["src_ip"], event.get(...), dict(event), **event). to_dict() returns a plain dict.
+
+EVENT_FIELDS = ("src_ip", "dst_ip", "src_port", "dst_port", "protocol_num", "protocol_name", "state", "timestamp", "session_id", "payload")
+FIELD_SET = frozenset(EVENT_FIELDS)
+
+ADDRESS_FAMILY = {4: socket.AF_INET, 6: socket.AF_INET6}
+ADDRESS_LENGTH = {4: 4, 6: 16}
+
+EPOCH = datetime(1970, 1, 1)
+
+# renders an integer address of the given IP version
+def format_address(version, address):
+    if address is None:
+        return None
+    return socket.inet_ntop(ADDRESS_FAMILY[version], address.to_bytes(ADDRESS_LENGTH[version], "big"))
+
+# renders a nanosecond timestamp in the packet log format (UTC, microseconds)
+def format_timestamp(time_ns):
+    return (EPOCH + timedelta(microseconds=time_ns // 1000)).isoformat(timespec="microseconds")
+
+# renders a session id (see sessions.SessionIdGenerator) as UUID text
+def format_session_id(session):
+    if session is None:
+        return None
+    digits = f"{session:032x}"
+    return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}"
+
+class Event(Mapping):
+    __slots__ = ("version", "src", "dst", "src_port", "dst_port", "protocol_num", "protocol_name", "state", "time_ns", "session", "payload")
+
+    def __init__(self, version, src, dst, src_port, dst_port, protocol_num, protocol_name, state, time_ns, session=None, payload=None):
+        self.version = version
+        self.src = src
+        self.dst = dst
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.protocol_num = protocol_num
+        self.protocol_name = protocol_name
+        self.state = state
+        self.time_ns = time_ns
+        self.session = session
+        self.payload = payload
+
+    @property
+    def src_ip(self):
+        return format_address(self.version, self.src)
+
+    @property
+    def dst_ip(self):
+        return format_address(self.version, self.dst)
+
+    @property
+    def timestamp(self):
+        return format_timestamp(self.time_ns)
+
+    @property
+    def session_id(self):
+        return format_session_id(self.session)
+
+    def __getitem__(self, key):
+        if key not in FIELD_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(EVENT_FIELDS)
+
+    def __len__(self):
+        return len(EVENT_FIELDS)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in EVENT_FIELDS}
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    # events are pickled between the capture workers and the main process in their compact form
+    def __reduce__(self):
+        return Event, (self.version, self.src, self.dst, self.src_port, self.dst_port, self.protocol_num, self.protocol_name, self.state, self.time_ns, self.session, self.payload)
@@ -2,67 +2,244 @@
 # Copyright (C) 2025  FXTELEKOM
 
 import ipaddress
-from pokiestream.components.config import config, has_field
-import fnmatch
-
-def get_attr_by_path(obj, path):
-    for attr in path.split('.'):
-        obj = getattr(obj, attr, None)
-        if obj is None:
-            return None
-    return obj
-
-# matches a source IP address against a list of subnets in the config
-def match_subnet(ip, field):
-    if not ((has_field("filter.source") and config.filter.source) or (has_field("filter.destination") and config.filter.destination)):
-        return True
-
-    subnet_list = getattr(config.filter, field, None)
-    if not subnet_list:
-        return False
-
-    subnets = [ipaddress.ip_network(subnet) for subnet in subnet_list]
-    try:
-        return any(ipaddress.ip_address(ip) in subnet for subnet in subnets)
-    except ValueError:
-        return False
-
-# matches a port against a list of ports in the config
-def match_port(port, field="filter.port"):
-    if not has_field(field):
-        return True
-
-    port_list = get_attr_by_path(config, field)
-    if port_list is None:
-        return True
-
-    return port in port_list
-
-# matches a protocol against a list of protocols in the config
-def match_protocol(protocol):
-    if not has_field("filter.protocol") or config.filter.protocol is None:
-        return True
-
-    protocol_list = config.filter.protocol
-    return protocol.lower() in protocol_list
-
+import socket
+from bisect import bisect_right
+from pokiestream.components.config import config
+from pokiestream.components.dns import DomainSet, load_domain_file
+
+# converts an IP address string to its version and integer value
+def ip_to_int(ip):
+    if ":" in ip:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+    return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+
+# A set of subnets stored as sorted, merged integer ranges per IP version.
+# Lookups are a single binary search instead of testing every subnet.
+class AddressSet:
+    __slots__ = ("_starts", "_ends", "size")
+
+    def __init__(self, subnets):
+        ranges = {4: [], 6: []}
+        for subnet in subnets or ():
+            network = ipaddress.ip_network(subnet)
+            ranges[network.version].append((int(network.network_address), int(network.broadcast_address)))
+
+        self._starts = {}
+        self._ends = {}
+        for version, items in ranges.items():
+            starts, ends = [], []
+            for start, end in sorted(items):
+                # merge overlapping and adjacent ranges
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self._starts[version] = starts
+            self._ends[version] = ends
+
+        self.size = len(self._starts[4]) + len(self._starts[6])
+
+    def contains_int(self, version, value):
+        starts = self._starts[version]
+        index = bisect_right(starts, value) - 1
+        return index >= 0 and value <= self._ends[version][index]
+
+    def __contains__(self, ip):
+        try:
+            version, value = ip_to_int(ip)
+        except (OSError, TypeError):
+            return False
+        return self.contains_int(version, value)
+
+    def __len__(self):
+        return self.size
+
+    # returns the smallest list of CIDR networks covering the ranges of an IP version
+    def networks(self, version):
+        address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+        networks = []
+        for start, end in zip(self._starts[version], self._ends[version]):
+            networks.extend(ipaddress.summarize_address_range(address(start), address(end)))
+        return networks
+
+# The filter section compiled once at startup.
+# Every per-packet decision is a set lookup, a binary search or a precomputed function.
+class FilterMatcher:
+    __slots__ = (
+        "strict", "source", "destination", "protocols", "ports",
+        "udp", "tcp", "icmp",
+        "dns_enabled", "dns_ports", "dns_match",
+        "tls_match", "http_match", "inspect_ports", "inspect_bytes",
+        "match_hosts_int",
+    )
+
+    def __init__(self, filter_config):
+        setattr_ = super().__setattr__
+
+        source = getattr(filter_config, "source", None)
+        destination = getattr(filter_config, "destination", None)
+        protocols = getattr(filter_config, "protocol", None)
+        ports = getattr(filter_config, "port", None)
+        payload = filter_config.payload
+        dns = payload.dns
+
+        setattr_("strict", bool(filter_config.strict))
+        setattr_("source", AddressSet(source))
+        setattr_("destination", AddressSet(destination))
+        setattr_("protocols", None if protocols is None else frozenset(p.lower() for p in protocols))
+        setattr_("ports", None if ports is None else frozenset(ports))
+
+        setattr_("udp", self.match_protocol("udp"))
+        setattr_("tcp", self.match_protocol("tcp"))
+        setattr_("icmp", self.match_protocol("icmp"))
+
+        setattr_("dns_enabled", bool(dns.enabled))
+        setattr_("dns_ports", None if dns.ports is None else frozenset(dns.ports))
+        setattr_("dns_match", compile_domains(dns))
+
+        # the TCP payload filters, the destination ports of the sessions whose first bytes are inspected
+        inspect_ports = {}
+        for kind in ("http", "tls"):
+            section = getattr(payload, kind, None)
+            if section is not None and section.enabled:
+                inspect_ports.update((port, kind) for port in section.ports or ())
+        setattr_("tls_match", compile_domains(getattr(payload, "tls", None)))
+        setattr_("http_match", compile_domains(getattr(payload, "http", None)))
+        setattr_("inspect_ports", inspect_ports)
+        setattr_("inspect_bytes", getattr(payload, "inspect_bytes", 4096))
+
+        setattr_("match_hosts_int", self._build_host_matcher(bool(source or destination)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FilterMatcher is immutable")
+
+    # precomputes the strict/non-strict source and destination decision
+    def _build_host_matcher(self, enabled):
+        if not enabled:
+            return lambda version, src, dst: True
+
+        source_contains = self.source.contains_int
+        destination_contains = self.destination.contains_int
+
+        if self.strict:
+            return lambda version, src, dst: source_contains(version, src) and destination_contains(version, dst)
+        return lambda version, src, dst: source_contains(version, src) or destination_contains(version, dst)
+
+    # matches the source and destination IP strings against the configured subnets
+    def match_hosts(self, src_ip, dst_ip):
+        try:
+            version, src = ip_to_int(src_ip)
+            dst = ip_to_int(dst_ip)[1]
+        except (OSError, TypeError):
+            return False
+        return self.match_hosts_int(version, src, dst)
+
+    # matches a destination port against the configured ports
+    def match_port(self, port):
+        return self.ports is None or port in self.ports
+
+    # matches a destination port against the DNS payload filter ports
+    def match_dns_port(self, port):
+        return self.dns_ports is None or port in self.dns_ports
+
+    # matches a protocol name against the configured protocols
+    def match_protocol(self, protocol):
+        return self.protocols is None or protocol.lower() in self.protocols
+
+# compiles the match list and the match file of a payload filter
+def compile_domains(section):
+    if section is None:
+        return None
+    patterns = list(getattr(section, "match", None) or ())
+    if getattr(section, "match_file", None):
+        patterns.extend(load_domain_file(section.match_file))
+    return DomainSet(patterns) if patterns else None
+
+# compiles the filter section of the config
+def compile_filter(filter_config):
+    return FilterMatcher(filter_config)
+
+# The filter section translated into a BPF expression, so the kernel drops the packets which the matcher would drop anyway
+# and they never reach PokieStream. The expression may let through packets which the matcher drops, never the other way around:
+#  - only UDP, TCP, ICMP and ICMPv6 echo packets of the enabled protocols pass, ports are matched against the destination port
+#  - IPv6 packets with extension headers only go through the host filter, BPF can't follow the header chain
+#  - with vlan, the expression is repeated behind a VLAN tag for the tags which were not stripped by the NIC
+BPF_NOTHING = "(ip and not ip)"
+IPV6_EXTENSION_HEADERS = (0, 43, 44, 51, 60)
+
+def bpf_hosts(direction, address_set):
+    terms = [f"{direction} net {network}" for version in (4, 6) for network in address_set.networks(version)]
+    if not terms:
+        return None
+    return "(" + " or ".join(terms) + ")"
+
+# the expression of one direction of the sessions: near is the side of the initiator ("src" for its own packets),
+# far the side of the responder ("src" for the replies)
+def bpf_direction(matcher, near, far):
+    hosts = None
+    if len(matcher.source) or len(matcher.destination):
+        source = bpf_hosts(near, matcher.source)
+        destination = bpf_hosts(far, matcher.destination)
+        if matcher.strict:
+            # both sides must match, so an empty side matches nothing
+            hosts = f"({source} and {destination})" if source and destination else BPF_NOTHING
+        else:
+            hosts = "(" + " or ".join(term for term in (source, destination) if term) + ")"
+
+    ports = None
+    if matcher.ports is not None:
+        ports = "(" + " or ".join(f"{far} port {port}" for port in sorted(matcher.ports)) + ")" if matcher.ports else BPF_NOTHING
+
+    protocols = []
+    for name, enabled in (("udp", matcher.udp), ("tcp", matcher.tcp)):
+        if enabled:
+            protocols.append(f"({name} and {ports})" if ports else name)
+    # ICMP has no sessions, only the packets matching the filter itself are logged
+    if matcher.icmp and near == "src":
+        protocols.append("icmp")
+        protocols.append("(icmp6 and (ip6[40] == 128 or ip6[40] == 129))")
+    if protocols:
+        protocols.append("(ip6 and (" + " or ".join(f"ip6[6] == {header}" for header in IPV6_EXTENSION_HEADERS) + "))")
+
+    expression = "(" + " or ".join(protocols) + ")" if protocols else BPF_NOTHING
+    if hosts:
+        expression = f"({hosts} and {expression})"
+    return expression
+
+# the replies of the UDP and TCP sessions pass the kernel filter too, they are counted by the flow records
+def bpf_expression(matcher, vlan=True):
+    expression = bpf_direction(matcher, "src", "dst")
+    has_filter = len(matcher.source) or len(matcher.destination) or matcher.ports is not None
+    if (matcher.udp or matcher.tcp) and has_filter:
+        expression = f"({expression} or {bpf_direction(matcher, 'dst', 'src')})"
+    if vlan:
+        expression = f"({expression} or (vlan and {expression}))"
+    return expression
+
+# combines the filter.scapy expression of the user with the expression of the filter section
+def combine_bpf(user_expression, expression):
+    if not user_expression:
+        return expression
+    return f"({user_expression}) and {expression}"
+
+matcher = compile_filter(config.filter)
 
 def match_host(hostname, type_):
     type_ = type_.lower()
-    if type_ not in ("dns"):
+    if type_ not in ("dns", "tls", "http"):
         return True
 
-    domain_list = None
+    domain_match = None
 
     if type_ == "dns":
-        domain_list = config.filter.payload.dns.match
+        domain_match = matcher.dns_match
+    elif type_ == "tls":
+        domain_match = matcher.tls_match
+    elif type_ == "http":
+        domain_match = matcher.http_match
 
-    if not domain_list:
+    if domain_match is None:
         return True
 
-    hostname = hostname.lower()
-    for pattern in domain_list:
-        if fnmatch.fnmatch(hostname, pattern.lower()):
-            return True
-
-    return False
+    return domain_match.match(hostname)
@@ -0,0 +1,278 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import asyncio
+import bisect
+import threading
+import time
+
+# Lightweight instrumentation of the pipeline.
+#
+# The counters are plain objects with a `value` attribute, the capture thread increments them with `counter.value += 1`,
+# there is no lock or function call on the packet path. Gauges are read from callbacks when the metrics are collected.
+# The metrics are exposed in the Prometheus text format over HTTP and can be logged periodically.
+#
+# Capture worker processes send snapshots of their metrics to the main process, which adds them to its own.
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+# returns the upper bound of the histogram bucket which contains the given quantile
+def quantile(buckets, counts, q):
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = q * total
+    seen = 0
+    for bound, count in zip(buckets, counts):
+        seen += count
+        if seen >= rank:
+            return bound
+    return float("inf")
+
+# latency buckets in seconds, from 10us to 10s
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def series_name(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+class Registry:
+    def __init__(self):
+        # name -> (type, help), in the order of registration
+        self.families = {}
+        # series -> metric object or gauge callback
+        self.series = {}
+        self.collectors = []
+        # the last snapshot of every capture worker process
+        self.workers = {}
+        self.lock = threading.Lock()
+
+    def register(self, kind, name, help_text, labels, metric):
+        series = series_name(name, labels)
+        with self.lock:
+            if series in self.series:
+                return self.series[series]
+            self.families.setdefault(name, (kind, help_text))
+            self.series[series] = metric
+        return metric
+
+    # returns the counter of the given name and labels, it is created on the first call
+    def counter(self, name, help_text, labels=None):
+        return self.register("counter", name, help_text, labels, Counter())
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, labels=None):
+        return self.register("histogram", name, help_text, labels, Histogram(buckets))
+
+    # a gauge is a callback which returns the current value
+    # counters kept by other components (e.g. the number of expired sessions) are registered with kind="counter"
+    def gauge(self, name, help_text, callback, labels=None, kind="gauge"):
+        with self.lock:
+            self.families.setdefault(name, (kind, help_text))
+            self.series[series_name(name, labels)] = callback
+
+    # adds a callback which updates metrics before they are collected (e.g. reading the kernel counters)
+    def collector(self, callback):
+        self.collectors.append(callback)
+
+    # returns the current values of the metrics of this process
+    def snapshot(self):
+        for callback in self.collectors:
+            try:
+                callback()
+            except Exception:
+                pass
+
+        values = {}
+        with self.lock:
+            series = list(self.series.items())
+
+        for key, metric in series:
+            if isinstance(metric, Counter):
+                values[key] = metric.value
+            elif isinstance(metric, Histogram):
+                values[key] = (list(metric.counts), metric.sum, metric.count)
+            else:
+                try:
+                    values[key] = metric()
+                except Exception:
+                    values[key] = 0
+        return values
+
+    # stores the snapshot of a capture worker process
+    def merge_worker(self, index, snapshot):
+        self.workers[index] = snapshot
+
+    # returns the values of this process and the capture workers added together
+    def collect(self):
+        values = self.snapshot()
+        for snapshot in list(self.workers.values()):
+            for key, value in snapshot.items():
+                current = values.get(key)
+                if isinstance(value, tuple):
+                    if current is None:
+                        values[key] = value
+                    else:
+                        values[key] = ([a + b for a, b in zip(current[0], value[0])], current[1] + value[1], current[2] + value[2])
+                else:
+                    values[key] = (current or 0) + value
+        return values
+
+    # renders the metrics in the Prometheus text exposition format
+    def render(self):
+        values = self.collect()
+        with self.lock:
+            families = list(self.families.items())
+            metrics = dict(self.series)
+
+        lines = []
+        for name, (kind, help_text) in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in values.items():
+                if key != name and not key.startswith(name + "{"):
+                    continue
+
+                if kind != "histogram":
+                    lines.append(f"{key} {value}")
+                    continue
+
+                counts, total, count = value
+                labels = key[len(name):]
+                cumulative = 0
+                for bound, bucket in zip(metrics[key].buckets, counts):
+                    cumulative += bucket
+                    lines.append(f"{name}_bucket{add_label(labels, 'le', bound)} {cumulative}")
+                lines.append(f"{name}_bucket{add_label(labels, 'le', '+Inf')} {count}")
+                lines.append(f"{name}_sum{labels} {total}")
+                lines.append(f"{name}_count{labels} {count}")
+
+        return "\n".join(lines) + "\n"
+
+def add_label(labels, key, value):
+    if not labels:
+        return f'{{{key}="{value}"}}'
+    return labels[:-1] + f',{key}="{value}"}}'
+
+metrics = Registry()
+
+# the metrics of the pipeline, the other components register their own metrics
+packets_seen = metrics.counter("pokiestream_packets_total", "Packets inspected by the capture")
+packets_matched = metrics.counter("pokiestream_packets_matched_total", "Packets which passed the host filter")
+packet_errors = metrics.counter("pokiestream_packet_errors_total", "Packets which could not be inspected")
+events_delivered = metrics.counter("pokiestream_events_delivered_total", "Events delivered to the plugin")
+plugin_latency = metrics.histogram("pokiestream_plugin_latency_seconds", "Time spent in the plugin receiver per call")
+
+# Errors of the packet inspection are counted and printed at most once per ERROR_LOG_INTERVAL,
+# a broken packet stream must not flood the console.
+ERROR_LOG_INTERVAL = 10
+last_error_log = None
+suppressed_errors = 0
+
+def report_packet_error(error):
+    global last_error_log, suppressed_errors
+    packet_errors.value += 1
+
+    now = time.monotonic()
+    if last_error_log is not None and now - last_error_log < ERROR_LOG_INTERVAL:
+        suppressed_errors += 1
+        return
+
+    suffix = f" ({suppressed_errors} more errors since the last report)" if suppressed_errors else ""
+    print(f"Failed to inspect a packet: {error!r}{suffix}")
+    last_error_log = now
+    suppressed_errors = 0
+
+# serves the metrics over HTTP, every request gets the metrics regardless of the path
+async def handle_metrics_request(reader, writer):
+    try:
+        # read the request line and the headers, the content does not matter
+        while True:
+            line = await asyncio.wait_for(reader.readline(), 5)
+            if not line or line in (b"\r\n", b"\n"):
+                break
+
+        body = metrics.render().encode()
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n" + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(host, port):
+    server = await asyncio.start_server(handle_metrics_request, host, port)
+    print(f"Metrics are served on http://{host}:{port}/metrics")
+    return server
+
+def value_of(values, name, labels=None):
+    return values.get(series_name(name, labels), 0)
+
+# returns the sum of the series of a metric which have the given label value, whatever their other labels are
+def label_total(values, name, label, value):
+    match = f'{label}="{value}"'
+    return sum(item for key, item in values.items() if key.startswith(name + "{") and (f"{{{match}" in key or f",{match}" in key))
+
+# returns the given quantile of a histogram over the last interval
+def interval_quantile(values, previous, name, buckets, q, labels=None):
+    key = series_name(name, labels)
+    counts, _, _ = values.get(key, ([], 0, 0))
+    previous_counts, _, _ = previous.get(key, ([0] * len(counts), 0, 0))
+    return quantile(buckets, [a - b for a, b in zip(counts, previous_counts)], q)
+
+# prints a line with the most important metrics every interval seconds
+# sinks are the names of the sinks (and their queues), every sink is listed if there are more than one
+async def log_stats(interval, sinks=("log_queue",)):
+    previous = metrics.collect()
+    while True:
+        await asyncio.sleep(interval)
+        values = metrics.collect()
+
+        def rate(name, labels=None):
+            return (value_of(values, name, labels) - value_of(previous, name, labels)) / interval
+
+        # the plugin latency of the last interval
+        latency = interval_quantile(values, previous, "pokiestream_plugin_latency_seconds", plugin_latency.buckets, 0.99)
+        depth = sum(value_of(values, "pokiestream_queue_depth", {"queue": name}) for name in sinks)
+
+        line = (
+            f"Stats: {rate('pokiestream_packets_total'):,.0f} pps, {rate('pokiestream_packets_matched_total'):,.0f} matched/s, "
+            f"{rate('pokiestream_events_delivered_total'):,.0f} events/s, "
+            f"queue {depth}, "
+            f"sessions udp {value_of(values, 'pokiestream_sessions', {'protocol': 'udp'})} tcp {value_of(values, 'pokiestream_sessions', {'protocol': 'tcp'})}, "
+            f"expired {rate('pokiestream_sessions_expired_total', {'protocol': 'udp'}) + rate('pokiestream_sessions_expired_total', {'protocol': 'tcp'}):,.0f}/s, "
+            f"kernel drops {value_of(values, 'pokiestream_kernel_drops_total')}, errors {value_of(values, 'pokiestream_packet_errors_total')}, "
+            f"plugin p99 {latency * 1000:.2f}ms"
+        )
+        if len(sinks) > 1:
+            details = []
+            for name in sinks:
+                lag = interval_quantile(values, previous, "pokiestream_sink_lag_seconds", LATENCY_BUCKETS, 0.99, {"sink": name})
+                details.append(
+                    f"{name} {rate('pokiestream_sink_events_delivered_total', {'sink': name}):,.0f}/s "
+                    f"queue {value_of(values, 'pokiestream_queue_depth', {'queue': name})} "
+                    f"dropped {label_total(values, 'pokiestream_events_dropped_total', 'queue', name)} "
+                    f"lag p99 {lag * 1000:.2f}ms"
+                )
+            line += "; sinks: " + ", ".join(details)
+        print(line)
+        previous = values
@@ -4,24 +4,78 @@
 from scapy.all import *
 from scapy.layers.inet import IP, TCP, UDP
 from scapy.layers.inet6 import IPv6, ICMPv6EchoRequest, ICMPv6EchoReply
-from datetime import datetime, timezone
-from pokiestream.components.match import match_subnet, match_port, match_protocol, match_host
+from scapy.layers.l2 import Ether
+from pokiestream.components.match import matcher, match_host, ip_to_int
 from pokiestream.components.udp import udp_session_manager
 from pokiestream.components.tcp import tcp_session_manager
-from pokiestream.components.queue import queues
+from pokiestream.components.queue import put_data_to_queue
 from pokiestream.components.config import config
+from pokiestream.components.clock import clock
+from pokiestream.components.event import Event
+from pokiestream.components.metrics import packets_seen, packets_matched, report_packet_error
+from pokiestream.components.decoder import decode_frame, ip_length, tcp_segment, udp_payload, PROTO_TCP, PROTO_UDP, PROTO_ICMP, PROTO_ICMPV6
+from pokiestream.components.dns import parse_query_name
 
 connections = {}
 
-# write data to queue synchronously as scapy is synchronous
-def put_data_to_queue(data, name='log_queue'):
-    if data:
-        queues[name].sync_q.put(data)
+# returns the payload of a dissected transport layer without the ethernet padding
+def scapy_payload(layer):
+    data = bytes(layer.payload)
+    padding = layer.getlayer(Padding)
+    if padding is not None:
+        data = data[:len(data) - len(padding.load)]
+    return data
+
+# handles a packet which already passed the source/destination filter
+# the addresses are the integers of the given IP version, time_ns is the capture time in nanoseconds
+# payload is called lazily and only when a payload filter needs the content of the packet,
+# it returns the payload of a UDP datagram or the sequence number and the payload of a TCP segment
+# length is the size of the IP packet, reply is set if only the reversed packet passed the filter:
+# such a packet can be the reply of a session, it is counted by the session but never starts one
+def process_packet(time_ns, version, src, dst, prot_num, transport, src_port, dst_port, flags, payload, length=0, reply=False):
+    # log udp only if its set in the config file and its a UDP packet
+    if transport == PROTO_UDP and matcher.udp:
+        create = not reply and matcher.match_port(dst_port)
+        if create or matcher.match_port(src_port):
+            udp_state, session_id, session_payload, responder = udp_session_manager.track_session_sync(version, src, src_port, dst, dst_port, length, create)
+
+            # We dont log if the session is not new as it's tracked and will be logged when it expires
+            if udp_state is None:
+                return
+
+            # Now we check if DNS is enabled in the config
+            if udp_state == "NEW" and matcher.dns_enabled and matcher.match_dns_port(dst_port):
+                queried_domain = parse_query_name(payload(), 0)
+                # We check if the queried domain matches any of the domains in the config
+                if queried_domain is not None and match_host(queried_domain, "dns"):
+                    put_data_to_queue(Event(version, src, dst, src_port, dst_port, prot_num, "UDP", udp_state, time_ns, session_id, {"dns": queried_domain}))
+                    return
+
+            # the initiator of the session is always the source of its events
+            if responder:
+                src, src_port, dst, dst_port = dst, dst_port, src, src_port
+            put_data_to_queue(Event(version, src, dst, src_port, dst_port, prot_num, "UDP", udp_state, time_ns, session_id, session_payload))
+        return
+
+    # log tcp only if its set in the config file and it has a TCP header
+    if transport == PROTO_TCP and matcher.tcp:
+        create = not reply and matcher.match_port(dst_port)
+        if create or matcher.match_port(src_port):
+            tcp_state, session_id, session_payload, responder = tcp_session_manager.track_session_sync(version, src, src_port, dst, dst_port, flags, payload, length, create)
+
+            if tcp_state is not None:
+                if responder:
+                    src, src_port, dst, dst_port = dst, dst_port, src, src_port
+                put_data_to_queue(Event(version, src, dst, src_port, dst_port, prot_num, "TCP", tcp_state, time_ns, session_id, session_payload))
+        return
+
+    if (transport == PROTO_ICMP or transport == PROTO_ICMPV6) and matcher.icmp and not reply:
+        put_data_to_queue(Event(version, src, dst, None, None, prot_num, "ICMPv6" if transport == PROTO_ICMPV6 else "ICMP", None, time_ns))
 
 # function to inspect packets with scapy
 def inspect_packets(packet):
-    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")
-    data = None
+    time_ns = clock.time_ns()
+    packets_seen.value += 1
 
     try:
         # check if the packet has an IP layer
@@ -30,81 +84,86 @@ def inspect_packets(packet):
             src_ip = ip_layer.src
             dst_ip = ip_layer.dst
             prot_num = ip_layer.proto
-        
+
         # check if the packet has an IPv6 layer
         elif IPv6 in packet:
             ip_layer = packet[IPv6]
             src_ip = ip_layer.src
             dst_ip = ip_layer.dst
             prot_num = ip_layer.nh
-        
+
+        else:
+            return
+
+        # check if the packet has a TCP, UDP or ICMP layer, everything else is ignored
+        if packet.haslayer(UDP):
+            layer = packet[UDP]
+            transport, src_port, dst_port, flags = PROTO_UDP, layer.sport, layer.dport, None
+            payload = lambda: scapy_payload(layer)
+        elif packet.haslayer(TCP):
+            layer = packet[TCP]
+            transport, src_port, dst_port, flags = PROTO_TCP, layer.sport, layer.dport, int(layer.flags)
+            payload = lambda: (layer.seq, scapy_payload(layer))
+        elif packet.haslayer(ICMP) or packet.haslayer(ICMPv6EchoRequest) or packet.haslayer(ICMPv6EchoReply):
+            transport, src_port, dst_port, flags, payload = PROTO_ICMPV6 if ip_layer.version == 6 else PROTO_ICMP, None, None, None, None
         else:
             return
 
-        # check if the packet has a TCP or UDP layer, everything else is ignored
-        if TCP in packet or UDP in packet or ICMP in packet or ICMPv6EchoRequest in packet or ICMPv6EchoReply in packet:
-            # check if the source or destination IP matches any of the subnets in the config
-            match_sources = match_subnet(src_ip, "source") or match_subnet(dst_ip, "destination")
-
-            # check if the source and destination IP matches any of the subnets in the config
-            if config.filter.strict:
-                match_sources = match_subnet(src_ip, "source") and match_subnet(dst_ip, "destination")
-
-            if match_sources:                        
-                # log udp only if its set in the config file and its a UDP packet
-                if match_protocol("udp") and packet.haslayer(UDP):
-                    src_port = packet[UDP].sport
-                    dst_port = packet[UDP].dport
-                    if match_port(dst_port):
-                        # Now we check if DNS is enabled in the config
-                        udp_state, session_id = udp_session_manager.track_session_sync(src_ip, src_port, dst_ip, dst_port)
-
-                        # We dont log if the session is not new as it's tracked and will be logged when it expires
-                        if udp_state is None:
-                            return
-
-                        if udp_state == "NEW":
-                            if config.filter.payload.dns.enabled:
-                                if match_port(dst_port, "filter.payload.dns.ports"):
-                                    # We check if its really a DNS request and if there is at least one question in it.
-                                    if packet.haslayer(DNS):
-                                        dns_layer = packet.getlayer(DNS)
-                                        # We check if there is at least one question in the DNS request
-                                        if dns_layer.qdcount > 0 and dns_layer.qd is not None:
-                                            queried_domain = dns_layer.qd.qname.decode("utf-8").rstrip(".")
-                                            # We check if the queried domain matches any of the domains in the config
-                                            if match_host(queried_domain, "dns"):
-                                                data = {"src_ip": src_ip, "dst_ip": dst_ip, "src_port": src_port, "dst_port": dst_port, "protocol_num": prot_num, "protocol_name": "UDP", "state": udp_state, "timestamp": timestamp, "session_id": session_id, "payload": {"dns": queried_domain}}
-                                                
-                                                put_data_to_queue(data)
-                                                return
-
-                        data = {"src_ip": src_ip, "dst_ip": dst_ip, "src_port": src_port, "dst_port": dst_port, "protocol_num": prot_num, "protocol_name": "UDP", "state": udp_state, "timestamp": timestamp, "session_id": session_id, "payload": None}
-                        
-                        put_data_to_queue(data)
-                        return
-
-                # log tcp only if its set in the config file and it has a TCP header
-                if match_protocol("tcp") and packet.haslayer(TCP):
-                    src_port = packet[TCP].sport
-                    dst_port = packet[TCP].dport
-
-                    if match_port(dst_port):
-                        flags = int(packet[TCP].flags)
-
-                        tcp_state, session_id = tcp_session_manager.track_session_sync(src_ip, src_port, dst_ip, dst_port, flags)
-
-                        if tcp_state is not None:
-                            data = {"src_ip": src_ip, "dst_ip": dst_ip, "src_port": src_port, "dst_port": dst_port, "protocol_num": prot_num, "protocol_name": "TCP", "state": tcp_state, "timestamp": timestamp, "session_id": session_id, "payload": None}
-                            put_data_to_queue(data)
-
-
-                if match_protocol("icmp") and (packet.haslayer(ICMP) or packet.haslayer(ICMPv6EchoRequest) or packet.haslayer(ICMPv6EchoReply)):
-                    if match_subnet(src_ip, "source") or match_subnet(dst_ip, "destination"):
-                        data = {"src_ip": src_ip, "dst_ip": dst_ip, "src_port": None, "dst_port": None, "protocol_num": prot_num, "protocol_name": "ICMPv6" if ip_layer.version == 6 else "ICMP", "state": None, "timestamp": timestamp, "session_id": None, "payload": None}
-                        
-                        put_data_to_queue(data)
-                        return
+        try:
+            version, src = ip_to_int(src_ip)
+            dst = ip_to_int(dst_ip)[1]
+        except (OSError, TypeError):
+            return
+
+        # check if the source and/or destination IP matches any of the subnets in the config (depending on strict mode)
+        # the reversed packet is matched too, it can be the reply of a UDP or TCP session
+        matched = matcher.match_hosts_int(version, src, dst)
+        reply = False
+        if not matched and (transport == PROTO_UDP or transport == PROTO_TCP):
+            matched = reply = matcher.match_hosts_int(version, dst, src)
+        if matched:
+            packets_matched.value += 1
+            length = ip_layer.len if version == 4 else ip_layer.plen + 40
+            process_packet(time_ns, version, src, dst, prot_num, transport, src_port, dst_port, flags, payload, length, reply)
+
+    except Exception as e:
+        report_packet_error(e)
+
+# function to inspect raw frames without a full scapy dissection
+# link_layer is the scapy class of the capture link type, frames of other link types are dissected with it
+def inspect_raw(frame, link_layer=Ether):
+    if link_layer is not Ether:
+        return inspect_packets(link_layer(frame))
+
+    time_ns = clock.time_ns()
+    packets_seen.value += 1
+
+    try:
+        decoded = decode_frame(frame)
+        if decoded is None:
+            return
+
+        version, src, dst, prot_num, transport, src_port, dst_port, flags, ip_offset, offset = decoded
+        if transport is None:
+            return
+
+        # check if the source and/or destination IP matches any of the subnets in the config (depending on strict mode)
+        src = int.from_bytes(src, "big")
+        dst = int.from_bytes(dst, "big")
+        # the reversed packet is matched too, it can be the reply of a UDP or TCP session
+        matched = matcher.match_hosts_int(version, src, dst)
+        reply = False
+        if not matched and (transport == PROTO_UDP or transport == PROTO_TCP):
+            matched = reply = matcher.match_hosts_int(version, dst, src)
+        if matched:
+            packets_matched.value += 1
+
+            # the payload is only read from the frame when a payload filter needs it
+            if transport == PROTO_TCP:
+                payload = lambda: tcp_segment(frame, ip_offset, offset)
+            else:
+                payload = lambda: udp_payload(frame, ip_offset, offset)
+            process_packet(time_ns, version, src, dst, prot_num, transport, src_port, dst_port, flags, payload, ip_length(frame, ip_offset), reply)
 
     except Exception as e:
-        print(e)
\ No newline at end of file
+        report_packet_error(e)
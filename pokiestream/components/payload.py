@@ -0,0 +1,166 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import re
+
+# Inspection of the first bytes a TCP client sends: the server name of a TLS ClientHello and the Host header of an HTTP request.
+#
+# Every parser gets the reassembled client data from the start of the stream and returns
+#  - the name (lower case) if it was found
+#  - None if more data is needed
+#  - False if the stream is not what the parser expects, the inspection is given up
+
+# parses the server_name extension of a TLS ClientHello, the handshake may span multiple records
+def parse_tls_sni(data):
+    if data and data[0] != 0x16:
+        return False
+
+    handshake = bytearray()
+    offset = 0
+    size = len(data)
+    while offset + 5 <= size:
+        # handshake records, SSL 3.0 or a TLS version
+        if data[offset] != 0x16 or data[offset + 1] != 3:
+            if offset:
+                break
+            return False
+        length = (data[offset + 3] << 8) | data[offset + 4]
+        handshake += data[offset + 5:offset + 5 + length]
+        offset += 5 + length
+
+    if len(handshake) < 4:
+        return None
+    # ClientHello
+    if handshake[0] != 1:
+        return False
+
+    # running out of data means more is needed, unless the whole ClientHello is there already
+    hello_end = 4 + int.from_bytes(handshake[1:4], "big")
+    more = None if len(handshake) < hello_end else False
+    available = min(len(handshake), hello_end)
+
+    # the fixed part: type, length, version, random
+    position = 4 + 2 + 32
+    # session id, cipher suites, compression methods
+    for length_size in (1, 2, 1):
+        if position + length_size > available:
+            return more
+        position += length_size + int.from_bytes(handshake[position:position + length_size], "big")
+
+    if position + 2 > available:
+        return more
+    extensions_end = min(position + 2 + ((handshake[position] << 8) | handshake[position + 1]), hello_end)
+    position += 2
+
+    while position + 4 <= extensions_end:
+        if position + 4 > available:
+            return more
+        extension = (handshake[position] << 8) | handshake[position + 1]
+        length = (handshake[position + 2] << 8) | handshake[position + 3]
+        position += 4
+        if extension != 0:
+            position += length
+            continue
+
+        # server name list: list length, name type, name length, name
+        if position + length > available:
+            return more
+        if length < 5 or handshake[position + 2] != 0:
+            return False
+        name_length = (handshake[position + 3] << 8) | handshake[position + 4]
+        if 5 + name_length > length:
+            return False
+        return bytes(handshake[position + 5:position + 5 + name_length]).decode("ascii", "replace").lower().rstrip(".") or False
+
+    # the ClientHello has no server name
+    return more if extensions_end > available else False
+
+HTTP_REQUEST_LINE = re.compile(rb"[A-Z]{3,16} \S+ HTTP/1\.[01]\Z")
+HTTP_METHOD_PREFIX = re.compile(rb"[A-Z]{0,16}\Z|[A-Z]{3,16} ")
+
+# parses the Host header of an HTTP/1.x request
+def parse_http_host(data):
+    data = bytes(data)
+    header_end = data.find(b"\r\n\r\n")
+    head = data if header_end < 0 else data[:header_end]
+    lines = head.split(b"\r\n")
+    if header_end < 0:
+        # the last line may be incomplete
+        incomplete = lines.pop()
+        if not lines:
+            return None if HTTP_METHOD_PREFIX.match(incomplete[:17]) else False
+
+    if not HTTP_REQUEST_LINE.match(lines[0]):
+        return False
+
+    for line in lines[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() != b"host":
+            continue
+        host = value.strip().decode("ascii", "replace").lower()
+        # the port is not part of the name, IPv6 literals are in brackets
+        if host.startswith("["):
+            host = host[1:host.find("]")] if "]" in host else host[1:]
+        else:
+            host = host.rsplit(":", 1)[0] if ":" in host else host
+        return host.rstrip(".") or False
+
+    return False if header_end >= 0 else None
+
+PARSERS = {"tls": parse_tls_sni, "http": parse_http_host}
+# the key of the found name in the payload of the events
+PAYLOAD_KEYS = {"tls": "sni", "http": "host"}
+
+# the most segments held back while waiting for a missing segment
+MAX_PENDING_SEGMENTS = 16
+
+# The client data of a TCP session, reassembled by sequence number until the parser finds the name.
+# Only the first `limit` bytes of the stream are kept, segments which arrive out of order are held until the gap is filled.
+class Inspection:
+    __slots__ = ("kind", "base", "limit", "data", "pending")
+
+    def __init__(self, kind, isn, limit):
+        self.kind = kind
+        # the sequence number of the first byte of the stream, the SYN takes one sequence number
+        self.base = (isn + 1) & 0xFFFFFFFF
+        self.limit = limit
+        self.data = bytearray()
+        self.pending = {}
+
+    # adds a segment of the client, returns the result of the parser (see above)
+    # the inspection also ends with False once the limit is reached without a result
+    def add(self, seq, payload):
+        if not payload:
+            return None
+
+        offset = (seq - self.base) & 0xFFFFFFFF
+        if offset >= self.limit:
+            return None if len(self.data) < self.limit else False
+        payload = payload[:self.limit - offset]
+
+        filled = len(self.data)
+        if offset > filled:
+            # a gap, the segment waits for the missing data
+            if len(self.pending) < MAX_PENDING_SEGMENTS:
+                self.pending[offset] = bytes(payload)
+            return None
+        if offset + len(payload) <= filled:
+            # a retransmission of data we already have
+            return None
+
+        self.data += payload[filled - offset:]
+        while self.pending:
+            filled = len(self.data)
+            ready = sorted(offset for offset in self.pending if offset <= filled)
+            if not ready:
+                break
+            for offset in ready:
+                segment = self.pending.pop(offset)
+                if offset + len(segment) > filled:
+                    self.data += segment[filled - offset:]
+                    filled = len(self.data)
+
+        result = PARSERS[self.kind](self.data)
+        if result is None and len(self.data) >= self.limit:
+            return False
+        return result
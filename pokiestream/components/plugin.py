@@ -1,12 +1,19 @@
 # SPDX-License-Identifier: AGPL-3.0
 # Copyright (C) 2025  FXTELEKOM
 
-import importlib.util
 import sys
 import os
 import asyncio
+import socket
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
 from lupa import LuaRuntime
 from pokiestream.components.config import config
+from pokiestream.components.metrics import metrics
+from pokiestream.components.plugin_process import Ring, encode_records, load_python_receivers
+from pokiestream.components.queue import flow_hash
 
 def convert_config_for_lua(config):
     if hasattr(config, '__dict__'): 
@@ -16,69 +23,340 @@ def convert_config_for_lua(config):
     else:
         return config
 
+# A loaded plugin. Plugins can implement receiver, receiver_batch or both.
+# receiver_batch is preferred when available as it receives the events in bulk.
+# linger overrides the max_linger of the batch settings in seconds, e.g. if the plugin is batched by its host and not by itself.
+class Plugin:
+    def __init__(self, name, receiver=None, receiver_batch=None, linger=None):
+        self.name = name
+        self.receiver = receiver
+        self.receiver_batch = receiver_batch
+        self.linger = linger
+
 def load_python_plugin(path):
-    if not os.path.isfile(path):
-        raise FileNotFoundError(f"Plugin file not found: {path}")
+    receiver, receiver_batch = load_python_receivers(path)
+    return Plugin(os.path.basename(path), receiver, receiver_batch)
+
+# the interval of the health checks of the plugin processes in seconds
+PROCESS_CHECK_INTERVAL = 1
+# the delay before a crashed plugin process is restarted in seconds, it doubles while the process keeps crashing
+MIN_RESTART_DELAY = 1
+MAX_RESTART_DELAY = 30
+# the directory which contains the pokiestream package, the plugin processes import it from there
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A worker process of a Python plugin (plugin.processes), the worker side is in plugin_process.
+# The process is restarted if it exits or doesn't answer a batch within the timeout, the batches it had are lost.
+class PluginProcess:
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.ring = Ring(pool.settings.process.ring_size)
+        self.process = None
+        self.conn = None
+        self.ready = asyncio.Event()
+        # signalled when the worker acknowledged a batch, the space of the batch is free again
+        self.space = asyncio.Event()
+        self.sequence = 0
+        # sequence -> (future, the time the batch was sent), in the order of the batches
+        self.waiting = {}
+        self.restart_delay = MIN_RESTART_DELAY
+        # why the process is not ready, the batches fail with it if the process doesn't come back within the timeout
+        self.error = None
+
+    # starts the process, the plugin is loaded by the process itself
+    def spawn(self):
+        parent_socket, child_socket = socket.socketpair()
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(path for path in (PACKAGE_ROOT, env.get("PYTHONPATH")) if path)
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "pokiestream.components.plugin_process", str(child_socket.fileno()), str(self.ring.fd), str(self.ring.size)],
+            pass_fds=(child_socket.fileno(), self.ring.fd), env=env
+        )
+        child_socket.close()
+        self.conn = Connection(parent_socket.detach())
+        self.ring.reset()
+
+        settings = self.pool.settings
+        self.conn.send((settings.path, config if settings.pass_config else None))
+
+    # the first start waits until the plugin is loaded, a plugin which can't be loaded stops PokieStream
+    def start(self):
+        self.spawn()
+        message = self.conn.recv()
+        if message[0] == "error":
+            raise RuntimeError(message[1])
+        self.listen()
+        self.ready.set()
+        return message[1], message[2]
+
+    def restart(self):
+        self.spawn()
+        self.listen()
+
+    def listen(self):
+        asyncio.get_running_loop().add_reader(self.conn.fileno(), self.readable)
+
+    def readable(self):
+        try:
+            while self.conn.poll():
+                message = self.conn.recv()
+                if message[0] == "done":
+                    self.done(*message[1:])
+                elif message[0] == "ready":
+                    self.ready.set()
+                    self.error = None
+                    print(f"Plugin process {self.index}{self.pool.suffix} restarted.")
+                else:
+                    self.error = f"The plugin process failed to load the plugin: {message[1]}"
+                    print(f"Plugin process {self.index}{self.pool.suffix} failed to load the plugin: {message[1]}")
+        except (EOFError, OSError):
+            self.exited()
+
+    def done(self, sequence, failed, error):
+        future, _ = self.waiting.pop(sequence)
+        self.ring.release()
+        self.space.set()
+        self.restart_delay = MIN_RESTART_DELAY
+        if not future.done():
+            future.set_result((failed, error))
+
+    # the process exited or was killed, the batches it had are failed and it is restarted after a delay
+    def exited(self):
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(self.conn.fileno())
+        self.conn.close()
+        if self.process.poll() is None:
+            self.process.kill()
+        code = self.process.wait()
+
+        self.ready.clear()
+        error = RuntimeError(f"The plugin process exited with code {code}")
+        # a failed load is the better reason
+        self.error = self.error or str(error)
+        for future, _ in self.waiting.values():
+            if not future.done():
+                future.set_exception(error)
+        self.waiting.clear()
+        self.ring.reset()
+        self.space.set()
+
+        self.pool.restarts.value += 1
+        print(f"Plugin process {self.index}{self.pool.suffix} exited with code {code}, restarting it in {self.restart_delay} seconds.")
+        loop.call_later(self.restart_delay, self.restart)
+        self.restart_delay = min(self.restart_delay * 2, MAX_RESTART_DELAY)
+
+    # kills the process if it exited without closing its socket or a batch took longer than the timeout
+    def check(self, now):
+        if not self.ready.is_set() or self.conn.closed:
+            return
+        if self.process.poll() is not None:
+            self.exited()
+            return
+        if self.waiting:
+            _, sent = next(iter(self.waiting.values()))
+            if now - sent > self.pool.settings.process.timeout:
+                print(f"Plugin process {self.index}{self.pool.suffix} did not answer for {self.pool.settings.process.timeout} seconds, killing it.")
+                self.process.kill()
 
-    module_name = os.path.splitext(os.path.basename(path))[0]
-    spec = importlib.util.spec_from_file_location(module_name, path)
-    if spec is None:
-        raise ImportError(f"Cannot load spec from: {path}")
+    # delivers a batch to the process and waits until it was processed, returns the number of failed events and the first error
+    # a batch which doesn't fit into half of the ring is split, the parts are sent in order
+    # a batch waits at most the timeout for a process which is restarted, then it fails with the reason of the restart
+    async def send(self, events):
+        buf = encode_records(events)
+        if len(buf) > self.ring.size // 2 and len(events) > 1:
+            middle = len(events) // 2
+            first_failed, first_error = await self.send(events[:middle])
+            failed, error = await self.send(events[middle:])
+            return first_failed + failed, first_error or error
+        if len(buf) > self.ring.size:
+            raise ValueError(f"The event is larger than the ring of the plugin process ({len(buf)} bytes)")
 
-    module = importlib.util.module_from_spec(spec)
-    sys.modules[module_name] = module
-    spec.loader.exec_module(module)
+        while True:
+            if not self.ready.is_set():
+                timeout = self.pool.settings.process.timeout
+                try:
+                    await asyncio.wait_for(self.ready.wait(), timeout)
+                except asyncio.TimeoutError:
+                    raise RuntimeError(f"The plugin process did not come back within {timeout} seconds: {self.error}") from None
+            offset = self.ring.reserve(len(buf))
+            if offset is not None:
+                break
+            self.space.clear()
+            await self.space.wait()
 
-    if not hasattr(module, "receiver"):
-        raise AttributeError(f"Python plugin must implement async 'receiver(data, config)'")
+        self.ring.write(offset, buf)
+        self.sequence += 1
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.sequence] = (future, time.monotonic())
+        try:
+            self.conn.send((self.sequence, offset, len(buf)))
+        except OSError:
+            self.exited()
+        return await future
 
-    if not asyncio.iscoroutinefunction(module.receiver):
-        raise TypeError("Python plugin receiver must be async function")
+# The worker processes of a Python plugin.
+# With ordered_sessions the events of a session always go to the same process, so they are processed in order,
+# else every batch goes to the process with the fewest batches waiting.
+class ProcessPool:
+    def __init__(self, settings, suffix):
+        self.settings = settings
+        self.suffix = suffix
+        labels = {"sink": settings.name}
+        self.restarts = metrics.counter("pokiestream_plugin_process_restarts_total", "Plugin processes which exited and were restarted", labels)
+        self.processes = [PluginProcess(self, index) for index in range(settings.processes)]
+        metrics.gauge("pokiestream_plugin_processes_ready", "Plugin processes which are running and have loaded the plugin", lambda: sum(process.ready.is_set() for process in self.processes), labels)
 
-    return module.receiver
+    # starts the processes, returns whether the plugin implements receiver and receiver_batch
+    def start(self):
+        for process in self.processes:
+            receivers = process.start()
+        asyncio.get_running_loop().create_task(self.check())
+        return receivers
 
-def load_lua_plugin(path):
+    async def check(self):
+        while True:
+            await asyncio.sleep(PROCESS_CHECK_INTERVAL)
+            now = time.monotonic()
+            for process in self.processes:
+                process.check(now)
+
+    async def receiver_batch(self, events, config=None):
+        processes = self.processes
+        if self.settings.ordered_sessions and len(processes) > 1:
+            parts = [[] for _ in processes]
+            for data in events:
+                parts[flow_hash(data) % len(processes)].append(data)
+            results = await asyncio.gather(*[process.send(part) for process, part in zip(processes, parts) if part])
+        else:
+            process = min(processes, key=lambda process: (not process.ready.is_set(), len(process.waiting)))
+            results = [await process.send(events)]
+
+        failed = sum(result[0] for result in results)
+        if failed:
+            error = next(result[1] for result in results if result[1])
+            raise RuntimeError(f"{failed} of {len(events)} events failed in the plugin processes, the first error: {error}")
+
+def load_process_plugin(sink, suffix):
+    pool = ProcessPool(sink, suffix)
+    receiver, receiver_batch = pool.start()
+    # a plugin with only a receiver gets the events which are waiting in the queue, the batch doesn't wait to fill up
+    return Plugin(os.path.basename(sink.path), receiver_batch=pool.receiver_batch, linger=None if receiver_batch else 0)
+
+# builds the Lua table of an event, a single call with the fields is much faster than converting a dict
+LUA_EVENT_TABLE = """
+function(src_ip, dst_ip, src_port, dst_port, protocol_num, protocol_name, state, timestamp, session_id, payload)
+    return {
+        src_ip = src_ip, dst_ip = dst_ip, src_port = src_port, dst_port = dst_port, protocol_num = protocol_num,
+        protocol_name = protocol_name, state = state, timestamp = timestamp, session_id = session_id, payload = payload
+    }
+end
+"""
+
+# A Lua runtime confined to a thread of its own.
+# A Lua state is not thread-safe, so the runtime is created by its thread and every call into it runs there, one at a time.
+# The Lua code runs without the GIL, so the runtimes of a pool run in parallel.
+class LuaWorker:
+    def __init__(self, code, pass_config):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pokiestream-lua")
+        self.executor.submit(self.start, code, pass_config).result()
+
+    def start(self, code, pass_config):
+        lua = LuaRuntime()
+        lua.execute(code)
+        self.lua = lua
+        self.receiver = lua.globals().receiver
+        self.receiver_batch = lua.globals().receiver_batch
+        self.event_table = lua.eval(LUA_EVENT_TABLE)
+        # the config is converted once, every call gets the same table
+        self.config = lua.table_from(convert_config_for_lua(config), recursive=True) if pass_config else None
+
+    def to_table(self, data):
+        payload = data.payload
+        if payload is not None:
+            payload = self.lua.table_from(payload, recursive=True)
+        return self.event_table(data.src_ip, data.dst_ip, data.src_port, data.dst_port, data.protocol_num, data.protocol_name, data.state, data.timestamp, data.session_id, payload)
+
+    # delivers a batch of events in the thread of the runtime
+    # a plugin with only a receiver gets the events one by one, a failing event doesn't stop the rest of the batch
+    def deliver(self, events):
+        args = () if self.config is None else (self.config,)
+        if self.receiver_batch:
+            self.receiver_batch(self.lua.table_from([self.to_table(data) for data in events]), *args)
+            return
+
+        error = None
+        failed = 0
+        for data in events:
+            try:
+                self.receiver(self.to_table(data), *args)
+            except Exception as e:
+                error = error or e
+                failed += 1
+        if error is not None and len(events) == 1:
+            raise error
+        if error is not None:
+            raise RuntimeError(f"{failed} of {len(events)} events failed, the first error: {error}") from error
+
+def load_lua_plugin(path, runtimes=1, pass_config=False):
     if not os.path.isfile(path):
         raise FileNotFoundError(f"Lua plugin file not found: {path}")
 
-    lua = LuaRuntime()
     with open(path, 'r') as f:
         lua_code = f.read()
 
-    lua.execute(lua_code)
-    lua_receiver = lua.globals().receiver
+    workers = [LuaWorker(lua_code, pass_config)]
+    if not workers[0].receiver and not workers[0].receiver_batch:
+        raise AttributeError("Lua plugin must implement 'receiver(data, config)' or 'receiver_batch(events, config)'")
+    # the runtimes of the pool share nothing, every one of them runs the plugin from the start
+    workers += [LuaWorker(lua_code, pass_config) for _ in range(runtimes - 1)]
 
-    if not lua_receiver:
-        raise AttributeError("Lua plugin must implement 'receiver(data, config)'")
+    # the idle runtimes, a call waits for the next free one
+    idle = None
 
-    def async_receiver(data, config=None):
-        async def _run():
-            if config and config.plugin.pass_config:
-                return await asyncio.to_thread(lua_receiver, data, convert_config_for_lua(config))
-            else:
-                return await asyncio.to_thread(lua_receiver, data)
-        return _run()
+    # the events are always delivered in batches, one thread switch per batch instead of one per event
+    async def receiver_batch(events, config=None):
+        nonlocal idle
+        if idle is None:
+            idle = asyncio.Queue()
+            for worker in workers:
+                idle.put_nowait(worker)
+
+        worker = await idle.get()
+        try:
+            await asyncio.get_running_loop().run_in_executor(worker.executor, worker.deliver, events)
+        finally:
+            idle.put_nowait(worker)
 
-    return async_receiver
+    # a plugin with only a receiver gets the events which are waiting in the queue, the batch doesn't wait to fill up
+    return Plugin(os.path.basename(path), receiver_batch=receiver_batch, linger=None if workers[0].receiver_batch else 0)
 
-def load_receiver():
-    if not config.plugin.path:
+# loads the plugin of a sink, a sink without a plugin prints the events
+def load_plugin(sink):
+    if not sink.path:
         return None
 
-    path = config.plugin.path
+    path = sink.path
     ext = os.path.splitext(path)[1].lower()
+    # the sinks of a plugin list are named in the messages
+    suffix = f" (sink {sink.name})" if len(config.sinks) > 1 else ""
 
     try:
         if ext == ".py":
-            receiver = load_python_plugin(path)
-            print(f"Python plugin loaded: {os.path.basename(path)}")
-            return receiver
+            if sink.processes:
+                plugin = load_process_plugin(sink, suffix)
+                print(f"Python plugin loaded: {plugin.name} in {sink.processes} processes{suffix}")
+            else:
+                plugin = load_python_plugin(path)
+                print(f"Python plugin loaded: {plugin.name}{suffix}")
+            return plugin
         elif ext == ".lua":
-            receiver = load_lua_plugin(path)
-            print(f"Lua plugin loaded: {os.path.basename(path)}")
-            return receiver
+            plugin = load_lua_plugin(path, sink.runtimes, sink.pass_config)
+            runtimes = f" with {sink.runtimes} runtimes" if sink.runtimes > 1 else ""
+            print(f"Lua plugin loaded: {plugin.name}{runtimes}{suffix}")
+            return plugin
         else:
             raise ValueError(f"Unsupported plugin type: {ext}")
 
     except Exception as e:
-        raise ValueError(f"Failed to load plugin: {e}")
\ No newline at end of file
+        raise ValueError(f"Failed to load plugin{suffix}: {e}")
@@ -0,0 +1,195 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import asyncio
+import importlib.util
+import mmap
+import os
+import signal
+import struct
+import sys
+import tempfile
+import traceback
+from multiprocessing.connection import Connection
+
+from pokiestream.components.codec import decode, encode
+
+# The worker process of a Python plugin which runs out of the main process (plugin.processes).
+#
+# The events are passed in a ring buffer in shared memory, in the binary encoding of the codec. Only the main process writes
+# the ring and only the worker reads it. The main process tells the worker the offset and the length of every batch on a
+# socket, and frees the space of the batch once the worker acknowledged it, so the ring itself has no read or write position.
+#
+# This module is also the entry point of the worker process (python -m pokiestream.components.plugin_process),
+# it must not import the config: the worker gets everything it needs from the main process.
+
+# the length of an encoded event in the ring
+record_header = struct.Struct("<I")
+
+# loads the receivers of a Python plugin, used by the main process and the worker processes
+def load_python_receivers(path):
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Plugin file not found: {path}")
+
+    module_name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    if spec is None:
+        raise ImportError(f"Cannot load spec from: {path}")
+
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+
+    receiver = getattr(module, "receiver", None)
+    receiver_batch = getattr(module, "receiver_batch", None)
+
+    if receiver is None and receiver_batch is None:
+        raise AttributeError(f"Python plugin must implement async 'receiver(data, config)' or 'receiver_batch(events, config)'")
+
+    if receiver is not None and not asyncio.iscoroutinefunction(receiver):
+        raise TypeError("Python plugin receiver must be async function")
+
+    if receiver_batch is not None and not asyncio.iscoroutinefunction(receiver_batch):
+        raise TypeError("Python plugin receiver_batch must be async function")
+
+    return receiver, receiver_batch
+
+# returns a file descriptor of shared memory of the given size, it is passed to the worker process
+# the memory has no name on the file system, so nothing is left behind if PokieStream crashes
+def create_shared_memory(size):
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("pokiestream-ring", os.MFD_CLOEXEC)
+    else:
+        fd, path = tempfile.mkstemp(prefix="pokiestream-ring-")
+        os.unlink(path)
+    os.ftruncate(fd, size)
+    return fd
+
+# returns the events of a batch in the ring as a single buffer
+def encode_records(events):
+    out = bytearray()
+    for data in events:
+        encoded = encode(data)
+        out += record_header.pack(len(encoded))
+        out += encoded
+    return out
+
+def decode_records(buf):
+    events = []
+    offset = 0
+    size = len(buf)
+    while offset < size:
+        length = record_header.unpack_from(buf, offset)[0]
+        offset += record_header.size
+        events.append(decode(buf[offset:offset + length]))
+        offset += length
+    return events
+
+# The main process side of the ring: the space of the batches which were not acknowledged yet.
+# The batches are acknowledged in the order they were written, the free space is always after the newest batch.
+class Ring:
+    def __init__(self, size):
+        self.size = size
+        self.fd = create_shared_memory(size)
+        self.map = mmap.mmap(self.fd, size)
+        # the end of the newest batch, and the start and the end of the batches in flight, oldest first
+        self.head = 0
+        self.batches = []
+
+    # returns the offset where a batch of `length` bytes fits, or None if it has to wait for space
+    def reserve(self, length):
+        if not self.batches:
+            self.head = 0
+            return 0 if length <= self.size else None
+
+        tail = self.batches[0][0]
+        if self.head > tail:
+            if self.head + length <= self.size:
+                return self.head
+            # wraps around to the start of the ring
+            return 0 if length <= tail else None
+        return self.head if self.head + length <= tail else None
+
+    def write(self, offset, buf):
+        end = offset + len(buf)
+        self.map[offset:end] = buf
+        self.head = end
+        self.batches.append((offset, end))
+
+    # frees the space of the oldest batch
+    def release(self):
+        self.batches.pop(0)
+
+    def reset(self):
+        self.head = 0
+        self.batches = []
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+# delivers a batch to the plugin, returns the number of events which failed and the first error
+async def deliver(events, receiver, receiver_batch, config):
+    args = () if config is None else (config,)
+    if receiver_batch is not None:
+        try:
+            await receiver_batch(events, *args)
+        except Exception as e:
+            return len(events), repr(e)
+        return 0, None
+
+    failed = 0
+    error = None
+    for data in events:
+        try:
+            await receiver(data, *args)
+        except Exception as e:
+            failed += 1
+            error = error or repr(e)
+    return failed, error
+
+# the main loop of the worker process, it exits when the main process closes the socket
+async def serve(conn, ring, receiver, receiver_batch, config):
+    loop = asyncio.get_running_loop()
+    batches = asyncio.Queue()
+
+    def readable():
+        try:
+            while conn.poll():
+                batches.put_nowait(conn.recv())
+        except (EOFError, OSError):
+            loop.remove_reader(conn.fileno())
+            batches.put_nowait(None)
+
+    loop.add_reader(conn.fileno(), readable)
+    while True:
+        batch = await batches.get()
+        if batch is None:
+            return
+        sequence, offset, length = batch
+        failed, error = await deliver(decode_records(ring[offset:offset + length]), receiver, receiver_batch, config)
+        conn.send(("done", sequence, failed, error))
+
+# entry point of the worker process: the socket to the main process, the shared memory of the ring and its size
+def main():
+    # Ctrl+C is handled by the main process, the worker exits when its socket is closed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    conn = Connection(int(sys.argv[1]))
+    ring = mmap.mmap(int(sys.argv[2]), int(sys.argv[3]))
+    path, config = conn.recv()
+
+    try:
+        receiver, receiver_batch = load_python_receivers(path)
+    except Exception as e:
+        conn.send(("error", f"{e}"))
+        return
+
+    conn.send(("ready", receiver is not None, receiver_batch is not None))
+    try:
+        asyncio.run(serve(conn, ring, receiver, receiver_batch, config))
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,298 @@
 # SPDX-License-Identifier: AGPL-3.0
 # Copyright (C) 2025  FXTELEKOM
 
+import asyncio
+import os
+import threading
+import time
+
 import culsans as janus
+from pokiestream.components.clock import clock
 from pokiestream.components.config import config
+from pokiestream.components.event import Event
+from pokiestream.components.metrics import metrics
+from pokiestream.components.spill import Spill
 
 queues = {}
+# the overload handling of the queues which do not block the capture, by queue name
+overloads = {}
+# the streams which are copied into the queues of multiple sinks: stream name -> queue names
+streams = {}
+# the counters of the times a queue with the block policy was full, by queue name
+full_counters = {}
+
+# Overload policies, they decide what happens with the new events when the plugin can't keep up.
+# block: the capture waits for free space in the queue, meanwhile the kernel drops the packets
+# drop_newest: the new events are dropped while the queue is full
+# drop_oldest: the oldest waiting event is dropped to make room for the new one
+# sample: while overloaded only the events of a fixed share of the flows are kept, every event of a kept flow is delivered
+# priority: while overloaded only the lifecycle events (CLOSE, ABORT, EXPIRED, EVICTED) are kept, NEW and ICMP events are dropped
+# spill: while overloaded the events are written to the disk and moved back to the queue once the plugin caught up
+OVERLOAD_POLICIES = ("block", "drop_newest", "drop_oldest", "sample", "priority", "spill")
+PRIORITY_STATES = frozenset(("CLOSE", "ABORT", "EXPIRED", "EVICTED"))
+# the flow hashes are reduced to this range for sampling
+SAMPLE_SPACE = 1 << 16
+# how often the spilled events are moved back to the queue in seconds and the maximum number of events moved at once
+SPILL_DRAIN_INTERVAL = 0.05
+SPILL_DRAIN_CHUNK = 1000
 
 # Create an asyncio queue using janus
-async def async_queue():
+async def async_queue(size=None):
     if not config.queue_size:
         config.queue_size = 10000
-    queue = janus.Queue(maxsize=config.queue_size)
+    queue = janus.Queue(maxsize=size or config.queue_size)
 
     return queue
 
+# The overload state of a queue.
+# The queue is overloaded when it fills above the high watermark and recovers when it drains below the low watermark,
+# the plugin receives an OVERLOAD event when it starts and a RECOVERED event with the number of dropped events when it ends.
+class Overload:
+    def __init__(self, name, sync_q, policy, maxsize, high_watermark, low_watermark, sample_rate, spill=None):
+        self.name = name
+        self.sync_q = sync_q
+        self.policy = policy
+        self.high = max(1, int(maxsize * high_watermark))
+        self.low = min(int(maxsize * low_watermark), self.high - 1)
+        self.sample_threshold = int(sample_rate * SAMPLE_SPACE)
+        self.spill = spill
+        self.active = False
+        self.started = None
+        # the events dropped since the overload started
+        self.dropped = 0
+        # the capture thread and the session cleanup both put events, the state changes are serialized
+        self.lock = threading.Lock()
+
+        self.dropped_total = metrics.counter("pokiestream_events_dropped_total", "Events dropped by the overload policy", {"queue": name, "policy": policy})
+        self.overloads = metrics.counter("pokiestream_overloads_total", "Times the queue got overloaded", {"queue": name})
+        metrics.gauge("pokiestream_overloaded", "Whether the queue is overloaded", lambda: int(self.active), {"queue": name})
+        if spill is not None:
+            self.spilled_total = metrics.counter("pokiestream_events_spilled_total", "Events written to the disk spill", {"queue": name})
+            metrics.gauge("pokiestream_spill_events", "Events waiting in the disk spill", lambda: len(spill), {"queue": name})
+            metrics.gauge("pokiestream_spill_bytes", "Disk space used by the spill segments", spill.size, {"queue": name})
+
+    def put(self, data):
+        sync_q = self.sync_q
+        depth = sync_q.qsize()
+        if self.active:
+            if depth <= self.low and not self.spilled():
+                self.recover()
+        elif depth >= self.high:
+            self.overload(depth)
+
+        if self.spill is not None:
+            self.put_spill(data)
+            return
+
+        if self.active and not self.keep(data):
+            self.drop()
+            return
+
+        try:
+            sync_q.put_nowait(data)
+            return
+        except janus.SyncQueueFull:
+            pass
+
+        if self.policy == "drop_oldest" and self.make_room():
+            try:
+                sync_q.put_nowait(data)
+                return
+            except janus.SyncQueueFull:
+                pass
+
+        self.drop()
+
+    # whether there are events on the disk which were not moved back to the queue yet
+    def spilled(self):
+        return self.spill is not None and self.spill.pending > 0
+
+    # the events are written to the disk while the queue is overloaded, and as long as the disk has events, so their order is kept
+    def put_spill(self, data):
+        spill = self.spill
+        with spill.lock:
+            if not self.active and not spill.pending:
+                try:
+                    self.sync_q.put_nowait(data)
+                    return
+                except janus.SyncQueueFull:
+                    pass
+            if spill.append(data):
+                self.spilled_total.value += 1
+                return
+
+        # the spill reached its size limit
+        self.drop()
+
+    # moves the spilled events back to the queue whenever it drained below the low watermark
+    async def drain(self):
+        spill = self.spill
+        sync_q = self.sync_q
+        while True:
+            await asyncio.sleep(SPILL_DRAIN_INTERVAL)
+            while spill.pending and sync_q.qsize() <= self.low:
+                with spill.lock:
+                    for data in spill.read(min(SPILL_DRAIN_CHUNK, self.high - sync_q.qsize())):
+                        sync_q.put_nowait(data)
+                await asyncio.sleep(0)
+
+            # the recovery is also noticed if no new events arrive
+            if self.active and not spill.pending and sync_q.qsize() <= self.low:
+                self.recover()
+
+    # whether an event is kept while the queue is overloaded
+    def keep(self, data):
+        if self.policy == "priority":
+            return data.state in PRIORITY_STATES
+        if self.policy == "sample":
+            return flow_hash(data) % SAMPLE_SPACE < self.sample_threshold
+        return True
+
+    def drop(self):
+        self.dropped += 1
+        self.dropped_total.value += 1
+
+    # drops the oldest waiting event, returns False if the consumer was faster
+    def make_room(self):
+        try:
+            self.sync_q.get_nowait()
+        except janus.SyncQueueEmpty:
+            return False
+        self.sync_q.task_done()
+        self.drop()
+        return True
+
+    def overload(self, depth):
+        with self.lock:
+            if self.active:
+                return
+            self.active = True
+            self.started = time.monotonic()
+            self.dropped = 0
+            self.overloads.value += 1
+        self.notify("OVERLOAD", {"queue": self.name, "policy": self.policy, "depth": depth})
+
+    def recover(self):
+        with self.lock:
+            if not self.active:
+                return
+            self.active = False
+            dropped = self.dropped
+        self.notify("RECOVERED", {"queue": self.name, "policy": self.policy, "dropped": dropped, "duration": round(time.monotonic() - self.started, 3)})
+
+    # the state events bypass the policy, the oldest event is dropped if there is no room for them
+    def notify(self, state, payload):
+        data = Event(None, None, None, None, None, None, None, state, clock.time_ns(), None, payload)
+        for _ in range(2):
+            try:
+                self.sync_q.put_nowait(data)
+                return
+            except janus.SyncQueueFull:
+                self.make_room()
+
+# the flow of an event for sampling and for the ordered workers, events without a session (ICMP) are hashed by their addresses
+# the hash of an integer is the integer itself and the low bits of the session ids are the same for every session
+# of a process (see SessionIdGenerator), the tuple hash mixes all bits of the id
+def flow_hash(data):
+    session = data.session
+    if session is None:
+        return hash((data.src, data.dst))
+    return hash((session,))
+
 # used to map multiple queues to different names
-async def create_queue(name):
-    queue = await async_queue()
+# policy overrides the overload policy of the config, e.g. the replay always blocks
+# settings has the queue_size and the overload settings of the queue (a sink), the global ones by default
+async def create_queue(name, policy=None, settings=None):
+    settings = settings or config
+    size = settings.queue_size or config.queue_size
+    queue = await async_queue(size)
     queues[name] = queue
+    metrics.gauge("pokiestream_queue_depth", "Events waiting in the queue", lambda: queues[name].sync_q.qsize(), {"queue": name})
+
+    overload = settings.overload
+    policy = policy or overload.policy
+    if policy == "block":
+        overloads.pop(name, None)
+        full_counters[name] = metrics.counter("pokiestream_queue_full_total", "Events which had to wait for free space in the queue", {"queue": name})
+        return
+
+    spill = None
+    if policy == "spill":
+        # the events left on the disk by a previous run are delivered first
+        spill = Spill(os.path.join(overload.spill.path, name), overload.spill.segment_size, overload.spill.max_bytes)
+        if len(spill):
+            print(f"Replaying {len(spill)} spilled events of {name} from {overload.spill.path}.")
+
+    overloads[name] = Overload(name, queue.sync_q, policy, size, overload.high_watermark, overload.low_watermark, overload.sample_rate, spill)
+    if spill is not None:
+        overloads[name].drainer = asyncio.create_task(overloads[name].drain())
+
+# creates a queue for every sink of a stream, the events put to the stream are copied into all of them
+# every queue applies the overload policy of its sink, so a slow sink only drops its own events
+# (with the block policy a full queue still makes the capture wait, which delays the other sinks too)
+async def create_stream(name, sinks, policy=None):
+    for sink in sinks:
+        await create_queue(sink.name, policy, sink)
+
+    names = tuple(sink.name for sink in sinks)
+    if names == (name,):
+        streams.pop(name, None)
+    else:
+        streams[name] = names
+
+# closes the spill files at the exit, the read positions are stored and the events left on the disk are replayed by the next run
+def close_queues():
+    for overload in overloads.values():
+        if overload.spill is not None:
+            overload.spill.close()
+
+# write data to the queue synchronously, used by the capture thread
+# the overload policy of the queue decides what happens if the queue is full, with the block policy the capture waits
+# an event put to a stream goes to the queues of all its sinks, they share the (read-only) event
+def put_data_to_queue(data, name='log_queue'):
+    if data is not None:
+        targets = streams.get(name)
+        if targets is None:
+            put_to_queue(data, name)
+            return
+        for target in targets:
+            put_to_queue(data, target)
+
+def put_to_queue(data, name):
+    overload = overloads.get(name)
+    if overload is not None:
+        overload.put(data)
+        return
+
+    sync_q = queues[name].sync_q
+    try:
+        sync_q.put_nowait(data)
+    except janus.SyncQueueFull:
+        full_counters[name].value += 1
+        sync_q.put(data)
+
+# Collects a batch of events from an async queue.
+# Waits for the first event, then collects until max_size events are collected
+# or linger seconds have passed since the first event.
+async def collect_batch(async_q, max_size, linger):
+    batch = [await async_q.get()]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + linger
+
+    while len(batch) < max_size:
+        try:
+            batch.append(async_q.get_nowait())
+            continue
+        except janus.AsyncQueueEmpty:
+            pass
+
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+
+        try:
+            batch.append(await asyncio.wait_for(async_q.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+
+    return batch
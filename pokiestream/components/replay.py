@@ -0,0 +1,90 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import math
+import time
+
+from scapy.config import conf
+from scapy.error import Scapy_Exception
+from scapy.layers.l2 import Ether
+from scapy.utils import RawPcapReader
+from pokiestream.components.clock import clock
+from pokiestream.components.config import config
+from pokiestream.components.packets import inspect_packets, inspect_raw
+from pokiestream.components.udp import udp_session_manager
+from pokiestream.components.tcp import tcp_session_manager
+
+# Replays a pcap or pcapng file through the same pipeline as a live capture.
+# The clock follows the timestamps of the packets (trace time), so the sessions expire as they did when the packets were captured.
+# With speed 0 the file is replayed as fast as possible, otherwise at the recorded pace multiplied by speed.
+
+# returns the capture time and the link type of a packet read by RawPcapReader or RawPcapNgReader
+def packet_info(reader, metadata):
+    if hasattr(metadata, "tsresol"):
+        if metadata.tshigh is None:
+            # simple packet blocks have no timestamp
+            return clock.time(), metadata.linktype
+        return ((metadata.tshigh << 32) | metadata.tslow) / metadata.tsresol, metadata.linktype
+
+    return metadata.sec + metadata.usec / (1e9 if reader.nano else 1e6), reader.linktype
+
+# expires the due sessions in trace time
+def expire_sessions(now):
+    udp_session_manager.expire_sync(now)
+    tcp_session_manager.expire_sync(now)
+
+def replay(path, speed=0):
+    raw = config.capture.decoder == "raw"
+    if not raw:
+        conf.debug_dissector = 2
+
+    packets = 0
+    started = time.monotonic()
+    first_timestamp = None
+    next_tick = None
+
+    with RawPcapReader(path) as reader:
+        for frame, metadata in reader:
+            timestamp, linktype = packet_info(reader, metadata)
+            packets += 1
+
+            if speed:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                delay = (timestamp - first_timestamp) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+            clock.advance(timestamp)
+            # the sessions are expired once per trace second, just like the cleanup of a live capture
+            now = clock.time()
+            if next_tick is None or now >= next_tick:
+                expire_sessions(now)
+                next_tick = math.floor(now) + 1
+
+            link_layer = conf.l2types.num2layer.get(linktype, Ether)
+            if raw:
+                inspect_raw(frame, link_layer)
+                continue
+
+            try:
+                packet = link_layer(frame)
+            except Exception:
+                continue
+            inspect_packets(packet)
+
+    # end of the file, the remaining sessions expire when their timeout is over
+    last_expiration = max(udp_session_manager.last_expiration() or 0, tcp_session_manager.last_expiration() or 0)
+    if last_expiration:
+        clock.advance(last_expiration)
+        expire_sessions(clock.time())
+
+    elapsed = time.monotonic() - started
+    print(f"Replayed {packets} packets from {path} in {elapsed:.2f} seconds ({packets / max(elapsed, 1e-9):,.0f} packets/s).")
+
+# replays a capture file, errors are printed just like the errors of the live sniffer
+def run_replay(path, speed=0):
+    try:
+        replay(path, speed)
+    except (OSError, EOFError, Scapy_Exception) as e:
+        print(f"There is an error with the replay: {e}")
@@ -0,0 +1,273 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from pokiestream.components.clock import clock
+from pokiestream.components.timer import TimingWheel
+
+# Compact session storage shared by the UDP and TCP session managers.
+# Sessions are keyed by a single integer which packs both addresses and ports,
+# and the session data is stored in slotted records instead of dicts.
+
+# The marker bit tells IPv4 and IPv6 keys apart: endpoint bits * 2 (+ the marker bit)
+V4_ENDPOINT_BITS = 32 + 16
+V6_ENDPOINT_BITS = 128 + 16
+V4_MARKER = 1 << (V4_ENDPOINT_BITS * 2)
+V6_MARKER = 1 << (V6_ENDPOINT_BITS * 2)
+
+ENDPOINT_BITS = {4: V4_ENDPOINT_BITS, 6: V6_ENDPOINT_BITS}
+
+# Packs the endpoints into a direction independent key for both directions of a connection, the addresses are integers
+# as they come from the decoder. Returns the key and whether the source is the first endpoint of the key.
+def pack_canonical_key_int(version, src, src_port, dst, dst_port):
+    bits = ENDPOINT_BITS[version]
+    src = (src << 16) | src_port
+    dst = (dst << 16) | dst_port
+    if src <= dst:
+        return (1 << (bits * 2)) | (src << bits) | dst, True
+    return (1 << (bits * 2)) | (dst << bits) | src, False
+
+# unpacks a session key into (version, src, src_port, dst, dst_port) with integer addresses
+def unpack_key_int(key):
+    if key >= V6_MARKER:
+        version, bits = 6, V6_ENDPOINT_BITS
+    else:
+        version, bits = 4, V4_ENDPOINT_BITS
+    mask = (1 << bits) - 1
+    src = (key >> bits) & mask
+    dst = key & mask
+    return version, src >> 16, src & 0xFFFF, dst >> 16, dst & 0xFFFF
+
+# Session ids are 128 bit integers in the UUIDv7 layout, they are rendered as UUID text only when a plugin reads them.
+#
+#   48 bits  unix time in milliseconds
+#    4 bits  version (7)
+#   12 bits  counter of the sessions created in the same millisecond
+#    2 bits  variant (0b10)
+#    8 bits  capture worker index
+#   54 bits  random, drawn once per process
+#
+# The ids of a process are strictly increasing: if the counter overflows, the next millisecond is borrowed.
+# The worker index keeps the ids of the sharded capture workers apart, the random bits the ids of different hosts and restarts.
+SESSION_ID_VERSION = 0x7 << 76
+SESSION_ID_VARIANT = 0b10 << 62
+SESSION_ID_COUNTER_MAX = 0xFFF
+SESSION_ID_WORKERS = 256
+
+class SessionIdGenerator:
+    def __init__(self, worker=0):
+        self.lock = threading.Lock()
+        self.last_ms = 0
+        self.counter = 0
+        self.set_worker(worker)
+
+    # called in the capture worker processes, the random bits are drawn again as the worker is forked
+    def set_worker(self, worker):
+        self.node = SESSION_ID_VARIANT | (worker % SESSION_ID_WORKERS) << 54 | int.from_bytes(os.urandom(7), "big") >> 2
+
+    def next(self):
+        now_ms = time.time_ns() // 1000000
+        with self.lock:
+            if now_ms > self.last_ms:
+                self.last_ms = now_ms
+                self.counter = 0
+            elif self.counter < SESSION_ID_COUNTER_MAX:
+                self.counter += 1
+            else:
+                self.last_ms += 1
+                self.counter = 0
+            return self.last_ms << 80 | SESSION_ID_VERSION | self.counter << 64 | self.node
+
+session_ids = SessionIdGenerator()
+
+# Both session records count the packets and bytes (of the IP packets) in both directions:
+# the packets of the initiator of the session and the replies of the other side.
+# report_at is the time of the next interim flow record of an active session (None if they are disabled).
+class UDPSession:
+    # forward is True if the initiator is the first endpoint of the canonical key
+    __slots__ = ("session_id", "forward", "first_seen", "last_seen", "expiration", "timer", "packets", "bytes", "reply_packets", "reply_bytes", "report_at")
+
+    def __init__(self, session_id, forward, now, expiration, length=0, report_at=None):
+        self.session_id = session_id
+        self.forward = forward
+        self.first_seen = now
+        self.last_seen = now
+        self.expiration = expiration
+        self.timer = None
+        self.packets = 1
+        self.bytes = length
+        self.reply_packets = 0
+        self.reply_bytes = 0
+        self.report_at = report_at
+
+class TCPSession:
+    # forward is True if the initiator is the first endpoint of the canonical key
+    # inspect is the payload inspection of the client data while it is running, payload is what it found
+    __slots__ = ("session_id", "forward", "state", "first_seen", "last_seen", "expiration", "timer", "inspect", "payload", "packets", "bytes", "reply_packets", "reply_bytes", "report_at")
+
+    def __init__(self, session_id, forward, now, expiration, inspect=None, length=0, report_at=None):
+        self.session_id = session_id
+        self.forward = forward
+        self.state = "NEW"
+        self.first_seen = now
+        self.last_seen = now
+        self.expiration = expiration
+        self.timer = None
+        self.inspect = inspect
+        self.payload = None
+        self.packets = 1
+        self.bytes = length
+        self.reply_packets = 0
+        self.reply_bytes = 0
+        self.report_at = report_at
+
+# counts a packet of a session in its direction
+def count_packet(sess, forward, length, now):
+    sess.last_seen = now
+    if forward == sess.forward:
+        sess.packets += 1
+        sess.bytes += length
+    else:
+        sess.reply_packets += 1
+        sess.reply_bytes += length
+
+# returns the flow record of a session, the counters are the totals since the session started
+# the duration is the time between the first and the last packet of the session
+def flow_payload(sess, payload=None):
+    record = dict(payload) if payload else {}
+    record["packets"] = sess.packets
+    record["bytes"] = sess.bytes
+    record["reply_packets"] = sess.reply_packets
+    record["reply_bytes"] = sess.reply_bytes
+    record["duration"] = round(sess.last_seen - sess.first_seen, 3)
+    return record
+
+# A session table with an optional hard limit on the number of sessions.
+# When the table is full, adding a session evicts one according to the eviction policy:
+#  - oldest: the session which was created first
+#  - lru: the session which has not seen a packet for the longest time
+class SessionTable:
+    def __init__(self, max_sessions=0, eviction="oldest"):
+        self.max_sessions = max_sessions
+        self.lru = max_sessions > 0 and eviction == "lru"
+        # a plain dict is enough (and smaller) if there is no limit to enforce
+        self.sessions = OrderedDict() if max_sessions > 0 else {}
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, key):
+        return key in self.sessions
+
+    # returns the session, in lru mode it is also marked as the most recently used one
+    def get(self, key):
+        sess = self.sessions.get(key)
+        if sess is not None and self.lru:
+            self.sessions.move_to_end(key)
+        return sess
+
+    # adds a new session, returns the evicted (key, session) or None
+    def add(self, key, sess):
+        evicted = None
+        if self.max_sessions and len(self.sessions) >= self.max_sessions:
+            evicted = self.sessions.popitem(last=False)
+            self.evicted += 1
+
+        self.sessions[key] = sess
+        return evicted
+
+    def pop(self, key, default=None):
+        return self.sessions.pop(key, default)
+
+# the number of sessions expired while holding the lock of a shard
+EXPIRE_CHUNK = 1000
+# 2^64 / golden ratio
+FIBONACCI_MULTIPLIER = 0x9E3779B97F4A7C15
+
+# One stripe of a session manager, with its own table, timers and lock
+class SessionShard:
+    def __init__(self, max_sessions=0, eviction="oldest"):
+        self.sessions = SessionTable(max_sessions, eviction)
+        self.timers = TimingWheel()
+        self.lock = threading.Lock()
+
+# Base of the UDP and TCP session managers.
+# The sessions are partitioned into hash striped shards, so the capture threads and the cleanup
+# only contend for the lock of a single shard instead of the whole table.
+# The session limit is split evenly between the shards, so eviction happens per shard.
+class ShardedSessionManager:
+    def __init__(self, shards=16, max_sessions=0, eviction="oldest", max_expire_per_tick=100000):
+        shard_limit = -(-max_sessions // shards) if max_sessions else 0
+        self.shards = [SessionShard(shard_limit, eviction) for _ in range(shards)]
+        self.max_expire_per_tick = max_expire_per_tick
+        self.cleanup_lock = asyncio.Lock()
+        # the cleanup starts at a different shard every time, so a burst in one shard can't starve the others
+        self.next_shard = 0
+        # the number of expired sessions, exposed as a metric
+        self.expired_total = 0
+
+    def __len__(self):
+        return sum(len(shard.sessions) for shard in self.shards)
+
+    # The hash of an int is the int modulo a Mersenne prime, which keeps the patterns of the packed keys,
+    # so it is spread with a Fibonacci multiplier before picking the shard.
+    def shard(self, key):
+        return self.shards[((hash(key) * FIBONACCI_MULTIPLIER) >> 64) % len(self.shards)]
+
+    # the number of sessions evicted because of the session limit
+    def evicted(self):
+        return sum(shard.sessions.evicted for shard in self.shards)
+
+    # reports an expired session, implemented by the session managers
+    def expired(self, key, sess):
+        raise NotImplementedError
+
+    # expires at most `limit` due sessions of a shard, returns whether it has more due sessions
+    def expire_shard(self, shard, now, limit=0):
+        with shard.lock:
+            expired_sessions = shard.timers.advance(now, limit)
+            for key, _ in expired_sessions:
+                shard.sessions.pop(key)
+            behind = shard.timers.behind(now)
+            self.expired_total += len(expired_sessions)
+
+        for key, sess in expired_sessions:
+            self.expired(key, sess)
+
+        return len(expired_sessions), behind
+
+    # Cleanup expired sessions
+    # At most max_expire_per_tick sessions are expired at once, the shards are walked one by one
+    # and the event loop is released between them and after every chunk
+    async def cleanup_sessions(self):
+        now = clock.time()
+        budget = self.max_expire_per_tick
+        count = len(self.shards)
+        start = self.next_shard
+        self.next_shard = (start + 1) % count
+
+        async with self.cleanup_lock:
+            for index in range(count):
+                shard = self.shards[(start + index) % count]
+                while budget > 0:
+                    expired, behind = self.expire_shard(shard, now, min(EXPIRE_CHUNK, budget))
+                    budget -= expired
+                    if not behind:
+                        break
+                    await asyncio.sleep(0)
+
+                await asyncio.sleep(0)
+
+    # expires every due session at once, used when the packets are replayed from a file
+    def expire_sync(self, now):
+        for shard in self.shards:
+            self.expire_shard(shard, now)
+
+    # returns the expiration of the session which expires last, or None if there are no sessions
+    def last_expiration(self):
+        return max((sess.expiration for shard in self.shards for sess in shard.sessions.sessions.values()), default=None)
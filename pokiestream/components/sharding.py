@@ -0,0 +1,117 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import culsans as janus
+from pokiestream.components.capture import run_sniffer
+from pokiestream.components.config import config
+from pokiestream.components.metrics import metrics
+from pokiestream.components.queue import create_queue, put_data_to_queue, queues
+from pokiestream.components.sessions import session_ids
+from pokiestream.components.udp import start_cleanup_task as start_udp_cleanup_task
+from pokiestream.components.tcp import start_cleanup_task as start_tcp_cleanup_task
+
+# Sharded capture: N worker processes join the same PACKET_FANOUT group in flow hash mode.
+# Every worker captures, filters and tracks its own share of the flows with its own session managers,
+# then forwards the events in batches to the main process which hosts the plugin.
+
+# The maximum number of events sent to the main process in one message
+FORWARD_BATCH_SIZE = 512
+# The interval of the metrics snapshots sent to the main process in seconds
+METRICS_INTERVAL = 1
+
+# sends the events of the worker queue to the main process
+# events are batched only as long as there are more of them waiting, so there is no added latency
+def forward_events(conn, send_lock):
+    sync_q = queues['log_queue'].sync_q
+
+    while True:
+        batch = [sync_q.get()]
+        while len(batch) < FORWARD_BATCH_SIZE:
+            try:
+                batch.append(sync_q.get_nowait())
+            except janus.SyncQueueEmpty:
+                break
+
+        with send_lock:
+            conn.send(batch)
+
+# sends the metrics of the worker to the main process, they are sent as a dict on the same pipe as the event batches
+def forward_metrics(conn, send_lock):
+    while True:
+        time.sleep(METRICS_INTERVAL)
+        snapshot = metrics.snapshot()
+        with send_lock:
+            conn.send(snapshot)
+
+async def capture_worker_main(conn, fanout_group):
+    # the worker waits for the pipe, the overload policy is applied by the main process
+    await create_queue('log_queue', "block")
+
+    send_lock = threading.Lock()
+    threading.Thread(target=forward_events, args=(conn, send_lock), daemon=True).start()
+    threading.Thread(target=forward_metrics, args=(conn, send_lock), daemon=True).start()
+    sniffer_thread = threading.Thread(target=run_sniffer, args=(fanout_group,), daemon=True)
+    sniffer_thread.start()
+
+    asyncio.create_task(start_udp_cleanup_task())
+    asyncio.create_task(start_tcp_cleanup_task())
+
+    # the worker exits when the capture stops
+    await asyncio.to_thread(sniffer_thread.join)
+
+# entry point of a capture worker process
+def run_capture_worker(index, conn, fanout_group):
+    # Ctrl+C is handled by the main process, the workers are stopped with it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # the worker index is part of the session ids, so the workers never create the same id
+    session_ids.set_worker(index)
+    try:
+        asyncio.run(capture_worker_main(conn, fanout_group))
+    except (BrokenPipeError, EOFError):
+        pass
+
+# starts the capture worker processes
+# must be called before the event loop and any thread is started as the workers are forked
+def start_capture_workers(count):
+    context = multiprocessing.get_context("fork")
+    fanout_group = os.getpid() & 0xFFFF
+    workers = []
+
+    for index in range(count):
+        reader, writer = context.Pipe(duplex=False)
+        process = context.Process(target=run_capture_worker, args=(index, writer, fanout_group), name=f"pokiestream-capture-{index}", daemon=True)
+        process.start()
+        # only the worker writes to the pipe, closing our end lets the reader notice when the worker exits
+        writer.close()
+        workers.append((index, process, reader))
+
+    return workers
+
+# reads the event batches of a capture worker into the local queue
+# the overload policy of the queue is applied here, so the workers never wait for a slow plugin (except with block)
+def receive_events(index, conn):
+    while True:
+        try:
+            events = conn.recv()
+        except EOFError:
+            print(f"Capture worker {index} exited.")
+            return
+
+        if isinstance(events, dict):
+            metrics.merge_worker(index, events)
+            continue
+
+        for data in events:
+            put_data_to_queue(data)
+
+# starts a receiver thread for every capture worker
+def receive_from_capture_workers(workers):
+    for index, _, reader in workers:
+        threading.Thread(target=receive_events, args=(index, reader), daemon=True).start()
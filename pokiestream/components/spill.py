@@ -0,0 +1,188 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from pokiestream.components.codec import decode, encode
+
+# Disk spill of a queue.
+# The events are appended to memory-mapped segment files of a fixed size in the compact binary encoding of the codec,
+# and read back in the same order. Fully read segments are deleted, so the disk usage is at most max_bytes.
+#
+# Every record is checksummed and the read position is stored in the header of the segment, so the events which were
+# not read yet are replayed after a restart, even if PokieStream crashed in the middle of writing a record.
+
+MAGIC = b"PKSP"
+VERSION = 1
+# magic, version, read offset
+segment_header = struct.Struct("<4sHxxQ")
+# length, crc32 of the encoded event
+record_header = struct.Struct("<II")
+
+SEGMENT_SUFFIX = ".seg"
+
+class Segment:
+    def __init__(self, path, size=None):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        try:
+            if size is not None:
+                # a new segment, the file is sparse until it is written
+                os.ftruncate(fd, size)
+            self.size = os.fstat(fd).st_size
+            self.map = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+
+        if size is not None:
+            segment_header.pack_into(self.map, 0, MAGIC, VERSION, segment_header.size)
+            self.read_offset = segment_header.size
+            self.write_offset = segment_header.size
+            self.count = 0
+            return
+
+        magic, version, self.read_offset = segment_header.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.map.close()
+            raise ValueError(f"{path} is not a PokieStream spill segment")
+        self.write_offset, self.count = self.scan()
+
+    # finds the end of the valid records of an existing segment and counts the unread ones
+    # a record which was not written completely (zero length or wrong checksum) ends the segment
+    def scan(self):
+        offset = segment_header.size
+        count = 0
+        while offset + record_header.size <= self.size:
+            length, checksum = record_header.unpack_from(self.map, offset)
+            start = offset + record_header.size
+            if not length or start + length > self.size or zlib.crc32(self.map[start:start + length]) != checksum:
+                break
+            if offset >= self.read_offset:
+                count += 1
+            offset = start + length
+        return offset, count
+
+    # returns False if the segment has no room for the record
+    def append(self, data):
+        offset = self.write_offset
+        start = offset + record_header.size
+        end = start + len(data)
+        if end > self.size:
+            return False
+
+        # the header is written last, a partially written record is never read
+        self.map[start:end] = data
+        record_header.pack_into(self.map, offset, len(data), zlib.crc32(data))
+        self.write_offset = end
+        self.count += 1
+        return True
+
+    # returns the next unread record
+    def read(self):
+        offset = self.read_offset
+        length = record_header.unpack_from(self.map, offset)[0]
+        start = offset + record_header.size
+        self.read_offset = start + length
+        self.count -= 1
+        return self.map[start:start + length]
+
+    # stores the read position, the records before it are not replayed after a restart
+    def commit(self):
+        segment_header.pack_into(self.map, 0, MAGIC, VERSION, self.read_offset)
+
+    def remove(self):
+        self.map.close()
+        os.unlink(self.path)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+
+# The spill files of a queue in a directory, the segments are read in the order of their sequence numbers.
+class Spill:
+    def __init__(self, directory, segment_size, max_bytes):
+        self.directory = directory
+        # a single segment never exceeds max_bytes
+        self.segment_size = min(segment_size, max_bytes)
+        self.max_segments = max_bytes // self.segment_size
+        # the producer and the drain task both work on the segments
+        self.lock = threading.Lock()
+        self.segments = []
+        # the segment which is written, the segments left from a previous run are only read
+        self.tail = None
+        self.pending = 0
+        self.next_sequence = 0
+
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            path = os.path.join(directory, name)
+            self.next_sequence = max(self.next_sequence, int(name[:-len(SEGMENT_SUFFIX)]) + 1)
+            segment = Segment(path)
+            if segment.count:
+                self.segments.append(segment)
+                self.pending += segment.count
+            else:
+                segment.remove()
+
+    def __len__(self):
+        return self.pending
+
+    # the disk space used by the segments
+    def size(self):
+        return sum(segment.size for segment in self.segments)
+
+    # appends an event, returns False if the spill is full
+    # must be called with the lock held
+    def append(self, event):
+        data = encode(event)
+        tail = self.tail
+        if tail is None or not tail.append(data):
+            if len(self.segments) >= self.max_segments:
+                return False
+            tail = Segment(os.path.join(self.directory, f"{self.next_sequence:012d}{SEGMENT_SUFFIX}"), self.segment_size)
+            self.next_sequence += 1
+            self.segments.append(tail)
+            self.tail = tail
+            if not tail.append(data):
+                # the event is larger than a segment
+                return False
+
+        self.pending += 1
+        return True
+
+    # returns at most `count` events in the order they were appended
+    # must be called with the lock held
+    def read(self, count):
+        events = []
+        while self.segments and len(events) < count:
+            segment = self.segments[0]
+            while segment.count and len(events) < count:
+                events.append(decode(segment.read()))
+
+            if segment.count:
+                segment.commit()
+                continue
+
+            # the segment is fully read
+            self.segments.pop(0)
+            if segment is self.tail:
+                self.tail = None
+            segment.remove()
+
+        self.pending -= len(events)
+        return events
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments:
+                if segment.count:
+                    segment.commit()
+                segment.close()
+            self.segments = []
+            self.tail = None
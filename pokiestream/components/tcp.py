@@ -1,105 +1,133 @@
 # SPDX-License-Identifier: AGPL-3.0
 # Copyright (C) 2025  FXTELEKOM
 
-from pokiestream.components.queue import queues
-import time
-import heapq
-import uuid6
-from datetime import datetime, timezone
-from threading import Lock
+from pokiestream.components.queue import put_data_to_queue
+from pokiestream.components.config import config
+from pokiestream.components.clock import clock
+from pokiestream.components.metrics import metrics
+from pokiestream.components.event import Event
+from pokiestream.components.sessions import ShardedSessionManager, TCPSession, count_packet, flow_payload, pack_canonical_key_int, session_ids, unpack_key_int
+from pokiestream.components.match import matcher, match_host
+from pokiestream.components.payload import Inspection, PAYLOAD_KEYS
 import asyncio
 
-def put_data_to_queue(data, name='log_queue'):
-    if data:
-        queues[name].sync_q.put(data)
-
-class TCPSessionManager:
-    def __init__(self, session_timeout=60):
-        self.sessions = {} 
-        self.expiration_heap = []
-        self.lock = Lock()
-        self.cleanup_lock = asyncio.Lock()
+# builds the event of a session, the initiator of the connection is always the source
+def session_event(key, sess, state):
+    version, src, src_port, dst, dst_port = unpack_key_int(key)
+    if not sess.forward:
+        src, src_port, dst, dst_port = dst, dst_port, src, src_port
+    return Event(version, src, dst, src_port, dst_port, 6, "TCP", state, clock.time_ns(), sess.session_id, flow_payload(sess, sess.payload))
+
+class TCPSessionManager(ShardedSessionManager):
+    # inspect_ports maps the destination ports whose client data is inspected to the payload filter ("tls" or "http"),
+    # only the first inspect_bytes bytes of the client data are inspected
+    # session_timeout is the inactivity timeout of a session, active_timeout the interval of the interim flow records (0 disables them)
+    def __init__(self, session_timeout=60, shards=16, max_sessions=0, eviction="oldest", max_expire_per_tick=100000, inspect_ports=None, inspect_bytes=4096, active_timeout=0):
+        super().__init__(shards, max_sessions, eviction, max_expire_per_tick)
         self.session_timeout = session_timeout
-
-    def _create_canonical_id(self, src_ip, src_port, dst_ip, dst_port):
-        return (src_ip, src_port, dst_ip, dst_port) if (src_ip, src_port) < (dst_ip, dst_port) else (dst_ip, dst_port, src_ip, src_port)
-
-    def track_session_sync(self, src_ip, src_port, dst_ip, dst_port, flags):
-        now = time.time()
-        conn_key = self._create_canonical_id(src_ip, src_port, dst_ip, dst_port)
-        session_id = None
-
-        with self.lock:
-            sess = self.sessions.get(conn_key)
+        self.inspect_ports = inspect_ports or {}
+        self.inspect_bytes = inspect_bytes
+        self.active_timeout = active_timeout
+
+    # the addresses are the integers of the given IP version, length is the size of the IP packet
+    # segment returns the sequence number and the payload of the packet, it is only called for inspected sessions
+    # a SYN only creates a session if create is set, the packets of the responder only update it
+    # returns the new state of the session (or None), the session id, the payload of the event and whether the packet is a reply
+    def track_session_sync(self, version, src, src_port, dst, dst_port, flags, segment=None, length=0, create=True):
+        now = clock.time()
+        conn_key, forward = pack_canonical_key_int(version, src, src_port, dst, dst_port)
+        shard = self.shard(conn_key)
+
+        with shard.lock:
+            sess = shard.sessions.get(conn_key)
 
             if flags & 0x02 and not (flags & 0x10):
+                if sess is not None:
+                    # a retransmitted SYN
+                    count_packet(sess, forward, length, now)
+                    return None, None, None, forward != sess.forward
+                if not create:
+                    return None, None, None, False
+
+                inspect = None
+                kind = self.inspect_ports.get(dst_port)
+                if kind is not None and segment is not None:
+                    inspect = Inspection(kind, segment()[0], self.inspect_bytes)
+
+                session_id = session_ids.next()
+                sess = TCPSession(session_id, forward, now, now + self.session_timeout, inspect, length, now + self.active_timeout if self.active_timeout else None)
+                evicted = shard.sessions.add(conn_key, sess)
+                if evicted is not None:
+                    shard.timers.cancel(*evicted)
+                shard.timers.schedule(conn_key, sess, now)
+
+            else:
                 if sess is None:
-                    session_id = str(uuid6.uuid7())
-                    self.sessions[conn_key] = {
-                        "session_id": session_id,
-                        "initiator": (src_ip, src_port),
-                        "state": "NEW",
-                        "expiration": now + self.session_timeout
-                    }
-                    heapq.heappush(self.expiration_heap, (now + self.session_timeout, conn_key))
-                    return "NEW", session_id
-
-                return None, None
-
-            if sess and sess["state"] == "NEW":
-                if (src_ip, src_port) != sess["initiator"]:
-                    sess["state"] = "ESTABLISHED"
-                    sess["expiration"] = now + self.session_timeout
-                    heapq.heappush(self.expiration_heap, (sess["expiration"], conn_key))
-                    return "ESTABLISHED", sess["session_id"]
-
-            if sess and (flags & 0x01):
-                session_id = sess["session_id"]
-                del self.sessions[conn_key]
-                return "CLOSE", session_id
-
-            if sess and (flags & 0x04):
-                session_id = sess["session_id"]
-                del self.sessions[conn_key]
-                return "ABORT", session_id
-
-            return None, None
-
-    async def cleanup_sessions(self):
-        now = time.time()
-        expired_sessions = []
-
-        async with self.cleanup_lock:
-            with self.lock:
-                while self.expiration_heap and self.expiration_heap[0][0] <= now:
-                    expiry_time, conn_key = heapq.heappop(self.expiration_heap)
-                    if conn_key in self.sessions and self.sessions[conn_key]["expiration"] == expiry_time:
-                        expired_sessions.append((conn_key, self.sessions.pop(conn_key)))
-
-        for key, sess in expired_sessions:
-            src_ip, src_port, dst_ip, dst_port = key
-            data = {"src_ip": src_ip, "dst_ip": dst_ip, "src_port": src_port, "dst_port": dst_port, "protocol_num": 6, "protocol_name": "TCP", "state": "EXPIRED", "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f"), "session_id": sess["session_id"], "payload": None }
-            put_data_to_queue(data, name='log_queue')
-
-    # Cleanup expired sessions
-    async def cleanup_sessions(self):
-        now = time.time()
-        expired_sessions = []
-
-        async with self.cleanup_lock:
-            with self.lock:
-                while self.expiration_heap and self.expiration_heap[0][0] <= now:
-                    expiry_time, key = heapq.heappop(self.expiration_heap)
-                    if key in self.sessions and self.sessions[key]["expiration"] == expiry_time:
-                        expired_sessions.append((key, self.sessions.pop(key)))
-
-        for key, sess in expired_sessions:
-            src_ip, src_port, dst_ip, dst_port = key
-            data = {"src_ip": src_ip, "dst_ip": dst_ip, "src_port": src_port, "dst_port": dst_port, "protocol_num": 6, "protocol_name": "TCP", "state": "EXPIRED", "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f"), "session_id": sess["session_id"], "payload": None}
-            put_data_to_queue(data, name='log_queue')
-
-
-tcp_session_manager = TCPSessionManager()
+                    return None, None, None, False
+
+                reply = forward != sess.forward
+                count_packet(sess, forward, length, now)
+                # every packet keeps the session alive, the timer is rescheduled lazily when it is reached
+                sess.expiration = now + self.session_timeout
+
+                if sess.state == "NEW" and reply:
+                    sess.state = "ESTABLISHED"
+                    return "ESTABLISHED", sess.session_id, sess.payload, reply
+
+                if flags & 0x01:
+                    shard.sessions.pop(conn_key)
+                    shard.timers.cancel(conn_key, sess)
+                    return "CLOSE", sess.session_id, flow_payload(sess, sess.payload), reply
+
+                if flags & 0x04:
+                    shard.sessions.pop(conn_key)
+                    shard.timers.cancel(conn_key, sess)
+                    return "ABORT", sess.session_id, flow_payload(sess, sess.payload), reply
+
+                # the client data is only looked at until the inspection ends
+                if sess.inspect is not None and not reply and segment is not None:
+                    state, session_id, payload = self.inspect(sess, *segment())
+                    if state is not None:
+                        return state, session_id, payload, reply
+
+                # an active session reports its counters every active_timeout seconds
+                if sess.report_at is not None and now >= sess.report_at:
+                    sess.report_at = now + self.active_timeout
+                    return "INTERIM", sess.session_id, flow_payload(sess, sess.payload), reply
+
+                return None, None, None, reply
+
+        # the evicted session is reported outside of the lock
+        if evicted is not None:
+            put_data_to_queue(session_event(*evicted, "EVICTED"))
+
+        return "NEW", session_id, None, False
+
+    # adds a client segment to the inspection of the session, the buffer is freed as soon as there is a result
+    def inspect(self, sess, seq, payload):
+        inspection = sess.inspect
+        result = inspection.add(seq, payload)
+        if result is None:
+            return None, None, None
+
+        sess.inspect = None
+        if result and match_host(result, inspection.kind):
+            sess.payload = {PAYLOAD_KEYS[inspection.kind]: result}
+            return "INSPECTED", sess.session_id, sess.payload
+        return None, None, None
+
+    def expired(self, key, sess):
+        put_data_to_queue(session_event(key, sess, "EXPIRED"), name='log_queue')
+
+
+tcp_session_manager = TCPSessionManager(
+    shards=config.sessions.shards, max_sessions=config.sessions.max_sessions, eviction=config.sessions.eviction, max_expire_per_tick=config.sessions.max_expire_per_tick,
+    inspect_ports=matcher.inspect_ports, inspect_bytes=matcher.inspect_bytes, active_timeout=config.sessions.active_timeout
+)
+
+metrics.gauge("pokiestream_sessions", "Tracked sessions", lambda: len(tcp_session_manager), {"protocol": "tcp"})
+metrics.gauge("pokiestream_sessions_expired_total", "Sessions expired after their timeout", lambda: tcp_session_manager.expired_total, {"protocol": "tcp"}, kind="counter")
+metrics.gauge("pokiestream_sessions_evicted_total", "Sessions evicted because of the session limit", tcp_session_manager.evicted, {"protocol": "tcp"}, kind="counter")
 
 # Start cleanup task
 async def start_cleanup_task():
@@ -0,0 +1,158 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import math
+
+# Hierarchical timing wheel used to expire the UDP and TCP sessions.
+#
+# Every level has `slots` slots, a slot of level 0 covers one tick (`resolution` seconds),
+# a slot of level N covers slots^N ticks. An entry is placed on the lowest level which can hold its deadline,
+# when the wheel reaches the slot of a higher level, its entries are moved (cascaded) down to the lower levels.
+#
+# Entries are the session records themselves, they must have an `expiration` and a `timer` attribute.
+# Every key is in the wheel at most once, `timer` points to the slot which holds it so it can be removed in O(1).
+# Refreshing a session only moves its `expiration` later, the entry is rescheduled lazily when its slot is reached,
+# so there are no stale entries and refreshing costs nothing.
+class TimingWheel:
+    def __init__(self, resolution=1.0, slots=64, levels=4):
+        self.resolution = resolution
+        self.bits = slots.bit_length() - 1
+        if 1 << self.bits != slots:
+            raise ValueError("The number of timing wheel slots must be a power of two.")
+
+        self.mask = slots - 1
+        self.levels = [[{} for _ in range(slots)] for _ in range(levels)]
+        # the furthest a deadline can be scheduled, later deadlines are rescheduled when they are reached
+        self.span = (1 << (self.bits * levels)) - 1
+        # the last tick which was processed
+        self.current = None
+        # the slots which are due but were not processed yet because of the work limit
+        self.due = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    # True if advance(now) has due entries left to process
+    def behind(self, now):
+        return bool(self.count) and (any(self.due) or self.current < math.floor(now / self.resolution))
+
+    def tick_of(self, deadline):
+        return math.ceil(deadline / self.resolution)
+
+    # the tick must not be earlier than the current one
+    def insert(self, key, entry, tick):
+        delta = min(tick - self.current, self.span)
+        level = 0
+        while delta >> (self.bits * (level + 1)):
+            level += 1
+
+        if delta == self.span:
+            tick = self.current + self.span
+
+        slot = self.levels[level][(tick >> (self.bits * level)) & self.mask]
+        slot[key] = entry
+        entry.timer = slot
+
+    # adds an entry to the wheel, it expires at entry.expiration
+    def schedule(self, key, entry, now):
+        tick = self.tick_of(entry.expiration)
+        if self.current is None:
+            self.current = math.floor(now / self.resolution)
+
+        # the current slot was already processed, so the earliest is the next tick
+        self.insert(key, entry, max(tick, self.current + 1))
+        self.count += 1
+
+    # removes an entry from the wheel
+    def cancel(self, key, entry):
+        if entry.timer is not None:
+            del entry.timer[key]
+            entry.timer = None
+            self.count -= 1
+
+    # moves the entries of a higher level slot to the lower levels
+    def cascade(self, level):
+        index = (self.current >> (self.bits * level)) & self.mask
+        slot = self.levels[level][index]
+        if not slot:
+            return
+
+        self.levels[level][index] = {}
+        for key, entry in slot.items():
+            self.insert(key, entry, max(self.tick_of(entry.expiration), self.current))
+
+    # steps the wheel by one tick, the entries of the reached level 0 slot become due
+    def step(self):
+        self.current += 1
+        level = 0
+        while level + 1 < len(self.levels) and not self.current & ((1 << (self.bits * (level + 1))) - 1):
+            level += 1
+
+        # the higher levels are cascaded first, as their entries may land in the lower level slots reached now
+        while level:
+            self.cascade(level)
+            level -= 1
+
+        index = self.current & self.mask
+        slot = self.levels[0][index]
+        if slot:
+            self.levels[0][index] = {}
+            self.due.append(slot)
+
+    # Jumps over the ticks where nothing can happen, but not further than `last`.
+    # The next thing to do is either reaching a non-empty level 0 slot, or cascading the first non-empty level.
+    def skip(self, last):
+        slots = self.levels[0]
+        tick = self.current + 1
+        boundary = ((self.current >> self.bits) + 1) << self.bits
+        while tick < boundary and tick <= last and not slots[tick & self.mask]:
+            tick += 1
+
+        if tick == boundary and not any(slots):
+            level = 1
+            while level + 1 < len(self.levels) and not any(self.levels[level]):
+                level += 1
+            tick = ((self.current >> (self.bits * level)) + 1) << (self.bits * level)
+
+        self.current = max(self.current, min(tick - 1, last))
+
+    # Advances the wheel to `now` and returns the expired (key, entry) pairs.
+    # At most `limit` due entries are processed (0 means no limit), the rest is processed by the next calls.
+    # The expired entries are removed from the wheel, refreshed entries are rescheduled.
+    def advance(self, now, limit=0):
+        target = math.floor(now / self.resolution)
+        if self.current is None or not self.count:
+            # there is nothing to expire, no need to walk the empty slots
+            if self.current is None or target > self.current:
+                self.current = target
+            self.due.clear()
+            return []
+
+        pending = sum(len(slot) for slot in self.due)
+        while self.current < target and (not limit or pending < limit):
+            self.skip(target - 1)
+            waiting = len(self.due)
+            self.step()
+            if len(self.due) > waiting:
+                pending += len(self.due[-1])
+
+        expired = []
+        due = self.due
+        work = 0
+        while due and (not limit or work < limit):
+            slot = due[0]
+            if not slot:
+                due.pop(0)
+                continue
+
+            work += 1
+            key, entry = slot.popitem()
+            if entry.expiration > now:
+                self.insert(key, entry, max(self.tick_of(entry.expiration), self.current + 1))
+            else:
+                entry.timer = None
+                self.count -= 1
+                expired.append((key, entry))
+
+        return expired
@@ -1,76 +1,83 @@
 # SPDX-License-Identifier: AGPL-3.0
 # Copyright (C) 2025  FXTELEKOM
 
-from pokiestream.components.queue import queues
-from datetime import datetime, timezone
-import time
-import heapq
-import threading
+from pokiestream.components.queue import put_data_to_queue
+from pokiestream.components.config import config
+from pokiestream.components.clock import clock
+from pokiestream.components.metrics import metrics
+from pokiestream.components.event import Event
+from pokiestream.components.sessions import ShardedSessionManager, UDPSession, count_packet, flow_payload, pack_canonical_key_int, session_ids, unpack_key_int
 import asyncio
-import uuid6
 
 UDP_IDLE_TIMEOUT = 120
 UDP_DNS_TIMEOUT = 30
 
-def put_data_to_queue(data, name='log_queue'):
-    if data:
-        queues[name].sync_q.put(data)
+# builds the event of a session, the initiator of the session is always the source
+def session_event(key, sess, state):
+    version, src, src_port, dst, dst_port = unpack_key_int(key)
+    if not sess.forward:
+        src, src_port, dst, dst_port = dst, dst_port, src, src_port
+    return Event(version, src, dst, src_port, dst_port, 17, "UDP", state, clock.time_ns(), sess.session_id, flow_payload(sess))
 
 # UDP session manager to track UDP sessions and handle expiration based on idle timeout
-class UDPSessionManager:
-    def __init__(self):
-        self.sessions = {}
-        self.expiration_heap = []
-        self.lock = threading.Lock()  
-        self.cleanup_lock = asyncio.Lock() 
+# the packets of both directions belong to the same session, active_timeout is the interval of the interim flow records (0 disables them)
+class UDPSessionManager(ShardedSessionManager):
+    def __init__(self, shards=16, max_sessions=0, eviction="oldest", max_expire_per_tick=100000, active_timeout=0):
+        super().__init__(shards, max_sessions, eviction, max_expire_per_tick)
+        self.active_timeout = active_timeout
 
     # Track a new UDP session or update an existing one
-    def track_session_sync(self, src_ip, src_port, dst_ip, dst_port):
-        now = time.time()
-        key = (src_ip, src_port, dst_ip, dst_port)
-        expiration_time = now + (UDP_DNS_TIMEOUT if dst_port == 53 else UDP_IDLE_TIMEOUT)
+    # the addresses are the integers of the given IP version, length is the size of the IP packet
+    # a packet only creates a session if create is set, the replies of the responder only update it
+    # returns the new state of the session (or None), the session id, the payload of the event and whether the packet is a reply
+    def track_session_sync(self, version, src, src_port, dst, dst_port, length=0, create=True):
+        now = clock.time()
+        key, forward = pack_canonical_key_int(version, src, src_port, dst, dst_port)
+        shard = self.shard(key)
 
-        with self.lock:
-            if key not in self.sessions:
-                connection_uuid = str(uuid6.uuid7())
-                self.sessions[key] = {
-                    "first_seen": now,
-                    "last_seen": now,
-                    "packets": 1,
-                    "session_id": connection_uuid,
-                    "expiration": expiration_time
-                }
-                heapq.heappush(self.expiration_heap, (expiration_time, key))
-                return "NEW", connection_uuid
+        with shard.lock:
+            sess = shard.sessions.get(key)
+            if sess is None:
+                if not create:
+                    return None, None, None, False
+                session_id = session_ids.next()
+                expiration_time = now + (UDP_DNS_TIMEOUT if dst_port == 53 else UDP_IDLE_TIMEOUT)
+                sess = UDPSession(session_id, forward, now, expiration_time, length, now + self.active_timeout if self.active_timeout else None)
+                evicted = shard.sessions.add(key, sess)
+                if evicted is not None:
+                    shard.timers.cancel(*evicted)
+                shard.timers.schedule(key, sess, now)
             else:
-                sess = self.sessions[key]
-                sess["last_seen"] = now
-                sess["packets"] += 1
-                sess["expiration"] = expiration_time
-                return None, sess["session_id"]
+                # the expiration only moves later, the timer is rescheduled lazily when it is reached
+                reply = forward != sess.forward
+                count_packet(sess, forward, length, now)
+                server_port = src_port if reply else dst_port
+                sess.expiration = now + (UDP_DNS_TIMEOUT if server_port == 53 else UDP_IDLE_TIMEOUT)
 
-    # Cleanup expired sessions
-    async def cleanup_sessions(self):
-        now = time.time()
-        expired_sessions = []
+                # an active session reports its counters every active_timeout seconds
+                if sess.report_at is not None and now >= sess.report_at:
+                    sess.report_at = now + self.active_timeout
+                    return "INTERIM", sess.session_id, flow_payload(sess), reply
+                return None, sess.session_id, None, reply
 
-        async with self.cleanup_lock:
-            with self.lock:  
-                while self.expiration_heap and self.expiration_heap[0][0] <= now:
-                    expiry_time, key = heapq.heappop(self.expiration_heap)
-                    if key in self.sessions and self.sessions[key]["expiration"] == expiry_time:
-                        expired_sessions.append((key, self.sessions.pop(key)))
+        # the evicted session is reported outside of the lock
+        if evicted is not None:
+            put_data_to_queue(session_event(*evicted, "EVICTED"))
 
-        for key, sess in expired_sessions:
-            src_ip, src_port, dst_ip, dst_port = key
-            data = {"src_ip": src_ip, "dst_ip": dst_ip, "src_port": src_port, "dst_port": dst_port, "protocol_num": 17, "protocol_name": "UDP", "state": "EXPIRED", "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f"), "session_id": sess["session_id"], "payload": None }
-            put_data_to_queue(data, name='log_queue')
+        return "NEW", session_id, None, False
 
+    def expired(self, key, sess):
+        put_data_to_queue(session_event(key, sess, "EXPIRED"), name='log_queue')
 
-udp_session_manager = UDPSessionManager()
+
+udp_session_manager = UDPSessionManager(config.sessions.shards, config.sessions.max_sessions, config.sessions.eviction, config.sessions.max_expire_per_tick, config.sessions.active_timeout)
+
+metrics.gauge("pokiestream_sessions", "Tracked sessions", lambda: len(udp_session_manager), {"protocol": "udp"})
+metrics.gauge("pokiestream_sessions_expired_total", "Sessions expired after their timeout", lambda: udp_session_manager.expired_total, {"protocol": "udp"}, kind="counter")
+metrics.gauge("pokiestream_sessions_evicted_total", "Sessions evicted because of the session limit", udp_session_manager.evicted, {"protocol": "udp"}, kind="counter")
 
 # Start the cleanup task
 async def start_cleanup_task():
     while True:
         await udp_session_manager.cleanup_sessions()
-        await asyncio.sleep(1)
\ No newline at end of file
+        await asyncio.sleep(1)
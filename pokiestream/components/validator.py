@@ -4,6 +4,7 @@
 from types import SimpleNamespace
 import ipaddress
 import os
+import re
 
 def is_valid_cidr(cidr):
     try:
@@ -15,6 +16,21 @@ def is_valid_cidr(cidr):
 def is_valid_plugin_path(path):
     return isinstance(path, str) and os.path.isfile(path) and (path.endswith(".py") or path.endswith(".lua"))
 
+# the name of a sink names its queue, its metrics and its spill directory
+SINK_NAME = re.compile(r"[A-Za-z0-9_.-]{1,64}\Z")
+
+# returns the name of a sink of the plugin list, it defaults to the file name of the plugin without the extension
+def sink_name(sink):
+    if sink.get("name"):
+        return sink["name"]
+    path = sink.get("path")
+    return os.path.splitext(os.path.basename(path))[0] if isinstance(path, str) and path else "stdout"
+
+def to_namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: to_namespace(v) for k, v in value.items()})
+    return value
+
 
 def validate_config(config):
     errors = []
@@ -24,6 +40,9 @@ def validate_config(config):
         def err(msg):
             errors.append(rules.get("message", msg))
 
+        if "deprecated" in rules:
+            warnings.append(rules["deprecated"])
+
         if value is None or (isinstance(value, dict) and not value) or (isinstance(value, SimpleNamespace) and not value.__dict__) or (isinstance(value, list) and not value):
             if rules.get("optional", False):
                 warnings.append(f"{path} is set but empty, ignored.")
@@ -72,17 +91,155 @@ def validate_config(config):
                 err(f"{path} contains an invalid value type. Expected a number within range {rules['range'][0]}–{rules['range'][1]}.")
 
     rules = {
-        "plugin": {"type": dict, "optional": True},
+        # a single sink or a list of sinks, the sinks of the list have the same settings as the single one
+        "plugin": {
+            "item_type": dict, "optional": True,
+            "validator": lambda v: isinstance(v, dict),
+            "message": "Plugin must be a mapping or a list of mappings (one per sink)."
+        },
+        "plugin.name": {
+            "type": str, "optional": True,
+            "validator": SINK_NAME.match,
+            "message": "Plugin name must be 1 to 64 letters, digits, dots, dashes or underscores."
+        },
         "plugin.path": {
             "type": str, "optional": True,
             "validator": is_valid_plugin_path,
             "message": "Plugin path must be a valid existing .py or .lua file."
         },
         "plugin.pass_config": {"type": bool, "optional": True},
+        "plugin.workers": {
+            "type": int, "range": (1, 1024), "optional": True,
+            "message": "Plugin workers must be an integer between 1 and 1024."
+        },
+        "plugin.runtimes": {
+            "type": int, "range": (1, 64), "optional": True,
+            "message": "Plugin runtimes must be an integer between 1 and 64."
+        },
+        "plugin.processes": {
+            "type": int, "range": (0, 256), "optional": True,
+            "message": "Plugin processes must be an integer between 0 and 256."
+        },
+        "plugin.process": {"type": dict, "optional": True},
+        "plugin.process.ring_size": {
+            "type": int, "range": (65536, 1 << 32), "optional": True,
+            "message": "Plugin process ring_size must be an integer between 65536 and 4294967296 bytes."
+        },
+        "plugin.process.timeout": {
+            "type": int, "range": (1, 86400), "optional": True,
+            "message": "Plugin process timeout must be an integer between 1 and 86400 seconds."
+        },
+        "plugin.ordered_sessions": {"type": bool, "optional": True},
+        "plugin.batch": {"type": dict, "optional": True},
+        "plugin.batch.max_size": {
+            "type": int, "range": (1, 1000000), "optional": True,
+            "message": "Plugin batch max_size must be an integer between 1 and 1000000."
+        },
+        "plugin.batch.max_linger": {
+            "type": int, "range": (0, 60000), "optional": True,
+            "message": "Plugin batch max_linger must be an integer between 0 and 60000 milliseconds."
+        },
 
         "iface": {"type": str},
         "queue_size": {"type": int, "optional": True},
 
+        "overload": {"type": dict, "optional": True},
+        "overload.policy": {
+            "type": str, "optional": True,
+            "validator": lambda v: v in ("block", "drop_newest", "drop_oldest", "sample", "priority", "spill"),
+            "message": "Overload policy must be one of: block, drop_newest, drop_oldest, sample, priority, spill."
+        },
+        "overload.high_watermark": {
+            "optional": True,
+            "validator": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool) and 0 < v <= 1,
+            "message": "Overload high_watermark must be a number between 0 and 1 (share of queue_size)."
+        },
+        "overload.low_watermark": {
+            "optional": True,
+            "validator": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool) and 0 <= v < 1,
+            "message": "Overload low_watermark must be a number between 0 and 1 (share of queue_size), lower than high_watermark."
+        },
+        "overload.sample_rate": {
+            "optional": True,
+            "validator": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool) and 0 <= v <= 1,
+            "message": "Overload sample_rate must be a number between 0 and 1."
+        },
+        "overload.spill": {"type": dict, "optional": True},
+        "overload.spill.path": {"type": str, "optional": True},
+        "overload.spill.segment_size": {
+            "type": int, "range": (65536, 1073741824), "optional": True,
+            "message": "Overload spill segment_size must be an integer between 65536 and 1073741824 bytes."
+        },
+        "overload.spill.max_bytes": {
+            "type": int, "range": (65536, 1 << 50), "optional": True,
+            "message": "Overload spill max_bytes must be an integer of at least 65536 bytes."
+        },
+
+        "capture": {"type": dict, "optional": True},
+        "capture.backend": {
+            "type": str, "optional": True,
+            "validator": lambda v: v in ("scapy", "tpacket_v3"),
+            "message": "Capture backend must be one of: scapy, tpacket_v3."
+        },
+        "capture.workers": {
+            "type": int, "range": (1, 256), "optional": True,
+            "message": "Capture workers must be an integer between 1 and 256."
+        },
+        "capture.stats_interval": {"type": int, "range": (0, 86400), "optional": True},
+        "capture.ring": {"type": dict, "optional": True},
+        "capture.ring.block_size": {
+            "type": int, "optional": True,
+            "validator": lambda v: v >= 4096 and v % 4096 == 0,
+            "message": "Capture ring block_size must be a multiple of 4096."
+        },
+        "capture.ring.block_count": {"type": int, "range": (1, 65536), "optional": True},
+        "capture.ring.frame_size": {
+            "type": int, "optional": True,
+            "validator": lambda v: v >= 64 and v % 16 == 0,
+            "message": "Capture ring frame_size must be a multiple of 16."
+        },
+        "capture.ring.block_timeout": {"type": int, "range": (1, 60000), "optional": True},
+        "capture.decoder": {
+            "type": str, "optional": True,
+            "validator": lambda v: v in ("scapy", "raw"),
+            "message": "Capture decoder must be one of: scapy, raw."
+        },
+
+        "sessions": {"type": dict, "optional": True},
+        "sessions.shards": {
+            "type": int, "range": (1, 4096), "optional": True,
+            "message": "Sessions shards must be an integer between 1 and 4096."
+        },
+        "sessions.max_sessions": {
+            "type": int, "range": (0, 1000000000), "optional": True,
+            "message": "Sessions max_sessions must be a non-negative integer (0 means unlimited)."
+        },
+        "sessions.eviction": {
+            "type": str, "optional": True,
+            "validator": lambda v: v in ("oldest", "lru"),
+            "message": "Sessions eviction must be one of: oldest, lru."
+        },
+        "sessions.max_expire_per_tick": {
+            "type": int, "range": (1, 100000000), "optional": True,
+            "message": "Sessions max_expire_per_tick must be a positive integer."
+        },
+        "sessions.active_timeout": {
+            "type": int, "range": (0, 86400), "optional": True,
+            "message": "Sessions active_timeout must be an integer between 0 and 86400 seconds (0 disables the interim flow records)."
+        },
+
+        "metrics": {"type": dict, "optional": True},
+        "metrics.enabled": {"type": bool, "optional": True},
+        "metrics.host": {"type": str, "optional": True},
+        "metrics.port": {
+            "type": int, "range": (1, 65535), "optional": True,
+            "message": "Metrics port must be an integer between 1 and 65535."
+        },
+        "metrics.log_interval": {
+            "type": int, "range": (0, 86400), "optional": True,
+            "message": "Metrics log_interval must be an integer between 0 and 86400 seconds (0 disables the log)."
+        },
+
         "filter": {"type": dict, "optional": True},
         "filter.source": {
             "item_type": str, "optional": True,
@@ -108,6 +265,10 @@ def validate_config(config):
             "type": str, "optional": True,
             "message": "Filter scapy must be a valid scapy filter expression."
         },
+        "filter.kernel": {
+            "type": bool, "optional": True,
+            "message": "Filter kernel must be a boolean value."
+        },
         "filter.strict": {
             "type": bool, "optional": True,
             "message": "Filter strict must be a boolean value."
@@ -129,13 +290,65 @@ def validate_config(config):
             "validator": lambda v: isinstance(v, str) and len(v) > 0,
             "message": "DNS match entries must be non-empty strings."
         },
+        "filter.payload.dns.match_file": {
+            "type": str, "optional": True,
+            "validator": os.path.isfile,
+            "message": "DNS match_file must be the path of an existing file."
+        },
+
+        "filter.payload.tls": {"type": dict, "optional": True},
+        "filter.payload.tls.enabled": {"type": bool, "optional": True},
+        "filter.payload.tls.ports": {
+            "item_type": int, "range": (0, 65535),
+            "optional": True,
+            "message": "TLS ports must be integers between 0 and 65535."
+        },
+        "filter.payload.tls.match": {
+            "item_type": str,
+            "optional": True,
+            "validator": lambda v: isinstance(v, str) and len(v) > 0,
+            "message": "TLS match entries must be non-empty strings."
+        },
+        "filter.payload.tls.match_file": {
+            "type": str, "optional": True,
+            "validator": os.path.isfile,
+            "message": "TLS match_file must be the path of an existing file."
+        },
+
+        "filter.payload.http": {"type": dict, "optional": True},
+        "filter.payload.http.enabled": {"type": bool, "optional": True},
+        "filter.payload.http.ports": {
+            "item_type": int, "range": (0, 65535),
+            "optional": True,
+            "message": "HTTP ports must be integers between 0 and 65535."
+        },
+        "filter.payload.http.match": {
+            "item_type": str,
+            "optional": True,
+            "validator": lambda v: isinstance(v, str) and len(v) > 0,
+            "message": "HTTP match entries must be non-empty strings."
+        },
+        "filter.payload.http.match_file": {
+            "type": str, "optional": True,
+            "validator": os.path.isfile,
+            "message": "HTTP match_file must be the path of an existing file."
+        },
+        "filter.payload.inspect_bytes": {
+            "type": int, "range": (64, 65536), "optional": True,
+            "message": "Filter payload inspect_bytes must be an integer between 64 and 65536."
+        },
 
         "NOT_RECOMMENDED": {"type": dict, "optional": True},
         "NOT_RECOMMENDED.bypass_polling_delay": {
-            "type": bool, "optional": True
+            "type": bool, "optional": True,
+            "deprecated": "NOT_RECOMMENDED.bypass_polling_delay is deprecated and has no effect, the queue is no longer polled."
         }
     }
 
+    # the queue settings of a sink override the global ones, they have the same rules
+    for path in [path for path in rules if path == "queue_size" or path.startswith("overload")]:
+        rules["plugin." + path] = rules[path]
+
     def recurse(namespace, current_path=""):
         for key, value in namespace.__dict__.items():
             path = f"{current_path}.{key}" if current_path else key
@@ -147,6 +360,22 @@ def validate_config(config):
                     validate_field(path, value, rule)
 
     recurse(config)
+
+    sinks = getattr(config, "plugin", None)
+    if isinstance(sinks, list):
+        names = set()
+        for sink in sinks:
+            if not isinstance(sink, dict):
+                continue
+            recurse(to_namespace(sink), "plugin")
+            name = sink_name(sink)
+            # an explicit name is checked by its rule, a name taken from the file name may still be invalid
+            if not sink.get("name") and not SINK_NAME.match(name):
+                errors.append(f"Plugin sink name {name} taken from the file name is invalid, set a name of letters, digits, dots, dashes or underscores.")
+            elif name in names:
+                errors.append(f"Plugin sink name {name} is used more than once, set a unique name for every sink.")
+            names.add(name)
+
     return errors, warnings
 
 def config_validation(config):
@@ -0,0 +1,21 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import os
+import sys
+import tempfile
+
+# PokieStream reads its config when the components are imported,
+# so the tests write a minimal config and point the argument parser at it before anything is imported.
+TEST_CONFIG = """
+config:
+  iface: "lo"
+  filter:
+    strict: False
+"""
+
+handle, path = tempfile.mkstemp(suffix=".yml", prefix="pokiestream-test-")
+with os.fdopen(handle, "w") as f:
+    f.write(TEST_CONFIG)
+sys.argv = [sys.argv[0], "-c", path]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
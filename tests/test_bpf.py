@@ -0,0 +1,200 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import ctypes
+import ctypes.util
+import itertools
+import random
+
+import pytest
+from scapy.layers.inet import ICMP, IP, TCP, UDP
+from scapy.layers.inet6 import ICMPv6DestUnreach, ICMPv6EchoReply, ICMPv6EchoRequest, IPv6
+from scapy.error import Scapy_Exception
+from scapy.layers.l2 import Dot1Q, Ether
+
+from pokiestream.components.config import DEFAULTS, dtn, merge_defaults
+from pokiestream.components.decoder import PROTO_ICMP, PROTO_ICMPV6, PROTO_TCP, PROTO_UDP, decode_frame
+from pokiestream.components.match import FilterMatcher, bpf_expression, combine_bpf
+
+def filter_matcher(**settings):
+    return FilterMatcher(dtn(merge_defaults(DEFAULTS["filter"], settings)))
+
+# the expression which lets the IPv6 packets with extension headers through
+IPV6_EXTENSION_HEADERS = "(ip6 and (ip6[6] == 0 or ip6[6] == 43 or ip6[6] == 44 or ip6[6] == 51 or ip6[6] == 60))"
+ICMP_ECHO = "icmp or (icmp6 and (ip6[40] == 128 or ip6[40] == 129))"
+
+# The expressions are checked as strings first, these tests run without libpcap.
+
+def test_no_filter_passes_the_enabled_protocols():
+    assert bpf_expression(filter_matcher(), vlan=False) == f"(udp or tcp or {ICMP_ECHO} or {IPV6_EXTENSION_HEADERS})"
+    assert bpf_expression(filter_matcher(protocol=["tcp"]), vlan=False) == f"(tcp or {IPV6_EXTENSION_HEADERS})"
+
+# the replies come from the destination port and go back to the source network
+def test_replies_pass_in_the_reverse_direction():
+    expression = bpf_expression(filter_matcher(source=["10.0.0.0/8"], port=[53], protocol=["udp"]), vlan=False)
+    forward = f"(((src net 10.0.0.0/8)) and ((udp and (dst port 53)) or {IPV6_EXTENSION_HEADERS}))"
+    reply = f"(((dst net 10.0.0.0/8)) and ((udp and (src port 53)) or {IPV6_EXTENSION_HEADERS}))"
+    assert expression == f"({forward} or {reply})"
+
+# ICMP has no sessions, so there is no reply direction for it
+def test_icmp_has_no_reply_direction():
+    expression = bpf_expression(filter_matcher(source=["2001:db8::/32"], protocol=["icmp"]), vlan=False)
+    assert expression == f"(((src net 2001:db8::/32)) and ({ICMP_ECHO} or {IPV6_EXTENSION_HEADERS}))"
+
+def test_strict_filter_with_an_empty_side_passes_nothing():
+    expression = bpf_expression(filter_matcher(strict=True, source=["10.0.0.0/8"], protocol=["udp"]), vlan=False)
+    assert expression == f"(((ip and not ip) and (udp or {IPV6_EXTENSION_HEADERS})) or ((ip and not ip) and (udp or {IPV6_EXTENSION_HEADERS})))"
+
+# the IPv6 packets with extension headers only go through the host filter, not through the protocol and port filter
+def test_ipv6_extension_headers_only_go_through_the_host_filter():
+    expression = bpf_expression(filter_matcher(strict=True, source=["2001:db8::/32"], destination=["2001:db8:ffff::/48"], port=[80], protocol=["tcp"]), vlan=False)
+    forward = f"(((src net 2001:db8::/32) and (dst net 2001:db8:ffff::/48)) and ((tcp and (dst port 80)) or {IPV6_EXTENSION_HEADERS}))"
+    reply = f"(((dst net 2001:db8::/32) and (src net 2001:db8:ffff::/48)) and ((tcp and (src port 80)) or {IPV6_EXTENSION_HEADERS}))"
+    assert expression == f"({forward} or {reply})"
+
+# the whole expression is repeated behind a VLAN tag
+def test_vlan_repeats_the_expression():
+    matcher = filter_matcher(source=["10.0.0.0/8"], port=[53, 443])
+    expression = bpf_expression(matcher, vlan=False)
+    assert bpf_expression(matcher) == f"({expression} or (vlan and {expression}))"
+
+def test_combined_with_the_user_expression():
+    assert combine_bpf(None, "udp") == "udp"
+    assert combine_bpf("", "udp") == "udp"
+    assert combine_bpf("not port 5353 or port 53", "(udp or tcp)") == "(not port 5353 or port 53) and (udp or tcp)"
+
+# The expression of the filter section is compiled by libpcap (the same way the capture does it) and run over synthetic
+# frames, its verdict is compared with the verdict of the matcher on the decoded frame.
+try:
+    from scapy.arch.common import compile_filter
+    compile_filter("ip", linktype=1)
+    libpcap = ctypes.CDLL(ctypes.util.find_library("pcap"))
+    libpcap.bpf_filter.restype = ctypes.c_uint
+except (ImportError, OSError):
+    libpcap = None
+
+requires_libpcap = pytest.mark.skipif(libpcap is None, reason="libpcap is not available")
+
+# the link type of ethernet frames
+DLT_EN10MB = 1
+
+def kernel_passes(program, frame):
+    if program is None:
+        return False
+    return libpcap.bpf_filter(program.bf_insns, frame, len(frame), len(frame)) != 0
+
+# returns the matcher of the filter settings and its compiled expression
+# libpcap refuses an expression which rejects every packet, the program is None then (the capture filters in userspace)
+def compile_matcher(**settings):
+    matcher = filter_matcher(**settings)
+    try:
+        program = compile_filter(bpf_expression(matcher), linktype=DLT_EN10MB)
+    except Scapy_Exception as e:
+        if "rejects all packets" not in str(e):
+            raise
+        program = None
+    return matcher, program
+
+# a UDP or TCP packet which may start a session
+def starts_session(matcher, enabled, version, src, dst, dst_port):
+    return enabled and matcher.match_hosts_int(version, src, dst) and matcher.match_port(dst_port)
+
+# The packets the matcher has a use for: the packets which may start a session, the replies of such sessions
+# (the reversed packet may start one) and the ICMP packets which pass the host filter.
+def matcher_passes(matcher, frame):
+    decoded = decode_frame(frame)
+    if decoded is None:
+        return False
+    version, src, dst, _, transport, src_port, dst_port = decoded[:7]
+    if transport is None:
+        return False
+    src = int.from_bytes(src, "big")
+    dst = int.from_bytes(dst, "big")
+
+    if transport == PROTO_UDP or transport == PROTO_TCP:
+        enabled = matcher.udp if transport == PROTO_UDP else matcher.tcp
+        return starts_session(matcher, enabled, version, src, dst, dst_port) or starts_session(matcher, enabled, version, dst, src, src_port)
+    if transport == PROTO_ICMP or transport == PROTO_ICMPV6:
+        return matcher.icmp and matcher.match_hosts_int(version, src, dst)
+    return False
+
+ADDRESSES = {
+    4: ["10.1.2.3", "10.255.0.1", "192.168.1.10", "192.168.2.1", "172.16.0.1", "8.8.8.8"],
+    6: ["2001:db8::1", "2001:db8:ffff::2", "2001:db9::1", "fd00::1", "::1"],
+}
+PORTS = [53, 80, 443, 5353, 40000]
+# fixed addresses, scapy would look them up otherwise
+ETHERNET = Ether(src="02:00:00:00:00:01", dst="02:00:00:00:00:02")
+
+# every combination of addresses, ports and protocols
+def frames():
+    for version, addresses in ADDRESSES.items():
+        ip = IP if version == 4 else IPv6
+        for src, dst in itertools.permutations(addresses, 2):
+            for sport, dport in itertools.product(PORTS, repeat=2):
+                yield ip(src=src, dst=dst) / UDP(sport=sport, dport=dport)
+                yield ip(src=src, dst=dst) / TCP(sport=sport, dport=dport, flags="S")
+            if version == 4:
+                yield IP(src=src, dst=dst) / ICMP()
+            else:
+                yield IPv6(src=src, dst=dst) / ICMPv6EchoRequest()
+                yield IPv6(src=src, dst=dst) / ICMPv6EchoReply()
+                yield IPv6(src=src, dst=dst) / ICMPv6DestUnreach()
+
+@pytest.fixture(scope="module")
+def sample():
+    rng = random.Random(1)
+    result = []
+    for packet in frames():
+        result.append(bytes(ETHERNET / packet))
+        # a sample of the packets behind a VLAN tag, every packet would make the test slow
+        if rng.random() < 0.1:
+            result.append(bytes(ETHERNET / Dot1Q(vlan=10) / packet))
+    return result
+
+FILTERS = {
+    "no filter": {},
+    "source": {"source": ["10.0.0.0/8", "2001:db8::/32"]},
+    "destination": {"destination": ["192.168.1.0/24", "2001:db8:ffff::/48"]},
+    "both": {"source": ["10.0.0.0/8"], "destination": ["192.168.0.0/16", "2001:db8::/32"]},
+    "strict": {"strict": True, "source": ["10.0.0.0/8", "2001:db8::/32"], "destination": ["192.168.0.0/16", "2001:db8:ffff::/48"]},
+    "strict one side": {"strict": True, "source": ["10.0.0.0/8"]},
+    "ports": {"port": [53, 443]},
+    "no ports": {"port": []},
+    "udp": {"protocol": ["udp"], "port": [53]},
+    "tcp and icmp": {"protocol": ["tcp", "icmp"], "source": ["10.0.0.0/8", "2001:db8::/32"]},
+    "icmp": {"protocol": ["icmp"]},
+    "strict ports": {"strict": True, "source": ["10.0.0.0/8"], "destination": ["192.168.1.0/24"], "port": [80, 5353], "protocol": ["udp", "tcp"]},
+}
+
+@requires_libpcap
+@pytest.mark.parametrize("name", FILTERS)
+def test_kernel_filter_matches_the_matcher(name, sample):
+    matcher, program = compile_matcher(**FILTERS[name])
+    mismatches = [
+        decode_frame(frame)[:7] for frame in sample
+        if kernel_passes(program, frame) != matcher_passes(matcher, frame)
+    ]
+    assert not mismatches, f"{len(mismatches)} frames, e.g. {mismatches[:3]}"
+
+@requires_libpcap
+def test_ipv6_extension_headers_pass_the_kernel_host_filter():
+    matcher, program = compile_matcher(strict=True, source=["2001:db8::/32"], destination=["2001:db8:ffff::/48"], port=[80], protocol=["tcp"])
+    # a hop-by-hop options header in front of a UDP header, the protocol and the port don't match
+    hop_by_hop = b"\x11\x00" + b"\x00" * 6
+    udp = bytes(UDP(sport=1, dport=2))
+    assert kernel_passes(program, bytes(ETHERNET / IPv6(src="2001:db8::1", dst="2001:db8:ffff::2", nh=0)) + hop_by_hop + udp)
+    assert not kernel_passes(program, bytes(ETHERNET / IPv6(src="2001:db9::1", dst="2001:db8:ffff::2", nh=0)) + hop_by_hop + udp)
+
+# the scapy expression of the user narrows the kernel filter down
+# (it is evaluated without a VLAN tag, just like on its own, so only the untagged frames are checked)
+@requires_libpcap
+def test_kernel_filter_combined_with_the_user_expression(sample):
+    matcher = filter_matcher(**FILTERS["source"])
+    program = compile_filter(combine_bpf("not port 5353", bpf_expression(matcher)), linktype=DLT_EN10MB)
+    for frame in sample:
+        decoded = decode_frame(frame)
+        if decoded[8] != 14:
+            continue
+        expected = matcher_passes(matcher, frame) and 5353 not in decoded[5:7]
+        assert kernel_passes(program, frame) == expected
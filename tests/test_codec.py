@@ -0,0 +1,23 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+from pokiestream.components.codec import decode, encode
+from pokiestream.components.event import Event
+
+EVENTS = [
+    Event(4, 0x0A000001, 0xC0A80101, 5353, 53, 17, "UDP", "NEW", 1700000000123456000, 0x01901234567870008000000000000001, {"dns": "example.com"}),
+    Event(6, 1, 2, None, None, 58, "ICMPv6", None, 1700000000000001000),
+    Event(None, None, None, None, None, None, None, "OVERLOAD", 1700000000000002000, None, {"queue": "log_queue", "policy": "spill", "depth": 10}),
+]
+
+def test_events_round_trip():
+    for event in EVENTS:
+        decoded = decode(encode(event))
+        assert type(decoded) is Event
+        assert decoded.to_dict() == event.to_dict()
+
+# the other values keep their types, the dicts of the plugins stay dicts
+def test_values_round_trip():
+    value = {"dns": "example.com", "ips": ["10.0.0.1", "::1"], "count": 1 << 70, "ratio": 0.5, "raw": b"\x00", "ok": True, "none": None}
+    assert decode(encode(value)) == value
+    assert decode(encode(EVENTS[0].to_dict())) == EVENTS[0].to_dict()
@@ -0,0 +1,66 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+from scapy.layers.dns import DNS, DNSQR
+
+from pokiestream.components.dns import DomainSet, parse_query_name
+
+def query(qname):
+    return bytes(DNS(id=1, rd=1, qd=DNSQR(qname=qname)))
+
+# the name is reported as it was sent, only the matching ignores the case
+def test_query_name_keeps_its_case():
+    assert parse_query_name(query("WWW.Example.com"), 0) == "WWW.Example.com"
+    assert parse_query_name(b"\x00" * 8 + query("a.b."), 8) == "a.b"
+    assert DomainSet(["Example.COM"]).match("EXAMPLE.com")
+    assert DomainSet(["*.Example.COM"]).match("www.EXAMPLE.com")
+    assert DomainSet(["EX?MPLE.com"]).match("exAmple.COM")
+
+# A query of the root has no labels. Its name is the empty string, as with the Scapy dissection before the raw parser,
+# so it is logged with an empty dns payload if every domain is logged, and matches no domain pattern.
+def test_root_query():
+    assert parse_query_name(query("."), 0) == ""
+    assert not DomainSet(["example.com", "*.org", "*"]).match("")
+
+def test_malformed_queries():
+    message = query("www.example.com")
+    # no question
+    assert parse_query_name(message[:4] + b"\x00\x00" + message[6:], 0) is None
+    # truncated in the header and in a label
+    assert parse_query_name(message[:10], 0) is None
+    assert parse_query_name(message[:20], 0) is None
+    # a compression pointer to itself
+    assert parse_query_name(message[:12] + b"\xc0\x0c", 0) is None
+    # a name longer than 255 bytes
+    assert parse_query_name(query(".".join(["a" * 60] * 5)), 0) is None
+
+def test_plain_and_wildcard_domains():
+    domains = DomainSet(["example.com", "*.wild.org"])
+    assert domains.match("example.com")
+    assert not domains.match("a.example.com")
+    assert domains.match("a.wild.org")
+    assert domains.match("a.b.wild.org")
+    assert not domains.match("wild.org")
+    assert not domains.match("com")
+
+def test_fnmatch_patterns():
+    domains = DomainSet(["ex?mple.net", "*shop.com"])
+    assert domains.match("exzmple.net")
+    assert domains.match("myshop.com")
+    assert not domains.match("example.org")
+
+# a name with an empty label must not reach the markers of the trie
+def test_empty_labels_do_not_match():
+    domains = DomainSet(["example.com", "*.wild.org"])
+    assert not domains.match("x..example.com")
+    assert not domains.match(".example.com")
+    assert not domains.match(".wild.org")
+    assert not domains.match("a..wild.org")
+    assert not domains.match("")
+
+# the markers of the trie can't be confused with a label
+def test_marker_like_labels():
+    domains = DomainSet(["*.example.com"])
+    assert not domains.match("*")
+    assert domains.match("*.example.com")
+    assert not DomainSet(["example.com"]).match("*.com")
@@ -0,0 +1,109 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import pytest
+from scapy.layers.dns import DNS, DNSQR
+from scapy.layers.inet import ICMP, IP, TCP, UDP, fragment
+from scapy.layers.inet6 import ICMPv6DestUnreach, ICMPv6EchoRequest, IPv6, IPv6ExtHdrFragment, IPv6ExtHdrHopByHop, fragment6
+from scapy.layers.l2 import Dot1Q, Ether
+from scapy.packet import Raw
+
+from pokiestream.components import match, packets
+from pokiestream.components.clock import clock
+from pokiestream.components.config import DEFAULTS, dtn, merge_defaults
+from pokiestream.components.match import FilterMatcher
+from pokiestream.components.tcp import TCPSessionManager
+from pokiestream.components.udp import UDPSessionManager
+
+# The raw decoder (inspect_raw) has to produce the very same packet logs as the Scapy dissection (inspect_packets).
+# Both paths are fed the same frames with fresh session managers and a fixed trace clock.
+
+FILTER = {"payload": {"dns": {"enabled": True, "ports": [53]}, "tls": {"enabled": True}, "http": {"enabled": True}}}
+# fixed addresses, scapy would look them up otherwise
+ETHERNET = Ether(src="02:00:00:00:00:01", dst="02:00:00:00:00:02")
+
+# the packets of a TCP connection from the client to the server, closed by close_flags
+def tcp_connection(ip, client, server, sport, dport, data=b"", close_flags="FA"):
+    forward = ip(src=client, dst=server)
+    backward = ip(src=server, dst=client)
+    packets = [
+        forward / TCP(sport=sport, dport=dport, flags="S", seq=1000),
+        backward / TCP(sport=dport, dport=sport, flags="SA", seq=5000, ack=1001),
+        forward / TCP(sport=sport, dport=dport, flags="A", seq=1001, ack=5001),
+    ]
+    if data:
+        packets.append(forward / TCP(sport=sport, dport=dport, flags="PA", seq=1001, ack=5001) / Raw(data))
+        packets.append(backward / TCP(sport=dport, dport=sport, flags="A", seq=5001, ack=1001 + len(data)))
+    packets.append(forward / TCP(sport=sport, dport=dport, flags=close_flags, seq=1001 + len(data), ack=5001))
+    return packets
+
+def traffic():
+    dns_query = DNS(id=1, rd=1, qd=DNSQR(qname="WWW.Example.com"))
+    packets = [
+        # DNS query and answer, a plain UDP session and its reply
+        IP(src="10.0.0.1", dst="10.0.0.53") / UDP(sport=40000, dport=53) / dns_query,
+        IP(src="10.0.0.53", dst="10.0.0.1") / UDP(sport=53, dport=40000) / DNS(id=1, qr=1, qd=DNSQR(qname="WWW.Example.com")),
+        IP(src="10.0.0.1", dst="192.0.2.10") / UDP(sport=40001, dport=123) / Raw(b"\x00" * 48),
+        IP(src="192.0.2.10", dst="10.0.0.1") / UDP(sport=123, dport=40001) / Raw(b"\x00" * 48),
+        IPv6(src="2001:db8::1", dst="2001:db8::53") / UDP(sport=40002, dport=53) / dns_query,
+        # a query of the root, the name is empty
+        IP(src="10.0.0.2", dst="10.0.0.53") / UDP(sport=40004, dport=53) / DNS(id=2, rd=1, qd=DNSQR(qname=".")),
+        # ICMP echo, ICMPv6 echo and an ICMPv6 error which is not reported
+        IP(src="10.0.0.1", dst="192.0.2.1") / ICMP(),
+        IPv6(src="2001:db8::1", dst="2001:db8::2") / ICMPv6EchoRequest(),
+        IPv6(src="2001:db8::1", dst="2001:db8::2") / ICMPv6DestUnreach(),
+        # IPv6 extension headers in front of the transport header
+        IPv6(src="2001:db8::1", dst="2001:db8::3") / IPv6ExtHdrHopByHop() / UDP(sport=40003, dport=5000) / Raw(b"data"),
+    ]
+    # NEW, ESTABLISHED, INSPECTED and CLOSE, and a connection which is aborted
+    packets += tcp_connection(IP, "10.0.0.1", "192.0.2.80", 40010, 80, b"GET / HTTP/1.1\r\nHost: Example.com\r\n\r\n")
+    packets += tcp_connection(IPv6, "2001:db8::1", "2001:db8::80", 40011, 8080, b"hello", close_flags="R")
+    # fragmented datagrams, only the first fragment has the UDP header
+    packets += fragment(IP(src="10.0.0.1", dst="192.0.2.20", id=7) / UDP(sport=40020, dport=4000) / Raw(b"x" * 3000), 1000)
+    packets += fragment6(IPv6(src="2001:db8::1", dst="2001:db8::20") / IPv6ExtHdrFragment(id=7) / UDP(sport=40021, dport=4000) / Raw(b"x" * 3000), 1280)
+
+    frames = [bytes(ETHERNET / packet) for packet in packets]
+    # the same packets behind a VLAN tag
+    frames += [bytes(ETHERNET / Dot1Q(vlan=10) / packet) for packet in packets]
+    return frames
+
+# returns the packet logs of the frames, the session ids are numbered in the order of their first appearance
+# (the trace clock makes the timestamps and the durations of both runs the same)
+def packet_logs(monkeypatch, inspect, frames):
+    logs = []
+    matcher = FilterMatcher(dtn(merge_defaults(DEFAULTS["filter"], FILTER)))
+    monkeypatch.setattr(packets, "matcher", matcher)
+    monkeypatch.setattr(match, "matcher", matcher)
+    monkeypatch.setattr(packets, "udp_session_manager", UDPSessionManager())
+    monkeypatch.setattr(packets, "tcp_session_manager", TCPSessionManager(inspect_ports=matcher.inspect_ports))
+    monkeypatch.setattr(packets, "put_data_to_queue", logs.append)
+    monkeypatch.setattr(clock, "trace_time_us", None)
+
+    for index, frame in enumerate(frames):
+        clock.advance(1700000000 + index / 1000)
+        inspect(frame)
+
+    session_ids = {}
+    result = []
+    for event in logs:
+        packet_log = event.to_dict()
+        if packet_log["session_id"] is not None:
+            packet_log["session_id"] = session_ids.setdefault(packet_log["session_id"], len(session_ids))
+        result.append(packet_log)
+    return result
+
+@pytest.fixture(scope="module")
+def frames():
+    return traffic()
+
+def test_raw_decoder_matches_scapy(monkeypatch, frames):
+    raw = packet_logs(monkeypatch, packets.inspect_raw, frames)
+    dissected = packet_logs(monkeypatch, lambda frame: packets.inspect_packets(Ether(frame)), frames)
+    assert raw == dissected
+
+    # the traffic covers every kind of packet log
+    states = {packet_log["state"] for packet_log in raw}
+    assert states == {"NEW", "ESTABLISHED", "INSPECTED", "CLOSE", "ABORT", None}
+    # the queried name keeps its case
+    payloads = [packet_log["payload"] for packet_log in raw]
+    assert {"dns": "WWW.Example.com"} in payloads and {"dns": ""} in payloads
@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+from pokiestream.components.plugin_process import load_python_receivers
+
+load_python_receivers(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "plain.py"))
+plain = sys.modules["plain"]
+
+# A stub of the system resolver: answers from a dict, records the lookups and how many of them ran at the same time.
+# The lookups wait for `release` if it is given.
+class StubLookup:
+    def __init__(self, names=None, release=None):
+        self.names = names or {}
+        self.release = release
+        self.calls = []
+        self.running = 0
+        self.most_running = 0
+
+    async def __call__(self, ip):
+        self.calls.append(ip)
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        try:
+            if self.release is not None:
+                await self.release.wait()
+            else:
+                await asyncio.sleep(0)
+            return self.names.get(ip)
+        finally:
+            self.running -= 1
+
+def test_cache_evicts_the_least_recently_used():
+    async def run():
+        lookup = StubLookup({"10.0.0.1": "a", "10.0.0.2": "b", "10.0.0.3": "c"})
+        resolver = plain.Resolver(lookup, size=2)
+        assert await resolver.resolve("10.0.0.1", 1) == "a"
+        assert await resolver.resolve("10.0.0.2", 1) == "b"
+        # a hit makes 10.0.0.1 the most recently used, 10.0.0.2 is evicted by the next address
+        assert await resolver.resolve("10.0.0.1", 1) == "a"
+        assert await resolver.resolve("10.0.0.3", 1) == "c"
+        assert list(resolver.cache) == ["10.0.0.1", "10.0.0.3"]
+        assert await resolver.resolve("10.0.0.2", 1) == "b"
+        assert lookup.calls == ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.2"]
+    asyncio.run(run())
+
+def test_failed_lookups_expire_after_the_negative_ttl():
+    async def run():
+        lookup = StubLookup({"10.0.0.1": "a"})
+        resolver = plain.Resolver(lookup, ttl=10, negative_ttl=0.05)
+        assert await resolver.resolve("10.0.0.1", 1) == "a"
+        assert await resolver.resolve("10.0.0.9", 1) is None
+        assert await resolver.resolve("10.0.0.9", 1) is None
+        assert lookup.calls == ["10.0.0.1", "10.0.0.9"]
+
+        await asyncio.sleep(0.1)
+        assert await resolver.resolve("10.0.0.1", 1) == "a"
+        assert await resolver.resolve("10.0.0.9", 1) is None
+        assert lookup.calls == ["10.0.0.1", "10.0.0.9", "10.0.0.9"]
+    asyncio.run(run())
+
+def test_concurrent_lookups_of_an_address_are_coalesced():
+    async def run():
+        release = asyncio.Event()
+        lookup = StubLookup({"10.0.0.1": "a"}, release)
+        resolver = plain.Resolver(lookup)
+        waiting = [asyncio.ensure_future(resolver.resolve("10.0.0.1", 1)) for _ in range(10)]
+        await asyncio.sleep(0.01)
+        release.set()
+        assert await asyncio.gather(*waiting) == ["a"] * 10
+        assert lookup.calls == ["10.0.0.1"]
+    asyncio.run(run())
+
+# a lookup which takes longer than the timeout returns None, its result is cached once it arrives
+def test_timeout_keeps_the_lookup_running():
+    async def run():
+        release = asyncio.Event()
+        resolver = plain.Resolver(StubLookup({"10.0.0.1": "a"}, release))
+        assert await resolver.resolve("10.0.0.1", 0.01) is None
+        release.set()
+        await asyncio.sleep(0.01)
+        assert resolver.cached("10.0.0.1") == (True, "a")
+    asyncio.run(run())
+
+def test_lookups_are_capped():
+    async def run():
+        release = asyncio.Event()
+        lookup = StubLookup(release=release)
+        resolver = plain.Resolver(lookup, max_lookups=3, max_pending=5)
+        tasks = [resolver.start(f"10.0.0.{index}") for index in range(10)]
+        await asyncio.sleep(0.01)
+
+        # 5 addresses are pending, 3 of them are looked up, the others are not looked up at all
+        assert sum(task is not None for task in tasks) == 5
+        assert len(lookup.calls) == 3
+        assert await resolver.resolve("10.0.0.9", 1) is None
+        release.set()
+        await asyncio.gather(*(task for task in tasks if task is not None))
+        assert lookup.most_running == 3
+        assert len(lookup.calls) == 5
+        assert not resolver.pending
+    asyncio.run(run())
+
+# the settings of the plain section are applied to the resolver, its lookup function is kept
+def test_configure_keeps_the_lookup():
+    lookup = StubLookup()
+    previous = plain.resolver
+    plain.resolver = plain.Resolver(lookup)
+    try:
+        plain.configure(SimpleNamespace(plain=SimpleNamespace(cache_size=5, max_lookups=2, max_pending=7)))
+        assert plain.resolver.lookup is lookup
+        assert (plain.resolver.size, plain.resolver.max_lookups, plain.resolver.max_pending) == (5, 2, 7)
+    finally:
+        plain.resolver = previous
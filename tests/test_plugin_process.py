@@ -0,0 +1,94 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from pokiestream.components.event import Event
+from pokiestream.components.plugin import PluginProcess
+from pokiestream.components.plugin_process import Ring, decode_records, encode_records
+
+EVENTS = [
+    Event(4, 0x0A000001, 0xC0A80101, 5353, 53, 17, "UDP", "NEW", 1700000000123456000, 0x01901234567870008000000000000001, {"dns": "Example.com"}),
+    Event(6, 1, 2, None, None, 58, "ICMPv6", None, 1700000000000001000),
+    Event(None, None, None, None, None, None, None, "RECOVERED", 1700000000000002000, None, {"queue": "log_queue", "policy": "spill", "dropped": 10, "duration": 1.5}),
+]
+
+@pytest.fixture
+def ring():
+    ring = Ring(100)
+    yield ring
+    ring.close()
+
+def write(ring, length):
+    offset = ring.reserve(length)
+    assert offset is not None
+    ring.write(offset, bytes([length]) * length)
+    return offset
+
+def test_empty_ring(ring):
+    assert ring.reserve(100) == 0
+    assert ring.reserve(101) is None
+
+# the batches are written one after the other and wrap around once the oldest ones were released
+def test_ring_wraps_around(ring):
+    assert write(ring, 40) == 0
+    assert write(ring, 40) == 40
+    # neither at the end nor in front of the oldest batch
+    assert ring.reserve(40) is None
+    assert ring.reserve(21) is None
+
+    ring.release()
+    # wraps around into the space of the released batch
+    assert write(ring, 30) == 0
+    assert ring.reserve(10) == 30
+    # the batch would overwrite the oldest one (40..80)
+    assert ring.reserve(11) is None
+
+    ring.release()
+    assert write(ring, 70) == 30
+    assert ring.map[0:30] == bytes([30]) * 30 and ring.map[30:100] == bytes([70]) * 70
+    assert ring.reserve(1) is None
+
+    ring.release()
+    ring.release()
+    # an empty ring starts at the beginning again
+    assert ring.reserve(100) == 0
+
+def test_ring_reset(ring):
+    write(ring, 60)
+    ring.reset()
+    assert ring.reserve(100) == 0
+
+def test_records_round_trip():
+    buf = encode_records(EVENTS)
+    decoded = decode_records(buf)
+    assert [event.to_dict() for event in decoded] == [event.to_dict() for event in EVENTS]
+    assert decode_records(encode_records([])) == []
+
+# the worker decodes the batches from a slice of the ring
+def test_records_round_trip_through_the_ring():
+    ring = Ring(1 << 16)
+    first = encode_records(EVENTS[:1])
+    second = encode_records(EVENTS[1:])
+    ring.write(ring.reserve(len(first)), first)
+    offset = ring.reserve(len(second))
+    ring.write(offset, second)
+    assert [event.to_dict() for event in decode_records(ring.map[offset:offset + len(second)])] == [event.to_dict() for event in EVENTS[1:]]
+    ring.close()
+
+# a batch doesn't wait forever for a process which can't load the plugin
+def test_send_fails_if_the_process_does_not_come_back():
+    async def run():
+        settings = SimpleNamespace(process=SimpleNamespace(ring_size=1 << 16, timeout=0.05))
+        process = PluginProcess(SimpleNamespace(settings=settings, suffix=""), 0)
+        process.error = "The plugin process failed to load the plugin: boom"
+        try:
+            with pytest.raises(RuntimeError, match="did not come back within 0.05 seconds: .*boom"):
+                await process.send(EVENTS)
+        finally:
+            process.ring.close()
+
+    asyncio.run(run())
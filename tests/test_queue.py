@@ -0,0 +1,150 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import asyncio
+from types import SimpleNamespace
+
+import culsans as janus
+
+from pokiestream.components import queue
+from pokiestream.components.config import config
+from pokiestream.components.event import Event
+from pokiestream.components.queue import SAMPLE_SPACE, Overload, flow_hash
+from pokiestream.components.spill import Spill
+
+# the events are told apart by their session id
+def event(index, state="NEW"):
+    return Event(4, 0x0A000000 + index, 0x0A0000FF, 40000 + index, 53, 17, "UDP", state, index, index)
+
+# an overloaded queue of `size` events, overloaded at 80% and recovered at 50%
+def overload(name, policy, size=10, sample_rate=0.5, spill=None):
+    sync_q = janus.Queue(maxsize=size).sync_q
+    return Overload(name, sync_q, policy, size, 0.8, 0.5, sample_rate, spill)
+
+# takes `count` events from the queue (all by default), the state events are returned as their state
+def take(sync_q, count=None):
+    items = []
+    while sync_q.qsize() and (count is None or len(items) < count):
+        data = sync_q.get_nowait()
+        sync_q.task_done()
+        items.append(data.state if data.state in ("OVERLOAD", "RECOVERED") else data.session)
+    return items
+
+def put_all(state, indices, status="NEW"):
+    for index in indices:
+        state.put(event(index, status))
+
+def test_drop_newest():
+    state = overload("test_drop_newest", "drop_newest")
+    put_all(state, range(15))
+    # the OVERLOAD event is sent when the queue reaches the high watermark (8 events), the rest is dropped once it is full
+    assert take(state.sync_q) == [0, 1, 2, 3, 4, 5, 6, 7, "OVERLOAD", 8]
+    assert state.dropped == 6 and state.dropped_total.value == 6
+
+    # the queue is empty, below the low watermark, so the next event ends the overload
+    state.put(event(15))
+    data = state.sync_q.get_nowait()
+    assert data.state == "RECOVERED"
+    assert data.payload["dropped"] == 6 and data.payload["policy"] == "drop_newest"
+    assert take(state.sync_q) == [15]
+    assert not state.active
+
+def test_drop_oldest():
+    state = overload("test_drop_oldest", "drop_oldest")
+    put_all(state, range(15))
+    # every event which doesn't fit pushes out the oldest one
+    assert take(state.sync_q) == [6, 7, "OVERLOAD", 8, 9, 10, 11, 12, 13, 14]
+    assert state.dropped == 6
+
+# while overloaded, every event of a sampled flow is kept and the other flows are dropped
+def test_sample():
+    state = overload("test_sample", "sample", size=1000, sample_rate=0.5)
+    put_all(state, range(800))
+    # the queue is at the high watermark, the next event starts the overload
+    put_all(state, range(1000, 1200))
+    put_all(state, range(1000, 1200), "CLOSE")
+    assert state.active
+
+    sampled = [index for index in range(1000, 1200) if flow_hash(event(index)) % SAMPLE_SPACE < state.sample_threshold]
+    assert 0 < len(sampled) < 200
+    assert take(state.sync_q) == list(range(800)) + ["OVERLOAD"] + sampled + sampled
+    assert state.dropped == 2 * (200 - len(sampled))
+
+# while overloaded only the lifecycle events are kept, until the queue drained to the low watermark
+def test_priority_and_watermark_hysteresis():
+    state = overload("test_priority", "priority", size=100)
+    put_all(state, range(80))
+    put_all(state, range(100, 105))
+    put_all(state, range(200, 204), "CLOSE")
+    put_all(state, range(300, 302), "EXPIRED")
+    assert state.active and state.dropped == 5
+
+    # below the high watermark, but above the low one: still overloaded
+    take(state.sync_q, 30)
+    state.put(event(400))
+    assert state.active and state.dropped == 6
+
+    # at the low watermark the overload ends and the NEW events are kept again
+    take(state.sync_q, 7)
+    state.put(event(401))
+    assert not state.active
+    assert take(state.sync_q, 50) == list(range(37, 80)) + ["OVERLOAD", 200, 201, 202, 203, 300, 301]
+    data = state.sync_q.get_nowait()
+    assert data.state == "RECOVERED" and data.payload["dropped"] == 6
+    assert take(state.sync_q) == [401]
+
+# the events are written to the disk while overloaded and delivered in their order once the consumer caught up
+def test_spill(tmp_path):
+    async def run():
+        spill = Spill(str(tmp_path / "spill"), 4096, 1 << 20)
+        async_queue = janus.Queue(maxsize=10)
+        state = Overload("test_spill", async_queue.sync_q, "spill", 10, 0.8, 0.5, 0.5, spill)
+        put_all(state, range(40))
+        assert len(spill) == 32 and state.dropped == 0
+        assert state.spilled_total.value == 32
+
+        drainer = asyncio.create_task(state.drain())
+        received = []
+        while "RECOVERED" not in received:
+            data = await asyncio.wait_for(async_queue.async_q.get(), 5)
+            async_queue.async_q.task_done()
+            received.append(data.state if data.state in ("OVERLOAD", "RECOVERED") else data.session)
+        drainer.cancel()
+        spill.close()
+        return received
+
+    assert asyncio.run(run()) == list(range(8)) + ["OVERLOAD"] + list(range(8, 40)) + ["RECOVERED"]
+
+# a spill which reached max_bytes drops the new events
+def test_full_spill_drops(tmp_path):
+    spill = Spill(str(tmp_path / "spill"), 1024, 1024)
+    state = overload("test_full_spill", "spill", spill=spill)
+    put_all(state, range(200))
+    assert 0 < len(spill) < 192
+    assert state.dropped == 200 - 8 - len(spill)
+    assert spill.size() <= 1024
+    spill.close()
+
+# a full queue with the block policy makes the producer wait, nothing is lost
+def test_block():
+    async def run():
+        await queue.create_queue("test_block", "block", SimpleNamespace(queue_size=4, overload=config.overload))
+        counter = queue.full_counters["test_block"]
+        async_q = queue.queues["test_block"].async_q
+        producer = asyncio.get_running_loop().run_in_executor(None, lambda: [queue.put_data_to_queue(event(index), "test_block") for index in range(10)])
+
+        # the producer waits for room
+        while not counter.value:
+            await asyncio.sleep(0.01)
+        assert async_q.qsize() == 4
+
+        received = []
+        for _ in range(10):
+            received.append((await asyncio.wait_for(async_q.get(), 5)).session)
+            async_q.task_done()
+        await producer
+        return received
+
+    assert asyncio.run(run()) == list(range(10))
+    assert "test_block" not in queue.overloads
+    assert queue.full_counters["test_block"].value >= 1
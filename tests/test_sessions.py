@@ -0,0 +1,93 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import random
+import uuid
+
+import pytest
+
+from pokiestream.components import sessions
+from pokiestream.components.sessions import SESSION_ID_COUNTER_MAX, SessionIdGenerator, SessionTable, pack_canonical_key_int, unpack_key_int
+
+ADDRESS_BITS = {4: 32, 6: 128}
+
+@pytest.mark.parametrize("version", (4, 6))
+def test_keys_round_trip(version):
+    rng = random.Random(version)
+    top = (1 << ADDRESS_BITS[version]) - 1
+    endpoints = [(0, 0), (top, 65535), (1, 1)] + [(rng.getrandbits(ADDRESS_BITS[version]), rng.randrange(65536)) for _ in range(200)]
+
+    for (src, src_port), (dst, dst_port) in zip(endpoints, reversed(endpoints)):
+        key, forward = pack_canonical_key_int(version, src, src_port, dst, dst_port)
+        reply_key, reply_forward = pack_canonical_key_int(version, dst, dst_port, src, src_port)
+        # both directions of a connection have the same key
+        assert key == reply_key
+        if (src, src_port) != (dst, dst_port):
+            assert forward != reply_forward
+
+        first, second = ((src, src_port), (dst, dst_port)) if forward else ((dst, dst_port), (src, src_port))
+        assert unpack_key_int(key) == (version, *first, *second)
+
+# an IPv4 key never equals an IPv6 key of the same numbers
+def test_ipv4_and_ipv6_keys_differ():
+    assert pack_canonical_key_int(4, 1, 2, 3, 4)[0] != pack_canonical_key_int(6, 1, 2, 3, 4)[0]
+    assert unpack_key_int(pack_canonical_key_int(6, 1, 2, 3, 4)[0])[0] == 6
+
+def test_session_id_layout():
+    generator = SessionIdGenerator(worker=5)
+    session_id = generator.next()
+    value = uuid.UUID(int=session_id)
+    assert value.version == 7
+    assert value.variant == uuid.RFC_4122
+    assert abs((session_id >> 80) - sessions.time.time_ns() // 1000000) < 1000
+    # the worker index is the byte after the variant
+    assert (session_id >> 54) & 0xFF == 5
+
+def test_worker_index_wraps():
+    generator = SessionIdGenerator()
+    generator.set_worker(300)
+    assert (generator.next() >> 54) & 0xFF == 300 % 256
+
+# the ids created in the same millisecond are told apart by the counter, an overflow borrows the next millisecond
+def test_session_ids_increase_within_a_millisecond(monkeypatch):
+    now_ms = 1700000000000
+    monkeypatch.setattr(sessions.time, "time_ns", lambda: now_ms * 1000000)
+    generator = SessionIdGenerator()
+
+    ids = [generator.next() for _ in range(SESSION_ID_COUNTER_MAX + 3)]
+    assert ids == sorted(set(ids))
+    assert [(session_id >> 64) & 0xFFF for session_id in ids[:3]] == [0, 1, 2]
+    assert {session_id >> 80 for session_id in ids[:SESSION_ID_COUNTER_MAX + 1]} == {now_ms}
+    assert [session_id >> 80 for session_id in ids[-2:]] == [now_ms + 1, now_ms + 1]
+
+    # the clock catches up with the borrowed millisecond
+    now_ms += 2
+    assert generator.next() >> 80 == now_ms and ids[-1] < generator.next()
+
+def fill(table):
+    for key in "abc":
+        assert table.add(key, key.upper()) is None
+    table.get("a")
+    table.get("b")
+
+def test_eviction_of_the_oldest_session():
+    table = SessionTable(max_sessions=3, eviction="oldest")
+    fill(table)
+    assert table.add("d", "D") == ("a", "A")
+    assert table.add("e", "E") == ("b", "B")
+    assert list(table.sessions) == ["c", "d", "e"]
+    assert table.evicted == 2
+
+def test_eviction_of_the_least_recently_used_session():
+    table = SessionTable(max_sessions=3, eviction="lru")
+    fill(table)
+    assert table.add("d", "D") == ("c", "C")
+    assert table.add("e", "E") == ("a", "A")
+    assert list(table.sessions) == ["b", "d", "e"]
+    assert table.evicted == 2
+
+def test_no_eviction_without_a_limit():
+    table = SessionTable()
+    for key in range(1000):
+        assert table.add(key, key) is None
+    assert len(table) == 1000 and table.evicted == 0
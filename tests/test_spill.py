@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import os
+
+from pokiestream.components.event import Event
+from pokiestream.components.spill import Spill, record_header
+
+def event(index):
+    return Event(4, 0x0A000000 + index, 0x0A0000FF, 40000, 53, 17, "UDP", "NEW", index, index, {"dns": f"{index}.example.com"})
+
+def append_all(spill, indices):
+    with spill.lock:
+        return [spill.append(event(index)) for index in indices]
+
+def read_all(spill, count=1000):
+    with spill.lock:
+        return [data.session for data in spill.read(count)]
+
+def disk_usage(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+def test_reads_come_back_in_order_across_segments(tmp_path):
+    spill = Spill(str(tmp_path), 1024, 1 << 20)
+    assert all(append_all(spill, range(200)))
+    assert len(spill) == 200 and len(spill.segments) > 5
+
+    received = []
+    while len(spill):
+        received += read_all(spill, 7)
+    assert received == list(range(200))
+    # the read segments are deleted
+    assert os.listdir(tmp_path) == []
+
+    # the spill is used again after it was emptied
+    assert all(append_all(spill, range(200, 210)))
+    assert read_all(spill) == list(range(200, 210))
+
+# the events which were not read are replayed after a crash, the committed read position is kept
+def test_reopen_after_an_unclean_stop(tmp_path):
+    spill = Spill(str(tmp_path), 1024, 1 << 20)
+    append_all(spill, range(100))
+    assert read_all(spill, 30) == list(range(30))
+    # no close(), the memory maps are written by the kernel like after a crash
+
+    reopened = Spill(str(tmp_path), 1024, 1 << 20)
+    assert len(reopened) == 70
+    append_all(reopened, range(100, 110))
+    assert read_all(reopened) == list(range(30, 110))
+    reopened.close()
+
+def test_reopen_after_close(tmp_path):
+    spill = Spill(str(tmp_path), 1024, 1 << 20)
+    append_all(spill, range(50))
+    read_all(spill, 5)
+    spill.close()
+
+    reopened = Spill(str(tmp_path), 1024, 1 << 20)
+    assert read_all(reopened) == list(range(5, 50))
+
+# returns the spill with the last of `count` records damaged by `damage(segment, offset)`
+def damaged_spill(directory, count, damage):
+    spill = Spill(directory, 1 << 16, 1 << 20)
+    append_all(spill, range(count - 1))
+    segment = spill.tail
+    offset = segment.write_offset
+    append_all(spill, [count - 1])
+    damage(segment, offset)
+    return spill
+
+# a record without its header (the header is written last) ends the segment
+def test_torn_record(tmp_path):
+    def tear(segment, offset):
+        segment.map[offset:offset + record_header.size] = bytes(record_header.size)
+    damaged_spill(str(tmp_path), 10, tear)
+
+    reopened = Spill(str(tmp_path), 1 << 16, 1 << 20)
+    assert len(reopened) == 9
+    # the new events are written to a new segment after the valid ones
+    append_all(reopened, [100])
+    assert read_all(reopened) == list(range(9)) + [100]
+
+def test_record_with_a_bad_checksum(tmp_path):
+    def corrupt(segment, offset):
+        segment.map[offset + record_header.size] ^= 0xFF
+    damaged_spill(str(tmp_path), 10, corrupt)
+
+    reopened = Spill(str(tmp_path), 1 << 16, 1 << 20)
+    assert read_all(reopened) == list(range(9))
+
+# the spill refuses the events beyond max_bytes and takes them again once segments were read
+def test_disk_usage_stays_within_max_bytes(tmp_path):
+    spill = Spill(str(tmp_path), 1024, 4096)
+    accepted = append_all(spill, range(500))
+    stored = accepted.index(False)
+    assert 0 < stored and not any(accepted[stored:])
+    assert spill.size() <= 4096 and disk_usage(tmp_path) <= 4096
+
+    assert read_all(spill, stored // 2) == list(range(stored // 2))
+    assert append_all(spill, [1000])[0]
+    assert disk_usage(tmp_path) <= 4096
+    assert read_all(spill) == list(range(stored // 2, stored)) + [1000]
+
+# a segment larger than max_bytes is shrunk to it
+def test_segment_size_is_capped_by_max_bytes(tmp_path):
+    spill = Spill(str(tmp_path), 1 << 20, 4096)
+    append_all(spill, range(500))
+    assert disk_usage(tmp_path) <= 4096
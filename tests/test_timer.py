@@ -0,0 +1,157 @@
+# SPDX-License-Identifier: AGPL-3.0
+# Copyright (C) 2025  FXTELEKOM
+
+import random
+
+import pytest
+
+from pokiestream.components.timer import TimingWheel
+
+# an entry of the wheel, like the session records
+class Entry:
+    __slots__ = ("expiration", "timer")
+
+    def __init__(self, expiration):
+        self.expiration = expiration
+        self.timer = None
+
+# a small wheel, so a few hundred ticks cross every level boundary and the span (4 ** 3 - 1 ticks)
+def small_wheel(resolution=1.0):
+    return TimingWheel(resolution, slots=4, levels=3)
+
+def expired_keys(wheel, now, limit=0):
+    return sorted(key for key, _ in wheel.advance(now, limit))
+
+def test_slots_must_be_a_power_of_two():
+    with pytest.raises(ValueError):
+        TimingWheel(slots=6)
+
+# every deadline expires at its tick, not one tick earlier, wherever it lands in the levels
+def test_deadlines_expire_on_time_across_the_levels():
+    for start in (0, 3, 15, 62):
+        for delay in range(1, 200):
+            wheel = small_wheel()
+            entry = Entry(start + delay)
+            wheel.advance(start)
+            wheel.schedule("key", entry, start)
+            for now in range(start + 1, start + delay):
+                assert wheel.advance(now) == [], (start, delay, now)
+            assert wheel.advance(start + delay) == [("key", entry)], (start, delay)
+            assert len(wheel) == 0 and entry.timer is None
+
+# deadlines between the ticks expire at the next tick, never before the deadline
+def test_fractional_deadlines():
+    wheel = small_wheel(resolution=0.5)
+    wheel.schedule("key", Entry(10.3), 0)
+    assert wheel.advance(10.29) == []
+    assert wheel.advance(10.49) == []
+    assert [key for key, _ in wheel.advance(10.5)] == ["key"]
+
+def test_cancel():
+    wheel = small_wheel()
+    entries = {key: Entry(key * 7) for key in range(1, 30)}
+    for key, entry in entries.items():
+        wheel.schedule(key, entry, 0)
+    for key in range(1, 30, 2):
+        wheel.cancel(key, entries[key])
+        # a second cancel does nothing
+        wheel.cancel(key, entries[key])
+    assert len(wheel) == 14
+    assert expired_keys(wheel, 1000) == list(range(2, 30, 2))
+
+# refreshing only moves the expiration, the entry is rescheduled once its old slot is reached
+def test_lazy_reschedule():
+    wheel = small_wheel()
+    entry = Entry(10)
+    wheel.schedule("key", entry, 0)
+    assert wheel.advance(9) == []
+    entry.expiration = 100
+    assert wheel.advance(10) == []
+    assert len(wheel) == 1 and entry.timer is not None
+    assert wheel.advance(99) == []
+    assert wheel.advance(100) == [("key", entry)]
+
+# deadlines beyond the span of the wheel are parked at its end and rescheduled from there
+def test_deadlines_beyond_the_span():
+    wheel = small_wheel()
+    entry = Entry(1000)
+    wheel.schedule("key", entry, 0)
+    for now in range(0, 1000, 37):
+        assert wheel.advance(now) == []
+    assert wheel.advance(999) == []
+    assert wheel.advance(1000) == [("key", entry)]
+
+# the empty stretches of the default wheel are skipped, a deadline millions of ticks ahead is reached at once
+def test_long_idle_stretch():
+    wheel = TimingWheel()
+    entry = Entry(10 ** 7)
+    wheel.schedule("key", entry, 0)
+    assert wheel.advance(10 ** 7 - 1) == []
+    assert wheel.advance(10 ** 7) == [("key", entry)]
+
+# with a limit, the due entries are processed over multiple calls and none is lost
+def test_advance_limit():
+    wheel = small_wheel()
+    for key in range(10):
+        wheel.schedule(key, Entry(5), 0)
+    for key in range(10, 15):
+        wheel.schedule(key, Entry(50), 0)
+
+    expired = []
+    calls = 0
+    while wheel.behind(60):
+        batch = wheel.advance(60, limit=3)
+        assert len(batch) <= 3
+        expired.extend(key for key, _ in batch)
+        calls += 1
+    assert sorted(expired) == list(range(15))
+    assert calls >= 5
+    assert len(wheel) == 0
+
+# Random schedules, refreshes, cancels and advances compared with a plain dict of deadlines.
+# The times are whole ticks, so an entry has to expire exactly when its deadline is reached.
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_a_naive_model(seed):
+    rng = random.Random(seed)
+    wheel = small_wheel()
+    entries = {}
+    model = {}
+    now = rng.randrange(0, 100)
+    next_key = 0
+
+    for _ in range(400):
+        action = rng.random()
+        if action < 0.4:
+            entry = Entry(now + rng.choice((1, 2, 3, 4, 5, 15, 16, 17, 63, 64, 65, rng.randrange(1, 300))))
+            wheel.schedule(next_key, entry, now)
+            entries[next_key] = entry
+            model[next_key] = entry.expiration
+            next_key += 1
+        elif action < 0.55 and model:
+            key = rng.choice(list(model))
+            entries[key].expiration += rng.randrange(1, 100)
+            model[key] = entries[key].expiration
+        elif action < 0.65 and model:
+            key = rng.choice(list(model))
+            wheel.cancel(key, entries[key])
+            del model[key]
+        else:
+            now += rng.choice((0, 1, 1, 2, 3, 16, 64, rng.randrange(0, 500)))
+            limit = rng.choice((0, 0, 1, 5))
+            expired = []
+            while True:
+                batch = wheel.advance(now, limit)
+                assert not limit or len(batch) <= limit
+                expired.extend(key for key, _ in batch)
+                if not wheel.behind(now) and not batch:
+                    break
+            assert sorted(expired) == sorted(key for key, deadline in model.items() if deadline <= now), now
+            for key in expired:
+                del model[key]
+        assert len(wheel) == len(model)
+
+    # everything left expires in the end
+    now += 10000
+    assert expired_keys(wheel, now) == sorted(model)
+    assert len(wheel) == 0
+    assert all(entry.timer is None for entry in entries.values())